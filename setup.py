@@ -22,10 +22,16 @@ setup (
        'bluepy',
        'pyyaml'
     ],
+    extras_require={
+        'numpy':['numpy']
+    },
     #packages=find_packages(exclude=['docs', 'tests*','res']),
     packages=['sphero_sprk'],
     package_data={
         'sphero_sprk':['data/*.yaml']
     },
     #include_package_data=True
+    entry_points={
+        'console_scripts':['sphero_sprk_bench=sphero_sprk.benchmark:main']
+    },
 )
\ No newline at end of file
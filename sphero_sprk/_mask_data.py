@@ -0,0 +1,22 @@
+# Generated from data/mask_list1.yaml and data/mask_list2.yaml by "python -m sphero_sprk.mask_schema", do not edit
+
+MASK_LIST1 = [{'name': 'accel_filtered',
+  'values': [{'mask': '0000 8000', 'name': 'x'},
+             {'mask': '0000 4000', 'name': 'y'},
+             {'mask': '0000 2000', 'name': 'z'}]},
+ {'name': 'gyro_filtered',
+  'values': [{'mask': '0000 1000', 'name': 'x'},
+             {'mask': '0000 0800', 'name': 'y'},
+             {'mask': '0000 0400', 'name': 'z'}]},
+ {'name': 'imu_filtered',
+  'values': [{'mask': '0004 0000', 'name': 'pitch'},
+             {'mask': '0002 0000', 'name': 'roll'},
+             {'mask': '0001 0000', 'name': 'yaw'}]}]
+
+MASK_LIST2 = [{'name': 'odometer',
+  'values': [{'mask': '0800 0000', 'name': 'x'},
+             {'mask': '0400 0000', 'name': 'y'}]},
+ {'name': 'accelone', 'values': [{'mask': '0200 0000', 'name': 'a'}]},
+ {'name': 'velocity',
+  'values': [{'mask': '0100 0000', 'name': 'x'},
+             {'mask': '0080 0000', 'name': 'y'}]}]
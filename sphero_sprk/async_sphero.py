@@ -0,0 +1,297 @@
+#!/usr/bin/python3
+
+import asyncio
+import collections
+
+from sphero_sprk.pipeline import tx_priority
+from sphero_sprk.sphero import Sphero
+from sphero_sprk.sphero_constants import CMD_CODES
+
+
+class AsyncSphero(object):
+    """
+    asyncio client of a Sphero, built on the packet handling of Sphero and DelegateObj.
+
+    The notifications are read on the event loop: with bluepy the file descriptor of bluepy-helper is
+    watched with loop.add_reader, peripherals without one (SimulatedSphero) are polled by a task.
+    No thread is kept per robot, only connect() runs the BLE handshake in the default executor.
+    Do not call start_pump() on the wrapped Sphero, the event loop is the only reader.
+
+    The loop never waits for the notification lock: when another thread holds it (a blocking call of the
+    wrapped Sphero) the read is tried again poll_interval seconds later.
+    """
+
+    #helper lines handled per readiness event at most, so one busy robot doesn't hold up the loop
+    READ_BATCH = 32
+
+    def __init__(self, addr=None, peripheral_factory=None, timeout=5.0, poll_interval=0.005):
+        '''
+        :param addr: (str) MAC address of the Sphero
+        :param peripheral_factory: (function) see Sphero
+        :param timeout: (float) seconds to wait for each attempt of a command without its own policy
+            (see CommandPolicy), the retries come from the policy of the command
+        :param poll_interval: (float) seconds between polls of peripherals without a file descriptor
+        '''
+        self.sphero = Sphero(addr, peripheral_factory=peripheral_factory)
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self._loop = None
+        self._reader_fd = None
+        self._poll_task = None
+        self._stream_events = set()
+        self.error = None
+
+    """ connection """
+
+    async def connect(self, timeout=5.0):
+        '''
+        Connect and start reading the notifications on the running event loop
+        :return: True
+        '''
+        self._loop = asyncio.get_running_loop()
+        await asyncio.wait_for(self._loop.run_in_executor(None, self.sphero.connect), timeout)
+        device = self.sphero._device
+        fd = AsyncSphero._helper_fd(device)
+        if fd is not None:
+            self._reader_fd = fd
+            self._loop.add_reader(fd, self._on_readable)
+        else:
+            self._poll_task = self._loop.create_task(self._poll())
+        return True
+
+    async def disconnect(self):
+        '''
+        Stop reading and disconnect, pending responses fail with ConnectionError
+        '''
+        self._stop_reading()
+        if self._poll_task is not None:
+            try:
+                await self._poll_task
+            except asyncio.CancelledError:
+                pass
+            self._poll_task = None
+        self.sphero.disconnect()
+
+    @staticmethod
+    def _helper_fd(device):
+        helper = getattr(device, '_helper', None)
+        if helper is None or getattr(helper, 'stdout', None) is None:
+            return None
+        return helper.stdout.fileno()
+
+    def _stop_reading(self):
+        if self._reader_fd is not None:
+            self._loop.remove_reader(self._reader_fd)
+            self._reader_fd = None
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+
+    def _fail(self, error):
+        self.error = error
+        self._stop_reading()
+        self.sphero._notifier.fail_pending(error)
+        for event in self._stream_events:
+            event.set()
+
+    def _on_readable(self):
+        lock = self.sphero._notification_lock
+        if not lock.acquire(blocking=False):
+            # another thread is reading, watch the descriptor again once it is likely done
+            self._loop.remove_reader(self._reader_fd)
+            self._loop.call_later(self.poll_interval, self._resume_reading)
+            return
+        try:
+            # bluepy-helper has lines for us, waitForNotifications returns as soon as one is handled
+            device = self.sphero._device
+            for _ in range(AsyncSphero.READ_BATCH):
+                if not device.waitForNotifications(0.001):
+                    break
+        except Exception as e:
+            self._fail(e)
+        finally:
+            lock.release()
+
+    def _resume_reading(self):
+        if self._reader_fd is not None:
+            self._loop.add_reader(self._reader_fd, self._on_readable)
+
+    async def _poll(self):
+        device = self.sphero._device
+        lock = self.sphero._notification_lock
+        try:
+            while True:
+                if lock.acquire(blocking=False):
+                    try:
+                        # a timeout of 0 returns at once for peripherals without a file descriptor
+                        while device.waitForNotifications(0):
+                            pass
+                    finally:
+                        lock.release()
+                await asyncio.sleep(self.poll_interval)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self._fail(e)
+
+    """ commands """
+
+    async def _request(self, cmd, resp, encode, timeout=None):
+        # same retry policy as Sphero._request, waiting on the event loop
+        orb = self.sphero
+        policy = orb.policy.get(cmd)
+        timeout = (policy.timeout if cmd in orb.policy else self.timeout) if timeout is None else timeout
+        priority = tx_priority(cmd)
+        if not resp:
+            return orb._write(False, encode, priority=priority)
+        for attempt in range(policy.retries + 1):
+            if attempt > 0:
+                orb.link_stats['retransmissions'] += 1
+                if policy.backoff > 0:
+                    await asyncio.sleep(policy.backoff)
+            (seq_num, pending) = orb._write(True, encode, use_window=False, label=cmd.name, priority=priority)
+            orb.flush()
+            try:
+                return (seq_num, await asyncio.wait_for(asyncio.wrap_future(pending), timeout))
+            except asyncio.TimeoutError:
+                orb._notifier.abandon(seq_num)
+                orb.link_stats['command_timeouts'] += 1
+                if attempt == policy.retries:
+                    raise TimeoutError("No response for seq {}".format(seq_num))
+
+    async def command(self, cmd, data, resp=True, timeout=None):
+        '''
+        Same as Sphero.command, awaiting the response
+        :param timeout: (float) seconds to wait for each attempt, defaults to the policy of cmd or the timeout of AsyncSphero
+        :return: (tuple) sequence number and the response, None if resp is False
+        '''
+        payload = b"".join(self.sphero._format_data_array(data))
+        did = cmd.value[0]
+        cid = cmd.value[1]
+        encoder = self.sphero._encoder
+        return await self._request(cmd, resp, lambda seq, answer: encoder.encode_payload(answer, did, cid, seq, payload), timeout)
+
+    async def _command_packed(self, cmd, resp, *values):
+        encoder = self.sphero._encoder
+        return await self._request(cmd, resp, lambda seq, answer: encoder.encode(cmd, seq, answer, *values))
+
+    def batch(self):
+        '''
+        Pack the commands sent in the block into as few writes as possible, see Sphero.batch
+        '''
+        return self.sphero.batch()
+
+    async def ping(self):
+        return await self.command(CMD_CODES.CMD_PING, [])
+
+    async def _query(self, cmd):
+        (seq_num, response) = await self.command(cmd, [])
+        return self.sphero._decode(cmd, response)
+
+    async def version(self):
+        return await self._query(CMD_CODES.CMD_VERSION)
+
+    async def get_device_name(self):
+        return await self._query(CMD_CODES.CMD_GET_BT_NAME)
+
+    async def get_auto_reconnect(self):
+        return await self._query(CMD_CODES.CMD_GET_AUTO_RECONNECT)
+
+    async def get_power_state(self):
+        return await self._query(CMD_CODES.CMD_GET_PWR_STATE)
+
+    async def get_options_flags(self, temporary=False):
+        return await self._query(CMD_CODES.CMD_GET_TEMP_OPTIONS_FLAG if temporary else CMD_CODES.CMD_GET_OPTIONS_FLAG)
+
+    async def read_locator(self):
+        return await self._query(CMD_CODES.CMD_READ_LOCATOR)
+
+    async def macro_status(self):
+        return await self._query(CMD_CODES.CMD_MACRO_STATUS)
+
+    async def roll(self, speed, heading, resp=False):
+        await self._command_packed(CMD_CODES.CMD_ROLL, resp, speed, heading, 1)
+
+    async def set_rgb_led(self, red, green, blue, persist=False, resp=False):
+        await self._command_packed(CMD_CODES.CMD_SET_RGB_LED, resp, red, green, blue, int(persist))
+
+    async def get_rgb_led(self):
+        return await self._query(CMD_CODES.CMD_GET_RGB_LED)
+
+    """ OrbBasic """
+
+    async def erase_orb_basic_storage(self, area):
+        (seq_num, response) = await self.command(CMD_CODES.CMD_ERASE_ORBBAS, [area])
+        return response[2] == 0
+
+    async def run_orb_basic_program(self, area, start_line):
+        (seq_num, response) = await self.command(CMD_CODES.CMD_EXEC_ORBBAS, [area, start_line.to_bytes(2, byteorder='big')])
+        return response[2] == 0
+
+    async def abort_orb_basic_program(self):
+        (seq_num, response) = await self.command(CMD_CODES.CMD_ABORT_ORBBAS, [])
+        return response[2] == 0
+
+    async def append_orb_basic_fragment(self, area, val):
+        (seq_num, response) = await self.command(CMD_CODES.CMD_APPEND_FRAG, [area] + list(val))
+        return response[2] == 0
+
+    async def append_orb_basic_line(self, area, code):
+        fragment = code.encode("utf-8") if len(code) > 0 else b'\x00'
+        return await self.append_orb_basic_fragment(area, [fragment])
+
+    """ streaming """
+
+    async def update_streaming(self, rate=10, samples=1):
+        '''
+        Send the current masks with CMD_SET_DATA_STREAMING, see Sphero.update_streaming
+        '''
+        if not 1 <= samples <= 255:
+            raise ValueError("samples must be between 1 and 255")
+        orb = self.sphero
+        orb._stream_rate = rate
+        orb._stream_samples = samples
+        await self.command(CMD_CODES.CMD_SET_DATA_STREAMING, [orb._stream_mask.pack(rate, samples)])
+        orb._update_frame_decoder()
+        orb._notifier.update_callbacks()
+
+    async def stream(self, fields, rate=10, maxsize=16, samples=1):
+        '''
+        Iterate over the sensor frames with the given groups or fields
+
+            async for frame in robot.stream(['odometer', 'accel_filtered.x'], rate=50):
+                print(frame.odometer.x)
+
+        Frames are queued until the consumer takes them. When maxsize frames are waiting the oldest one is
+        dropped, so a slow consumer always gets the latest values. The masks are released when the generator
+        is closed, use contextlib.aclosing (or aclose()) to release them right after a break.
+
+        :param fields: (list of str) groups or group.field names of the mask lists
+        :param rate: (int) frames per second, a factor of 400
+        :param maxsize: (int) frames kept for the consumer
+        :param samples: (int) samples per frame, every sample is yielded as its own StreamFrame
+        :return: async iterator of StreamFrame
+        '''
+        queue = collections.deque(maxlen=maxsize)
+        ready = asyncio.Event()
+
+        def on_frame(frame):
+            # called on the event loop by the notification reader
+            queue.append(frame)
+            ready.set()
+
+        self.sphero.add_frame_callback(on_frame, fields)
+        self._stream_events.add(ready)
+        try:
+            await self.update_streaming(rate, samples)
+            while True:
+                while len(queue) == 0:
+                    if self.error is not None:
+                        raise self.error
+                    ready.clear()
+                    await ready.wait()
+                yield queue.popleft()
+        finally:
+            self._stream_events.discard(ready)
+            self.sphero.remove_frame_callback(on_frame)
+            if self.error is None and self.sphero._connected:
+                await self.update_streaming(rate, samples)
@@ -0,0 +1,382 @@
+#!/usr/bin/python3
+"""
+Benchmarks for the per packet encode/decode paths.
+
+Every scenario is timed with timeit (best of `repeat` runs) and then run once more under tracemalloc.
+Results are reported per packet:
+    ns_per_pkt              - time spent per packet
+    alloc_bytes_per_pkt     - peak of the memory allocated while handling one packet
+    retained_bytes_per_pkt  - memory still held after handling the packets (buffers, leaks)
+
+Run `sphero_sprk_bench` or `python -m sphero_sprk.benchmark`, the results are printed as JSON.
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import threading
+import timeit
+import tracemalloc
+
+import sphero_sprk.util as util
+from sphero_sprk.delegate_object import DelegateObj
+from sphero_sprk.recorder import SensorRecorder, np
+from sphero_sprk.simulator import SimulatedSphero, build_sync_packet
+from sphero_sprk.sphero import Sphero, CommandsCharacteristic
+from sphero_sprk.wire_log import RX, WireLog
+
+#groups streamed by the notification scenarios, 13 fields -> 32 byte frames
+STREAM_GROUPS = [('imu_filtered', 1), ('accel_filtered', 1), ('gyro_filtered', 1), ('odometer', 2), ('velocity', 2)]
+FRAMES_PER_CALL = 64
+NOTIFICATION_SIZE = 20
+
+SCENARIOS = {}
+
+
+def scenario(func):
+    '''
+    Register a scenario, the function returns (callable, packets handled per call)
+    '''
+    SCENARIOS[func.__name__] = func
+    return func
+
+
+class _NullCharacteristic(object):
+
+    def write(self, val, withResponse=False):
+        pass
+
+
+def _noop(data):
+    pass
+
+
+def _connected_sphero():
+    orb = Sphero("00:00:00:00:00:00", peripheral_factory=SimulatedSphero.factory())
+    orb.connect()
+    return orb
+
+
+def _streaming_sphero(frames=False):
+    orb = _connected_sphero()
+    if frames:
+        orb.add_frame_callback(_noop, [name for (name, mask_id) in STREAM_GROUPS])
+    else:
+        for (name, mask_id) in STREAM_GROUPS:
+            orb.set_stream_callback(name, _noop, mask_id=mask_id)
+    orb.update_streaming(rate=400)
+    #stop the simulator, the scenarios feed the frames themselves
+    orb._device.disconnect()
+    return orb
+
+
+def _sensor_frame(orb):
+    return orb._device.build_sensor_frame(0.0)
+
+
+def _chunks(data, size=NOTIFICATION_SIZE):
+    return [data[i:i + size] for i in range(0, len(data), size)]
+
+
+@scenario
+def send_command():
+    orb = _connected_sphero()
+    orb._cmd_characteristics[CommandsCharacteristic] = _NullCharacteristic()
+
+    def run():
+        orb._send_command("fe", 0x02, 0x30, [b'\x64', b'\x00', b'\x5a', b'\x01'])
+    return (run, 1)
+
+
+@scenario
+def roll():
+    orb = _connected_sphero()
+    orb._cmd_characteristics[CommandsCharacteristic] = _NullCharacteristic()
+
+    def run():
+        orb.roll(100, 90)
+    return (run, 1)
+
+
+@scenario
+def format_data_array():
+    orb = Sphero("00:00:00:00:00:00")
+
+    def run():
+        orb._format_data_array([100, 0, 90, 1])
+    return (run, 1)
+
+
+@scenario
+def cal_packet_checksum():
+    packet = [b'\x02', b'\x30', b'\x00', b'\x05', b'\x64', b'\x00', b'\x5a', b'\x01']
+
+    def run():
+        util.cal_packet_checksum(packet)
+    return (run, 1)
+
+
+@scenario
+def count_data_size():
+    data_list = [b'\x64', b'\x00', b'\x5a', b'\x01']
+
+    def run():
+        util.count_data_size(data_list)
+    return (run, 1)
+
+
+@scenario
+def parse_pkt_sync():
+    delegate = DelegateObj(None, threading.RLock())
+    packet = build_sync_packet(0, 17)
+
+    def run():
+        delegate.parse_pkt(packet)
+    return (run, 1)
+
+
+@scenario
+def process_sensor_pkt():
+    orb = _streaming_sphero()
+    masks = orb.get_mask_order()
+    packet = _sensor_frame(orb)
+    delegate = orb._notifier
+
+    def run():
+        delegate.process_sensor_pkt(masks, packet)
+    return (run, 1)
+
+
+@scenario
+def decode_sensor_frame():
+    '''
+    Single pass decode of a sensor packet into a StreamFrame
+    '''
+    orb = _streaming_sphero(frames=True)
+    packet = _sensor_frame(orb)
+    delegate = orb._notifier
+
+    def run():
+        delegate.process_sensor_frame(packet)
+    return (run, 1)
+
+
+@scenario
+def notify_back_to_back_frames():
+    '''
+    Same as notify_back_to_back with a single frame callback instead of group callbacks
+    '''
+    orb = _streaming_sphero(frames=True)
+    data = _sensor_frame(orb) * FRAMES_PER_CALL
+    handle_notification = orb._notifier.handleNotification
+
+    def run():
+        handle_notification(0x12, data)
+    return (run, FRAMES_PER_CALL)
+
+
+def record_frame():
+    '''
+    Store a decoded frame in the NumPy recorder
+    '''
+    orb = _streaming_sphero(frames=True)
+    frame = orb.get_frame_decoder().decode(_sensor_frame(orb))
+    recorder = SensorRecorder(capacity=4000)
+
+    def run():
+        recorder.record(frame)
+    return (run, 1)
+
+
+if np is not None:
+    scenario(record_frame)
+
+
+@scenario
+def notify_fragmented():
+    '''
+    Sensor frames delivered in 20 byte notifications
+    '''
+    orb = _streaming_sphero()
+    chunks = _chunks(_sensor_frame(orb) * FRAMES_PER_CALL)
+    handle_notification = orb._notifier.handleNotification
+
+    def run():
+        for chunk in chunks:
+            handle_notification(0x12, chunk)
+    return (run, FRAMES_PER_CALL)
+
+
+@scenario
+def notify_back_to_back():
+    '''
+    Many sensor frames queued up in a single notification
+    '''
+    orb = _streaming_sphero()
+    data = _sensor_frame(orb) * FRAMES_PER_CALL
+    handle_notification = orb._notifier.handleNotification
+
+    def run():
+        handle_notification(0x12, data)
+    return (run, FRAMES_PER_CALL)
+
+
+@scenario
+def notify_mixed():
+    '''
+    Simple responses interleaved with sensor frames, fragmented
+    '''
+    orb = _streaming_sphero()
+    frame = _sensor_frame(orb)
+    data = b''.join(frame + build_sync_packet(0, i % 256) for i in range(FRAMES_PER_CALL // 2))
+    chunks = _chunks(data)
+    handle_notification = orb._notifier.handleNotification
+
+    def run():
+        for chunk in chunks:
+            handle_notification(0x12, chunk)
+    return (run, FRAMES_PER_CALL)
+
+
+@scenario
+def construct_sphero():
+    '''
+    Creating a Sphero object (one packet = one object)
+    '''
+    def run():
+        Sphero("00:00:00:00:00:00")
+    return (run, 1)
+
+
+def wire_log_scenario(path):
+    '''
+    Scenario replaying the notifications of a captured wire log (see wire_log.WireRecorder) as fast as
+    possible, the frames are decoded with the stream settings of the capture and go to a frame callback
+    '''
+    log = WireLog(path)
+
+    def replay_wire_log():
+        orb = _connected_sphero()
+        orb._device.disconnect()
+        orb._frame_decoder.update(*log.stream_settings())
+        orb._frame_callbacks.append(_noop)
+        orb._notifier.update_callbacks()
+        chunks = [(record.handle, record.data) for record in log if record.direction == RX]
+        handle_notification = orb._notifier.handleNotification
+
+        def run():
+            for (handle, data) in chunks:
+                handle_notification(handle, data)
+        return (run, max(1, len(chunks)))
+    return replay_wire_log
+
+
+def measure_import(repeat=5):
+    '''
+    Time `import sphero_sprk` in fresh interpreters
+    :return: (dict) best import time and whether bluepy/yaml were imported
+    '''
+    code = ("import sys, time; t = time.perf_counter(); import sphero_sprk; t = time.perf_counter() - t; "
+            "print(t, 'bluepy' in sys.modules, 'yaml' in sys.modules)")
+    best = None
+    for _ in range(repeat):
+        output = subprocess.check_output([sys.executable, '-c', code]).decode().split()
+        best = float(output[0]) if best is None else min(best, float(output[0]))
+    return {
+        'import_ns': round(best * 1e9, 1),
+        'imports_bluepy': output[1] == 'True',
+        'imports_yaml': output[2] == 'True',
+    }
+
+
+def measure(setup, number=2000, repeat=5):
+    '''
+    Time and trace the allocations of a scenario
+    :param setup: scenario function
+    :param number: calls per timing run
+    :param repeat: number of timing runs, the best one is reported
+    :return: (dict) results per packet
+    '''
+    (func, packets) = setup()
+    best = min(timeit.Timer(func).repeat(repeat=repeat, number=number))
+
+    samples = max(1, min(number, 200))
+    tracemalloc.start()
+    try:
+        func()  # warm up buffers
+        (baseline, _) = tracemalloc.get_traced_memory()
+        peak_total = 0
+        for _ in range(samples):
+            (current, _) = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            func()
+            peak_total += tracemalloc.get_traced_memory()[1] - current
+        (retained, _) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    total_packets = samples * packets
+    return {
+        'ns_per_pkt': round(best * 1e9 / (number * packets), 1),
+        'alloc_bytes_per_pkt': round(peak_total / total_packets, 1),
+        'retained_bytes_per_pkt': round(max(0, retained - baseline) / total_packets, 1),
+        'packets_per_call': packets,
+    }
+
+
+def run_benchmarks(names=None, number=2000, repeat=5):
+    names = sorted(SCENARIOS) if not names else names
+    results = {}
+    for name in names:
+        results[name] = measure(SCENARIOS[name], number=number, repeat=repeat)
+    return results
+
+
+def _package_version():
+    try:
+        from importlib.metadata import version
+        return version('sphero_sprk')
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the sphero_sprk packet encode/decode paths")
+    parser.add_argument('-s', '--scenario', action='append', choices=sorted(SCENARIOS),
+                        help="scenario to run, can be repeated (default: all)")
+    parser.add_argument('-n', '--number', type=int, default=2000, help="calls per timing run")
+    parser.add_argument('-r', '--repeat', type=int, default=5, help="timing runs, the best is reported")
+    parser.add_argument('-o', '--output', help="write the JSON to this file instead of stdout")
+    parser.add_argument('-w', '--wire-log', help="also replay the notifications of this wire log (replay_wire_log, "
+                                                 "reported per notification)")
+    args = parser.parse_args(argv)
+    scenarios = args.scenario
+    if args.wire_log:
+        SCENARIOS['replay_wire_log'] = wire_log_scenario(args.wire_log)
+        if scenarios:
+            scenarios = scenarios + ['replay_wire_log']
+
+    report = {
+        'package': 'sphero_sprk',
+        'version': _package_version(),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'number': args.number,
+        'repeat': args.repeat,
+        'scenarios': run_benchmarks(scenarios, number=args.number, repeat=args.repeat),
+        'import': measure_import(args.repeat),
+    }
+    text = json.dumps(report, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write(text + '\n')
+    else:
+        sys.stdout.write(text + '\n')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
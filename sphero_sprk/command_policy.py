@@ -0,0 +1,81 @@
+#!/usr/bin/python3
+
+from sphero_sprk.sphero_constants import CMD_CODES
+
+#commands that must not run twice when only their response was lost
+NON_IDEMPOTENT = (
+    CMD_CODES.CMD_APPEND_FRAG,
+    CMD_CODES.CMD_EXEC_ORBBAS,
+    CMD_CODES.CMD_RUN_MACRO,
+    CMD_CODES.CMD_SAVE_MACRO,
+    CMD_CODES.CMD_SAVE_TEMP_MACRO,
+    CMD_CODES.CMD_APPEND_TEMP_MACRO_CHUNK,
+)
+
+
+class RetryPolicy(object):
+    """
+    How long to wait for the response of a command and how often to send it again
+
+    timeout - (float) seconds to wait for each attempt, None waits forever
+    retries - (int) attempts after the first one, each with a fresh sequence number
+    backoff - (float) seconds between a timeout and the next attempt
+    confirm - (bool) ask for a response even when the caller doesn't wait for it (resp=False), so a lost
+        command is sent again in the background. Needs the notification pump (see Sphero.start_pump)
+    """
+
+    __slots__ = ('timeout', 'retries', 'backoff', 'confirm')
+
+    def __init__(self, timeout=1.0, retries=2, backoff=0.0, confirm=False):
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.confirm = confirm
+
+    def copy(self, **changes):
+        values = dict((name, getattr(self, name)) for name in RetryPolicy.__slots__)
+        values.update(changes)
+        return RetryPolicy(**values)
+
+    def __repr__(self):
+        return "RetryPolicy(timeout={}, retries={}, backoff={}, confirm={})".format(
+            self.timeout, self.retries, self.backoff, self.confirm)
+
+
+class CommandPolicy(object):
+    """
+    RetryPolicy of every CMD_CODES entry, the default one for the commands without their own.
+
+    A sequence number whose response timed out is held back for late_window seconds, a response
+    arriving for it in that time is recognized as late and discarded.
+
+        policy = CommandPolicy(timeout=0.5, retries=2)
+        policy.set(CMD_CODES.CMD_ROLL, timeout=0.1, retries=0, confirm=True)
+        orb = Sphero(addr, policy=policy)
+    """
+
+    def __init__(self, timeout=1.0, retries=2, backoff=0.0, late_window=2.0):
+        self.default = RetryPolicy(timeout, retries, backoff)
+        self.late_window = late_window
+        self._policies = {}
+        for cmd in NON_IDEMPOTENT:
+            self._policies[cmd] = self.default.copy(retries=0)
+
+    def set(self, cmd, **changes):
+        '''
+        Set the policy of a command, the values not given are taken from its current policy
+        :param cmd: (CMD_CODES) the command
+        :return: (RetryPolicy) the new policy
+        '''
+        policy = self.get(cmd).copy(**changes)
+        self._policies[cmd] = policy
+        return policy
+
+    def reset(self, cmd):
+        self._policies.pop(cmd, None)
+
+    def get(self, cmd):
+        return self._policies.get(cmd, self.default)
+
+    def __contains__(self, cmd):
+        return cmd in self._policies
@@ -1,35 +1,87 @@
-import struct
-
-import bluepy
+import concurrent.futures
+import threading
+import time
 from collections import namedtuple
 
-class DelegateObj(bluepy.btle.DefaultDelegate):
+from sphero_sprk.events import AsyncRouter
+from sphero_sprk.metrics import Metrics
+from sphero_sprk.reassembler import PacketReassembler
+
+class DelegateObj(object):
     """
     Delegate object that get calls when there is a notification
+
+    bluepy only calls handleNotification on the delegate, so this doesn't need to derive from
+    bluepy.btle.DefaultDelegate and bluepy isn't needed to decode packets
     """
 
     SPHERO_PKT_HEADER = namedtuple('SPHERO_PKT_HEADER', 'sop1 sop2 mrsp seq dlen')
 
     def __init__(self, sphero_obj, lock):
-        bluepy.btle.DefaultDelegate.__init__(self)
         self._sphero_obj = sphero_obj
         self._callback_dict = {}
-        self._wait_list = {}
+        self._pending = {}  # seq -> (Future, deadline, label, time sent)
+        self._pending_lock = threading.Lock()
+        self._pump = None
+        self._transmitter = None
+        #seconds of each read while a TransmitQueue is writing, the longest a queued packet waits for a reader
+        self.rx_slice = 0.005
+        self._abandoned = {}  # seq -> time.monotonic() until a late response is expected
+        self.late_window = 2.0
         self._data_group_callback = {}
         self._enabled_group = []
-        self._buffer_bytes = b''
+        self._reassembler = PacketReassembler()
         self._notification_lock = lock
         self._mask_callbacks = []
+        self._frame_decoder = None
+        self._frame_callbacks = []
+        self._frame_batch_callbacks = []
         self.start_time = None
+        self.wire_tap = None  # WireRecorder
+        metrics = getattr(sphero_obj, 'metrics', None)
+        self.metrics = Metrics() if metrics is None else metrics
+        self.metrics.add_source('reassembler', self._reassembler.stats)
+        events = getattr(sphero_obj, 'events', None)
+        self.events = AsyncRouter(self.metrics) if events is None else events
+
+    @property
+    def late_responses(self):
+        return self.metrics.late_responses
 
     def update_callbacks(self):
         self._mask_callbacks = self._sphero_obj.get_mask_order()
+        self._frame_decoder = self._sphero_obj.get_frame_decoder()
+        self._frame_callbacks = self._sphero_obj.get_frame_callbacks()
+        self._frame_batch_callbacks = self._sphero_obj.get_frame_batch_callbacks()
+
+    def process_sensor_frame(self, data):
+        '''
+        Decode a sensor packet in one pass and hand it to the frame callbacks
+        '''
+        decoder = self._frame_decoder
+        if decoder.samples == 1:
+            frame = decoder.decode(data)
+            frames = None if frame is None else (frame,)
+        else:
+            frames = decoder.decode_samples(data)
+        if frames is None:
+            self.metrics.problem('length_mismatches', "sensor frame of %d bytes doesn't match the masks", len(data))
+            return
+        for callback in self._frame_callbacks:
+            for frame in frames:
+                callback(frame)
+        if len(self._frame_batch_callbacks) > 0:
+            frames = list(frames)
+            for callback in self._frame_batch_callbacks:
+                callback(frames)
 
     def register_callback(self, seq, callback):
         self._callback_dict[seq] = callback
 
     def register_async_callback(self, group_name, callback):
-        self._data_group_callback[group_name] = callback
+        callbacks = self._data_group_callback.setdefault(group_name, [])
+        if callback not in callbacks:
+            callbacks.append(callback)
         self._enabled_group = list(set(self._enabled_group) | set([group_name]))
 
     def handle_callbacks(self, packet):
@@ -39,29 +91,145 @@ class DelegateObj(bluepy.btle.DefaultDelegate):
         dlen = (packet[4] - 1)
         data = []
         if (dlen > 0):
-            data = packet[5:5 + dlen]
+            data = bytes(packet[5:5 + dlen])
         # parse the packet
         callback(MRSP, data)
 
+    def set_pump(self, pump):
+        '''
+        Set the thread pumping notifications, None when the waiting caller has to pump them
+        '''
+        self._pump = pump
+
+    def set_transmitter(self, transmitter):
+        '''
+        Set the TransmitQueue writing the packets, the readers leave it the lock between short reads
+        '''
+        self._transmitter = transmitter
+
+    def yield_to_transmitter(self, timeout=None):
+        '''
+        Called before taking the notification lock to read: let the queued packets be written first
+        :param timeout: (float) seconds the caller wants to read, None blocks
+        :return: (float) seconds to read, at most rx_slice while a TransmitQueue runs
+        '''
+        transmitter = self._transmitter
+        if transmitter is None:
+            return timeout
+        if transmitter.pending() > 0:
+            transmitter.wait_drained(self.rx_slice)
+        return self.rx_slice if timeout is None else min(timeout, self.rx_slice)
+
+    def expect(self, seq, timeout=None, future=None, label=None):
+        '''
+        Register a response we are waiting for, must be called before the command is written
+        :param seq: (int) sequence number of the command
+        :param timeout: (float) seconds until the future fails with TimeoutError, None waits forever
+        :param future: (Future) future to resolve, a new concurrent.futures.Future by default
+        :param label: (str) name of the command, its round trip time is recorded in the metrics
+        :return: (Future) resolved with the response packet (bytes)
+        '''
+        future = concurrent.futures.Future() if future is None else future
+        now = time.monotonic()
+        deadline = None if timeout is None else now + timeout
+        with self._pending_lock:
+            self._pending[seq] = (future, deadline, label, now)
+        return future
+
+    def abandon(self, seq, error=None):
+        '''
+        Stop waiting for a response, the future fails with the error (TimeoutError by default)
+        '''
+        with self._pending_lock:
+            entry = self._pending.pop(seq, None)
+            if entry is not None and error is None:
+                #the response may still come, it must not be taken for the answer of the next command
+                self._abandoned[seq] = time.monotonic() + self.late_window
+        if entry is not None and not entry[0].done():
+            entry[0].set_exception(error if error is not None else TimeoutError("No response for seq {}".format(seq)))
+
+    def expire_pending(self, now=None):
+        '''
+        Fail the pending responses past their deadline
+        '''
+        if len(self._pending) == 0 and len(self._abandoned) == 0:
+            return
+        now = time.monotonic() if now is None else now
+        if len(self._abandoned) > 0:
+            with self._pending_lock:
+                for seq in [seq for (seq, until) in self._abandoned.items() if until <= now]:
+                    del self._abandoned[seq]
+        with self._pending_lock:
+            expired = [seq for (seq, (future, deadline, label, sent)) in self._pending.items()
+                       if (deadline is not None and deadline <= now) or future.cancelled()]
+        for seq in expired:
+            self.abandon(seq)
+
+    def fail_pending(self, error):
+        '''
+        Fail every pending response, e.g. when the connection is lost
+        '''
+        with self._pending_lock:
+            pending = list(self._pending)
+        for seq in pending:
+            self.abandon(seq, error)
+
+    def pending_count(self):
+        return len(self._pending)
+
+    def wait(self, future, timeout=None, seq=None):
+        '''
+        Block until the future has its response. Without a pump thread the caller pumps the notifications.
+        :param future: (Future) from expect()
+        :param timeout: (float) seconds, None waits forever
+        :param seq: (int) sequence number, abandoned on timeout
+        :return: (bytes) response packet
+        '''
+        try:
+            if self._pump is not None and self._pump.is_alive():
+                return future.result(timeout)
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not future.done():
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError("No response for seq {}".format(seq))
+                #with a transmit queue, read in slices it writes between
+                remaining = self.yield_to_transmitter(remaining)
+                with self._notification_lock:
+                    if not future.done():
+                        self._sphero_obj._device.waitForNotifications(remaining)
+                self.expire_pending()
+            return future.result(0)
+        except (TimeoutError, concurrent.futures.TimeoutError):
+            if seq is not None:
+                self.abandon(seq)
+            raise TimeoutError("No response for seq {}".format(seq))
+
     def wait_for_resp(self, seq, timeout=None):
-        # this is a dangerous function, it waits for a response in the handle notification part
-        self._wait_list[seq] = None;
-        while (self._wait_list[seq] == None):
-            # time.sleep(0.1)
-            with self._notification_lock:
-                self._sphero_obj._device.waitForNotifications(timeout)
-        return self._wait_list.pop(seq)
+        '''
+        Wait for the response of a sequence number, registering it if expect() wasn't called
+        '''
+        entry = self._pending.get(seq)
+        future = self.expect(seq) if entry is None else entry[0]
+        return self.wait(future, timeout, seq)
 
     def wait_for_sim_response(self, seq, timeout=None):
-        # this is a dangerous function, it waits for a response in the handle notification part
-        self._wait_list[seq] = None;
-        while (self._wait_list[seq] == None):
-            # time.sleep(0.1)
-            with self._notification_lock:
-                self._sphero_obj._device.waitForNotifications(timeout)
-        data = self._wait_list.pop(seq)
+        data = self.wait_for_resp(seq, timeout)
         return (len(data) == 6 and data[0] == 255)
 
+    def resolve(self, seq, packet):
+        with self._pending_lock:
+            entry = self._pending.pop(seq, None)
+        if entry is not None and entry[2] is not None:
+            self.metrics.observe_rtt(entry[2], time.monotonic() - entry[3])
+        if entry is not None and not entry[0].done():
+            try:
+                entry[0].set_result(packet)
+            except concurrent.futures.InvalidStateError:
+                pass  # cancelled in the meantime
+
     def verify_checksum(self, data):
         data_length = int.from_bytes(data[3:5], 'big') - 1  # minus one for the checksum_val
 
@@ -76,30 +244,26 @@ class DelegateObj(bluepy.btle.DefaultDelegate):
         return chk_sum == pkt_chk_sum
 
     def process_sensor_pkt(self, active_masks, data):
+        '''
+        Call the callback of every mask with its slice of each sample of the frame, a frame holds as many
+        samples as asked by update_streaming
+        '''
         if (len(active_masks) == 0):
             return
 
         data_length = int.from_bytes(data[3:5], 'big') - 1  # minus one for the checksum_val
+        record_size = sum(mask['len'] * 2 for mask in active_masks)
 
-        total_processed = 0
+        if (record_size == 0 or data_length % record_size != 0):
+            self.metrics.problem('length_mismatches', "sensor data of %d bytes doesn't match the mask list", data_length)
+            return
 
         start = 5
-        stop = 5
-
-        for mask in active_masks:
-            len_mask = mask['len'] * 2
-            stop = len_mask + start
-            sub_data = data[start:stop]
-
-            mask['callback'](sub_data)
-            total_processed = total_processed + len_mask
-            start = stop
-
-            if (total_processed >= data_length):
-                break
-
-        if (total_processed != data_length):
-            print("Data Length Did not match mask list")
+        for _ in range(data_length // record_size):
+            for mask in active_masks:
+                stop = start + mask['len'] * 2
+                mask['callback'](data[start:stop])
+                start = stop
 
     def parse_pkt(self, data):
         '''
@@ -111,73 +275,67 @@ class DelegateObj(bluepy.btle.DefaultDelegate):
             # get the sequence number and check if a callback is assigned
             if (data[3] in self._callback_dict):
                 self.handle_callbacks(data)
-            # check if we have it in the wait list
-            elif (data[3] in self._wait_list):
-                self._wait_list[data[3]] = data
+            # check if we are waiting for it
+            elif (data[3] in self._pending):
+                self.resolve(data[3], bytes(data))
+            # answer of a command we gave up on
+            elif (data[3] in self._abandoned):
+                self._abandoned.pop(data[3], None)
+                self.metrics.late_responses += 1
             # simple response
             elif (len(data) == 6 and data[0] == 255 and data[2] == 0):
                 pass
                 # print("receive simple response for seq:{}".format(data[3]))
             else:
-                print("unknown response:{}".format(data))
+                self.metrics.problem('unknown_responses', "unknown response %s", bytes(data).hex())
             # Sync Message
         elif (data[1] == 254):
             ##print("receive async")
             # Async Message
             if (data[2] == int.from_bytes(b'\x03', 'big')):
                 # the message is sensor data streaming
-
-                self.process_sensor_pkt(self._mask_callbacks, data)
+                self.metrics.frame(time.monotonic())
+                if (len(self._frame_callbacks) > 0 or len(self._frame_batch_callbacks) > 0):
+                    self.process_sensor_frame(data)
+                if (len(self._mask_callbacks) > 0):
+                    self.process_sensor_pkt(self._mask_callbacks, data)
 
                 # self.process_sensor_package(data, mask_list)
 
-            elif (data[2] == int.from_bytes(b'\x09', 'big')):
-                # orbbasic error message:
-                print("orbBasic Error Message:")
-                print(data[2:])
-            elif (data[2] == int.from_bytes(b'\x0A', 'big')):
-                print(data[2:])
-            else:
-                print("unknown async response:{}".format(data))
+            elif not self.events.dispatch(data):
+                # not a collision, power, OrbBasic... message
+                self.metrics.problem('unknown_async', "unknown async message %s", bytes(data).hex())
         else:
             pass
 
-    def process_buffer(self, bytes):
+    def process_buffer(self, data):
         '''
-        Process all bytes, returning any bytes left over from a complete packet
-        :param bytes:
-        :return: remaining bytes
+        Add the bytes to the reassembler and parse every packet that is complete
+        :param data: received bytes
+        :return:
         '''
+        metrics = self.metrics
+        metrics.rx_notifications += 1
+        metrics.rx_bytes += len(data)
+        reassembler = self._reassembler
+        reassembler.feed(data)
+        for packet in reassembler.packets():
+            metrics.rx_packets += 1
+            self.parse_pkt(packet)
+
+    def reset_buffer(self):
+        '''
+        Drop the partial packet of a connection that was lost
+        '''
+        self._reassembler.reset()
 
-        while (len(bytes) > 0):
-            buffer_len = len(bytes)
-
-            if(buffer_len < 6): # Always a checksum byte
-                return  bytes
-
-            # Get Header, and try to process a packet
-            header = DelegateObj.SPHERO_PKT_HEADER._make(struct.unpack('<BBBBB', bytes[0:5]))
-
-            pkt_len = header.dlen + 5
-
-            if(buffer_len >= pkt_len):
-                pkt_bytes = bytes[0:pkt_len]
-                self.parse_pkt(pkt_bytes)
-                bytes = bytes[pkt_len:]
-            else:
-                return bytes
-
-        return  bytes
+    def reassembler_stats(self):
+        '''
+        Counters of the packet reassembler (packets, resyncs, checksum failures, discarded bytes)
+        '''
+        return self._reassembler.stats()
 
     def handleNotification(self, cHandle, data):
-
-        # Check to see if the data is len(0), if so return
-
-        # merge data with any incomplete instance
-        self._buffer_bytes = self._buffer_bytes + data
-
-        self._buffer_bytes = self.process_buffer(self._buffer_bytes)
-
-        if(self._buffer_bytes is None):
-            self._buffer_bytes = b''
-
+        if self.wire_tap is not None:
+            self.wire_tap.rx(cHandle, data)
+        self.process_buffer(data)
@@ -0,0 +1,278 @@
+#!/usr/bin/python3
+
+import contextlib
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+
+import sphero_sprk.util as util
+
+COMPLETE_LOCAL_NAME = 9
+
+DEFAULT_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "sphero_sprk", "discovery.json")
+
+DiscoveredSphero = namedtuple('DiscoveredSphero', 'addr name rssi last_seen')
+DiscoveredSphero.__doc__ = """
+A robot seen by the scanner
+
+addr      - (str) MAC address
+name      - (str) complete local name, e.g. SK-1A2B
+rssi      - (int) signal strength of the last advertisement in dBm
+last_seen - (float) time.time() of the last advertisement
+"""
+
+
+class _ScanDelegate(object):
+
+    def __init__(self, service):
+        self._service = service
+
+    def handleDiscovery(self, dev, isNewDev, isNewData):
+        self._service.observe(dev.addr, dev.getValueText(COMPLETE_LOCAL_NAME), dev.rssi)
+
+
+def _bluepy_scanner(iface):
+    #imported here so the package can be used without bluepy
+    from bluepy.btle import Scanner
+    return Scanner(iface)
+
+
+class DiscoveryService(object):
+    """
+    Keeps a cache of the Spheros around, fed by a scanner running in a background thread.
+
+    Robots not seen for ttl seconds expire. The cache can be saved to a JSON file and is loaded back
+    on start, so a restarted program finds its robots without waiting for a scan.
+
+    BlueZ often fails an LE connection made while the same adapter scans, connect() stops the scanner
+    of its adapter during the connection (see paused).
+    """
+
+    def __init__(self, ttl=300.0, interval=1.0, iface=0, cache_path=None, name_prefix='SK-', scanner_factory=None):
+        '''
+        :param ttl: (float) seconds a robot stays in the cache after its last advertisement
+        :param interval: (float) seconds the scanner processes advertisements between cache maintenance
+        :param iface: (int) HCI adapter to scan with
+        :param cache_path: (str) JSON file of the on-disk cache, None keeps the cache in memory only
+        :param name_prefix: (str) local name prefix of the robots
+        :param scanner_factory: (function) called with iface, returns a bluepy.btle.Scanner like object
+        '''
+        self.ttl = ttl
+        self.interval = interval
+        self.iface = iface
+        self.cache_path = cache_path
+        self.name_prefix = name_prefix
+        self._scanner_factory = _bluepy_scanner if scanner_factory is None else scanner_factory
+        self._cond = threading.Condition()
+        #one save at a time, so an older snapshot never replaces a newer one
+        self._save_lock = threading.Lock()
+        self._entries = {}
+        self._dirty = False
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._pauses = 0
+        self._scanning = False
+        self.error = None
+        if cache_path is not None:
+            self.load()
+
+    def observe(self, addr, name, rssi, now=None):
+        '''
+        Record an advertisement, ignored if the name doesn't start with name_prefix
+        :return: (bool) True if it was recorded
+        '''
+        if name is None or not name.startswith(self.name_prefix):
+            return False
+        now = time.time() if now is None else now
+        with self._cond:
+            self._entries[addr] = DiscoveredSphero(addr, name, rssi, now)
+            self._dirty = True
+            self._cond.notify_all()
+        return True
+
+    def robots(self, order='rssi', now=None):
+        '''
+        :param order: (str) 'rssi' for the strongest first, 'recent' for the most recently seen first
+        :return: (list of DiscoveredSphero) the robots seen in the last ttl seconds
+        '''
+        now = time.time() if now is None else now
+        with self._cond:
+            self._expire(now)
+            robots = list(self._entries.values())
+        if order == 'rssi':
+            robots.sort(key=lambda robot: robot.rssi, reverse=True)
+        elif order == 'recent':
+            robots.sort(key=lambda robot: robot.last_seen, reverse=True)
+        else:
+            raise ValueError("Unknown order {}".format(order))
+        return robots
+
+    def addresses(self, order='rssi'):
+        return [robot.addr for robot in self.robots(order)]
+
+    def strongest(self):
+        robots = self.robots('rssi')
+        return robots[0] if len(robots) > 0 else None
+
+    def most_recent(self):
+        robots = self.robots('recent')
+        return robots[0] if len(robots) > 0 else None
+
+    def wait_for(self, count=1, timeout=None):
+        '''
+        Block until at least count robots are in the cache
+        :return: (list of DiscoveredSphero) the robots, strongest first. Raises TimeoutError after timeout seconds
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                self._expire(time.time())
+                if len(self._entries) >= count:
+                    break
+                if self.error is not None:
+                    raise self.error
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    raise TimeoutError("Found {} of {} Spheros".format(len(self._entries), count))
+                self._cond.wait(remaining)
+        return self.robots('rssi')
+
+    def _expire(self, now):
+        expired = [addr for (addr, robot) in self._entries.items() if now - robot.last_seen > self.ttl]
+        for addr in expired:
+            del self._entries[addr]
+            self._dirty = True
+
+    """ on-disk cache """
+
+    def load(self, path=None):
+        '''
+        Merge the robots of the cache file that haven't expired, missing or broken files are ignored
+        '''
+        path = self.cache_path if path is None else path
+        try:
+            with open(path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self._cond:
+            for entry in data.get("robots", []):
+                robot = DiscoveredSphero(entry["addr"], entry["name"], entry["rssi"], entry["last_seen"])
+                known = self._entries.get(robot.addr)
+                if known is None or known.last_seen < robot.last_seen:
+                    self._entries[robot.addr] = robot
+            self._expire(time.time())
+            self._cond.notify_all()
+
+    def save(self, path=None):
+        '''
+        Write the cache file, atomically replacing the previous one
+        '''
+        path = self.cache_path if path is None else path
+        with self._save_lock:
+            with self._cond:
+                self._expire(time.time())
+                data = {"robots": [robot._asdict() for robot in self._entries.values()]}
+                self._dirty = False
+            util.write_file_atomic(path, json.dumps(data))
+
+    """ background scanner """
+
+    def start(self):
+        '''
+        Start scanning in a background thread
+        '''
+        if self._thread is not None and self._thread.is_alive():
+            return self
+        self._stop_event.clear()
+        self.error = None
+        self._thread = threading.Thread(target=self._run, name="sphero-discovery")
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+        if self.cache_path is not None and self._dirty:
+            self.save()
+
+    @contextlib.contextmanager
+    def paused(self, timeout=None):
+        '''
+        Stop the scanner for the duration of the block, e.g. while connecting on the same adapter. Waits for
+        the scan in progress to stop, which takes up to interval seconds. Blocks can be nested and overlap
+        :param timeout: (float) seconds to wait for the scanner to stop, 2 * interval by default
+        '''
+        timeout = 2 * self.interval if timeout is None else timeout
+        with self._cond:
+            self._pauses += 1
+            self._cond.notify_all()
+            self._cond.wait_for(lambda: not self._scanning, timeout)
+        try:
+            yield self
+        finally:
+            with self._cond:
+                self._pauses -= 1
+                self._cond.notify_all()
+
+    def _run(self):
+        try:
+            scanner = self._scanner_factory(self.iface).withDelegate(_ScanDelegate(self))
+            while not self._stop_event.is_set():
+                with self._cond:
+                    while self._pauses > 0 and not self._stop_event.is_set():
+                        self._cond.wait(self.interval)
+                    if self._stop_event.is_set():
+                        break
+                    self._scanning = True
+                scanner.start()
+                try:
+                    while not self._stop_event.is_set() and self._pauses == 0:
+                        scanner.process(self.interval)
+                        if self.cache_path is not None and self._dirty:
+                            self.save()
+                finally:
+                    scanner.stop()
+                    with self._cond:
+                        self._scanning = False
+                        self._cond.notify_all()
+        except Exception as e:
+            with self._cond:
+                self.error = e
+                self._cond.notify_all()
+
+
+_default_services = {}  # iface -> DiscoveryService
+_default_lock = threading.Lock()
+
+
+def default_service(iface=None, cache_path=None):
+    '''
+    The discovery service shared by the process for an adapter, started on first use
+    :param iface: (int) HCI adapter, None for hci0
+    :param cache_path: (str) on-disk cache of the service when this call creates it (DEFAULT_CACHE_PATH for
+        warm restarts), None keeps it in memory only
+    '''
+    iface = 0 if iface is None else iface
+    with _default_lock:
+        service = _default_services.get(iface)
+        if service is None:
+            service = _default_services[iface] = DiscoveryService(iface=iface, cache_path=cache_path)
+        return service.start()
+
+
+def paused(iface=None):
+    '''
+    Context manager stopping the shared scanner of an adapter during the block, does nothing if the process
+    never used default_service() on it
+    '''
+    with _default_lock:
+        service = _default_services.get(0 if iface is None else iface)
+    if service is None:
+        return contextlib.nullcontext()
+    return service.paused()
@@ -0,0 +1,200 @@
+#!/usr/bin/python3
+
+import collections
+import logging
+import threading
+
+logger = logging.getLogger("sphero_sprk")
+
+#what offer() does when the queue of a subscription is full
+BLOCK = 'block'              # wait for room, the reader slows down to the pace of the subscriber
+DROP_OLDEST = 'drop_oldest'  # drop the oldest item of the queue
+KEEP_LATEST = 'keep_latest'  # drop the whole queue, the subscriber jumps to the latest item
+POLICIES = (BLOCK, DROP_OLDEST, KEEP_LATEST)
+
+
+class Subscription(threading.Thread):
+    """
+    Calls a callback from its own thread with the items offered to it, so a slow callback never holds up the
+    thread reading the notifications.
+
+    offer() is the callback given to the reader (a frame or event callback): it keeps one item out of every
+    `every`, queues it and returns. When maxsize items are waiting the policy decides: BLOCK waits for room,
+    DROP_OLDEST drops the oldest item, KEEP_LATEST drops them all. Dropped items are counted.
+    With BLOCK the reader waits for the callback, which should then not wait for responses itself.
+    """
+
+    def __init__(self, callback, maxsize=64, policy=DROP_OLDEST, every=1, name=None):
+        '''
+        :param callback: (function) called with every item kept
+        :param maxsize: (int) items waiting for the callback at most
+        :param policy: (str) BLOCK, DROP_OLDEST or KEEP_LATEST
+        :param every: (int) keep one item out of every `every`, 1 keeps them all
+        :param name: (str) name of the subscription in the metrics, the name of the callback by default
+        '''
+        if policy not in POLICIES:
+            raise ValueError("policy must be one of {}".format(", ".join(POLICIES)))
+        if maxsize < 1 or every < 1:
+            raise ValueError("maxsize and every must be at least 1")
+        self.subscription_name = name if name is not None else getattr(callback, '__name__', repr(callback))
+        threading.Thread.__init__(self, name="sphero-subscriber-{}".format(self.subscription_name))
+        self.daemon = True
+        self.callback = callback
+        self.maxsize = maxsize
+        self.policy = policy
+        self.every = every
+        #called once by close(), e.g. to remove offer() from the callbacks of the robot
+        self.on_close = None
+        self._cond = threading.Condition()
+        self._queue = collections.deque()
+        self._skip = 0
+        self._closed = False
+        self._busy = False
+        self.offered = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.decimated = 0
+        self.errors = 0
+        self.max_depth = 0
+        self.error = None
+
+    def offer(self, item):
+        '''
+        Queue an item for the callback, returns at once unless the policy is BLOCK and the queue is full
+        '''
+        with self._cond:
+            if self._closed:
+                return
+            self.offered += 1
+            if self._skip > 0:
+                self._skip -= 1
+                self.decimated += 1
+                return
+            self._skip = self.every - 1
+            queue = self._queue
+            if len(queue) >= self.maxsize:
+                if self.policy == BLOCK:
+                    while len(queue) >= self.maxsize and not self._closed:
+                        self._cond.wait()
+                    if self._closed:
+                        return
+                elif self.policy == DROP_OLDEST:
+                    queue.popleft()
+                    self.dropped += 1
+                else:
+                    self.dropped += len(queue)
+                    queue.clear()
+            queue.append(item)
+            if len(queue) > self.max_depth:
+                self.max_depth = len(queue)
+            self._cond.notify_all()
+
+    def run(self):
+        while True:
+            with self._cond:
+                self._busy = False
+                self._cond.notify_all()
+                while len(self._queue) == 0 and not self._closed:
+                    self._cond.wait()
+                if len(self._queue) == 0:
+                    return
+                item = self._queue.popleft()
+                self._busy = True
+                #room for a blocked offer()
+                self._cond.notify_all()
+            try:
+                self.callback(item)
+                self.delivered += 1
+            except Exception as e:
+                self.errors += 1
+                self.error = e
+                logger.warning("subscriber %s failed: %r", self.subscription_name, e)
+
+    def depth(self):
+        return len(self._queue)
+
+    def join_queue(self, timeout=None):
+        '''
+        Block until the callback took every queued item
+        :return: (bool) False on timeout
+        '''
+        with self._cond:
+            return self._cond.wait_for(lambda: len(self._queue) == 0 and not self._busy, timeout)
+
+    def stats(self):
+        '''
+        :return: (dict) queue depth, max depth and the items offered, delivered, dropped, decimated and failed
+        '''
+        return {
+            'depth': len(self._queue),
+            'max_depth': self.max_depth,
+            'offered': self.offered,
+            'delivered': self.delivered,
+            'dropped': self.dropped,
+            'decimated': self.decimated,
+            'errors': self.errors,
+        }
+
+    def close(self, drain=True, timeout=None):
+        '''
+        Stop the thread
+        :param drain: (bool) deliver the queued items first
+        '''
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            if not drain:
+                self.dropped += len(self._queue)
+                self._queue.clear()
+            self._cond.notify_all()
+        if self.on_close is not None:
+            self.on_close()
+        if self.is_alive() and self is not threading.current_thread():
+            self.join(timeout)
+
+
+class Dispatcher(object):
+    """
+    The subscriptions of a connection, each with its own queue and thread. Their counters are added to the
+    metrics of the robot under 'subscriptions'.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = []
+
+    def subscribe(self, callback, maxsize=64, policy=DROP_OLDEST, every=1, name=None):
+        '''
+        :return: (Subscription) started, give its offer method to the reader
+        '''
+        subscription = Subscription(callback, maxsize, policy, every, name)
+        with self._lock:
+            names = set(other.subscription_name for other in self._subscriptions)
+            if subscription.subscription_name in names:
+                base = subscription.subscription_name
+                subscription.subscription_name = next("{}-{}".format(base, i) for i in range(2, len(names) + 2)
+                                                      if "{}-{}".format(base, i) not in names)
+            self._subscriptions.append(subscription)
+        subscription.start()
+        return subscription
+
+    def unsubscribe(self, subscription, drain=True):
+        with self._lock:
+            if subscription in self._subscriptions:
+                self._subscriptions.remove(subscription)
+        subscription.close(drain)
+
+    def subscriptions(self):
+        with self._lock:
+            return list(self._subscriptions)
+
+    def stats(self):
+        '''
+        :return: (dict) name of the subscription -> its stats()
+        '''
+        return dict((subscription.subscription_name, subscription.stats()) for subscription in self.subscriptions())
+
+    def close(self, drain=False):
+        for subscription in self.subscriptions():
+            self.unsubscribe(subscription, drain)
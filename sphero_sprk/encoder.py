@@ -0,0 +1,118 @@
+#!/usr/bin/python3
+
+import struct
+
+from sphero_sprk.sphero_constants import CMD_CODES
+
+SOP1 = 0xff
+SOP2_ANSWER = 0xff
+SOP2_NO_ANSWER = 0xfe
+
+HEADER_SIZE = 6  # SOP1 SOP2 DID CID SEQ DLEN
+MAX_PAYLOAD = 254  # DLEN is one byte and includes the checksum
+
+#struct layouts of the command payloads, all big endian
+PAYLOAD_LAYOUTS = {
+    CMD_CODES.CMD_PING: '>',
+    CMD_CODES.CMD_VERSION: '>',
+    CMD_CODES.CMD_GET_BT_NAME: '>',
+    CMD_CODES.CMD_SET_PWR_NOTIFY: '>B',         # flag
+    CMD_CODES.CMD_SET_HEADING: '>H',            # heading
+    CMD_CODES.CMD_SET_STABILIZ: '>B',           # flag
+    CMD_CODES.CMD_SET_COLLISION_DET: '>BBBBBB', # method, x threshold, x speed, y threshold, y speed, dead time
+    CMD_CODES.CMD_LOCATOR: '>BhhH',             # flags, x, y, yaw tare
+    CMD_CODES.CMD_SET_RGB_LED: '>BBBB',         # red, green, blue, persist
+    CMD_CODES.CMD_SET_BACK_LED: '>B',           # brightness
+    CMD_CODES.CMD_GET_RGB_LED: '>',
+    CMD_CODES.CMD_ROLL: '>BHB',                 # speed, heading, state
+    CMD_CODES.CMD_SET_RAW_MOTORS: '>BBBB',      # left mode, left power, right mode, right power
+    CMD_CODES.CMD_RUN_MACRO: '>B',              # macro id
+    CMD_CODES.CMD_ABORT_MACRO: '>',
+}
+
+
+class PacketEncoder(object):
+    """
+    Builds command packets into a reusable buffer.
+
+    Headers are precompiled per CMD_CODES entry and payloads are packed with cached struct.Struct layouts,
+    the checksum is computed in a single pass over the buffer. The returned memoryview points into the
+    internal buffer and is only valid until the next encode, write it out before encoding again.
+    """
+
+    def __init__(self, layouts=PAYLOAD_LAYOUTS):
+        self._layouts = dict(layouts)
+        self._compiled = {}
+        self._buffer = bytearray(HEADER_SIZE + MAX_PAYLOAD + 1)
+        self._view = memoryview(self._buffer)
+        self._buffer[0] = SOP1
+
+    def register_layout(self, cmd, fmt):
+        '''
+        Add or replace the payload layout of a command
+        :param cmd: (CMD_CODES) command
+        :param fmt: (str) struct format of the payload
+        '''
+        self._layouts[cmd] = fmt
+        self._compiled.pop(cmd, None)
+
+    def _compile(self, cmd):
+        fmt = self._layouts.get(cmd)
+        if fmt is None:
+            raise KeyError("No payload layout for {}".format(cmd))
+        layout = struct.Struct(fmt)
+        if layout.size > MAX_PAYLOAD:
+            raise ValueError("Payload of {} is too long".format(cmd))
+        (did, cid) = cmd.value
+        dlen = layout.size + 1
+        end = HEADER_SIZE + layout.size
+        #DID, CID and DLEN never change, only SEQ and the payload are summed per packet
+        compiled = (bytes([did, cid]), dlen, layout, end, did + cid + dlen)
+        self._compiled[cmd] = compiled
+        return compiled
+
+    def encode(self, cmd, seq, answer, *values):
+        '''
+        Encode a command with the registered payload layout
+        :param cmd: (CMD_CODES) command
+        :param seq: (int) sequence number 0-255
+        :param answer: (bool) whether Sphero should send a response
+        :param values: payload values matching the layout
+        :return: (memoryview) the packet
+        '''
+        compiled = self._compiled.get(cmd)
+        if compiled is None:
+            compiled = self._compile(cmd)
+        (did_cid, dlen, layout, end, header_sum) = compiled
+        buf = self._buffer
+        buf[1] = SOP2_ANSWER if answer else SOP2_NO_ANSWER
+        buf[2:4] = did_cid
+        buf[4] = seq
+        buf[5] = dlen
+        layout.pack_into(buf, HEADER_SIZE, *values)
+        buf[end] = 255 - ((header_sum + seq + sum(self._view[HEADER_SIZE:end])) % 256)
+        return self._view[:end + 1]
+
+    def encode_payload(self, answer, did, cid, seq, payload):
+        '''
+        Encode a command with an already serialized payload
+        :param answer: (bool) whether Sphero should send a response
+        :param did: (int) device id
+        :param cid: (int) command id
+        :param seq: (int) sequence number 0-255
+        :param payload: (bytes) the data of the command
+        :return: (memoryview) the packet
+        '''
+        size = len(payload)
+        if size > MAX_PAYLOAD:
+            raise ValueError("Payload of {} bytes is too long".format(size))
+        end = HEADER_SIZE + size
+        buf = self._buffer
+        buf[1] = SOP2_ANSWER if answer else SOP2_NO_ANSWER
+        buf[2] = did
+        buf[3] = cid
+        buf[4] = seq
+        buf[5] = size + 1
+        buf[HEADER_SIZE:end] = payload
+        buf[end] = 255 - (sum(self._view[2:end]) % 256)
+        return self._view[:end + 1]
@@ -0,0 +1,141 @@
+#!/usr/bin/python3
+
+import logging
+import struct
+import time
+from collections import namedtuple
+
+logger = logging.getLogger("sphero_sprk")
+
+#async ID codes of the messages sent by the firmware
+ASYNC_POWER = 0x01
+ASYNC_SENSOR_DATA = 0x03
+ASYNC_PRE_SLEEP = 0x05
+ASYNC_MACRO_MARKER = 0x06
+ASYNC_COLLISION = 0x07
+ASYNC_ORBBASIC_PRINT = 0x08
+ASYNC_ORBBASIC_ERROR_ASCII = 0x09
+ASYNC_ORBBASIC_ERROR_BINARY = 0x0A
+
+POWER_STATES = {1: 'charging', 2: 'ok', 3: 'low', 4: 'critical'}
+
+#received is the host time.monotonic() of every event
+PowerEvent = namedtuple('PowerEvent', 'state received')
+PreSleepEvent = namedtuple('PreSleepEvent', 'received')
+MacroMarkerEvent = namedtuple('MacroMarkerEvent', 'marker macro_id command received')
+#x, y, z - acceleration of the impact, axis - bit 0 x, bit 1 y, speed - speed at the impact,
+#timestamp - ms since the robot started
+CollisionEvent = namedtuple('CollisionEvent', 'x y z axis x_magnitude y_magnitude speed timestamp received')
+OrbBasicPrintEvent = namedtuple('OrbBasicPrintEvent', 'text received')
+#ASCII errors only have the text, binary errors only the line and the error code
+OrbBasicErrorEvent = namedtuple('OrbBasicErrorEvent', 'text line code received')
+#any other async message, data is the payload without the checksum
+AsyncMessage = namedtuple('AsyncMessage', 'id_code data received')
+
+COLLISION = struct.Struct('>hhhBhhBI')
+MACRO_MARKER = struct.Struct('>BBH')
+
+
+def _payload(packet):
+    return bytes(packet[5:-1])
+
+
+def _text(packet):
+    return _payload(packet).rstrip(b'\x00').decode('utf-8', 'replace')
+
+
+def _decode_power(packet, received):
+    data = _payload(packet)
+    return PowerEvent(POWER_STATES.get(data[0], data[0]), received) if len(data) >= 1 else None
+
+
+def _decode_macro_marker(packet, received):
+    data = _payload(packet)
+    return MacroMarkerEvent(*MACRO_MARKER.unpack_from(data), received) if len(data) >= MACRO_MARKER.size else None
+
+
+def _decode_collision(packet, received):
+    data = _payload(packet)
+    return CollisionEvent(*COLLISION.unpack_from(data), received) if len(data) >= COLLISION.size else None
+
+
+def _decode_orbbasic_error_binary(packet, received):
+    data = _payload(packet)
+    if len(data) < 4:
+        return None
+    return OrbBasicErrorEvent(None, int.from_bytes(data[0:2], 'big'), int.from_bytes(data[2:4], 'big'), received)
+
+
+#async ID -> (event type, decoder returning the event or None if the payload is too short)
+DECODERS = {
+    ASYNC_POWER: (PowerEvent, _decode_power),
+    ASYNC_PRE_SLEEP: (PreSleepEvent, lambda packet, received: PreSleepEvent(received)),
+    ASYNC_MACRO_MARKER: (MacroMarkerEvent, _decode_macro_marker),
+    ASYNC_COLLISION: (CollisionEvent, _decode_collision),
+    ASYNC_ORBBASIC_PRINT: (OrbBasicPrintEvent, lambda packet, received: OrbBasicPrintEvent(_text(packet), received)),
+    ASYNC_ORBBASIC_ERROR_ASCII: (OrbBasicErrorEvent,
+                                 lambda packet, received: OrbBasicErrorEvent(_text(packet), None, None, received)),
+    ASYNC_ORBBASIC_ERROR_BINARY: (OrbBasicErrorEvent, _decode_orbbasic_error_binary),
+}
+
+
+class AsyncRouter(object):
+    """
+    Decodes the async messages other than sensor data into typed events and calls the subscribers of
+    their type. A message is only decoded when its type has subscribers, except the OrbBasic output which
+    is logged to the "sphero_sprk" logger when nobody listens to it.
+
+        router.subscribe(CollisionEvent, lambda event: print(event.speed))
+
+    Subscribers of AsyncMessage receive the messages no decoder knows.
+    """
+
+    def __init__(self, metrics=None):
+        self._subscribers = {}
+        self.metrics = metrics
+
+    def subscribe(self, event_type, callback):
+        callbacks = self._subscribers.setdefault(event_type, [])
+        if callback not in callbacks:
+            callbacks.append(callback)
+
+    def unsubscribe(self, event_type, callback):
+        callbacks = self._subscribers.get(event_type, [])
+        if callback in callbacks:
+            callbacks.remove(callback)
+
+    def subscribers(self, event_type):
+        return len(self._subscribers.get(event_type, ()))
+
+    def dispatch(self, packet):
+        '''
+        Decode an async packet and call the subscribers of its event type
+        :return: (bool) False if the message is unknown and nobody subscribed to AsyncMessage
+        '''
+        id_code = packet[2]
+        entry = DECODERS.get(id_code)
+        if entry is None:
+            callbacks = self._subscribers.get(AsyncMessage)
+            if not callbacks:
+                return False
+            event = AsyncMessage(id_code, _payload(packet), time.monotonic())
+        else:
+            (event_type, decode) = entry
+            callbacks = self._subscribers.get(event_type)
+            if not callbacks and event_type not in (OrbBasicPrintEvent, OrbBasicErrorEvent):
+                return True
+            event = decode(packet, time.monotonic())
+            if event is None:
+                if self.metrics is not None:
+                    self.metrics.problem('length_mismatches', "async message %s is too short", bytes(packet).hex())
+                return True
+            if not callbacks:
+                if event_type is OrbBasicPrintEvent:
+                    logger.info("orbBasic: %s", event.text)
+                else:
+                    logger.warning("orbBasic error: %s", event.text if event.text is not None else
+                                   "line {} code {}".format(event.line, event.code))
+                return True
+        for callback in list(callbacks):
+            callback(event)
+        return True
@@ -0,0 +1,174 @@
+#!/usr/bin/python3
+
+import threading
+import time
+
+from sphero_sprk.sphero import Sphero
+
+
+class SpheroFleet(object):
+    """
+    Connects and drives several Spheros at the same time.
+
+    Robots are connected concurrently, with at most per_adapter connections in progress on each HCI adapter
+    (BlueZ handles one LE connection attempt at a time per controller, more only queue up in the kernel).
+    A failed or timed out attempt is retried after an exponential backoff, a timed out attempt keeps its
+    slot until the connect running in the background returns. The broadcast helpers release
+    one thread per robot from a barrier, so the writes of the robots start at nearly the same time.
+    """
+
+    def __init__(self, addresses, per_adapter=1, timeout=5.0, retries=2, backoff=0.5, peripheral_factory=None):
+        '''
+        :param addresses: (list) MAC addresses, or (address, iface) tuples to pick the HCI adapter of a robot
+        :param per_adapter: (int) connections in progress at the same time on one adapter
+        :param timeout: (float) seconds for one connection attempt
+        :param retries: (int) attempts after the first one
+        :param backoff: (float) seconds before the first retry, doubled on every retry
+        :param peripheral_factory: (function) see Sphero
+        '''
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.per_adapter = per_adapter
+        self._robots = {}
+        for address in addresses:
+            (addr, iface) = address if isinstance(address, tuple) else (address, None)
+            self._robots[addr] = Sphero(addr, peripheral_factory=peripheral_factory, iface=iface)
+        self._adapters = {}
+        for robot in self._robots.values():
+            if robot._iface not in self._adapters:
+                self._adapters[robot._iface] = threading.BoundedSemaphore(per_adapter)
+        self.report = {}
+        self.last_skew = None
+
+    def __len__(self):
+        return len(self.connected())
+
+    def __iter__(self):
+        return iter(self.connected())
+
+    def __getitem__(self, addr):
+        return self._robots[addr]
+
+    def connected(self):
+        return [robot for robot in self._robots.values() if robot._connected]
+
+    @staticmethod
+    def _release_twice(adapter):
+        '''
+        :return: (function) releases the adapter on its second call
+        '''
+        lock = threading.Lock()
+        calls = [0]
+
+        def release():
+            with lock:
+                calls[0] += 1
+                last = calls[0] == 2
+            if last:
+                adapter.release()
+        return release
+
+    def _connect_one(self, addr, robot):
+        adapter = self._adapters[robot._iface]
+        start = time.monotonic()
+        entry = {'connected': False, 'attempts': 0, 'latency': None, 'total': None, 'errors': []}
+        for attempt in range(self.retries + 1):
+            if attempt > 0:
+                time.sleep(self.backoff * 2 ** (attempt - 1))
+            adapter.acquire()
+            #the slot is freed once the attempt is over for us and for the adapter: a timed out connect
+            #keeps running in its worker thread and still occupies the controller
+            release = SpheroFleet._release_twice(adapter)
+            entry['attempts'] += 1
+            attempt_start = time.monotonic()
+            try:
+                robot.connect(self.timeout, on_attempt_done=release)
+            except Exception as e:
+                entry['errors'].append(repr(e))
+                continue
+            finally:
+                release()
+            entry['connected'] = True
+            entry['latency'] = time.monotonic() - attempt_start
+            break
+        entry['total'] = time.monotonic() - start
+        self.report[addr] = entry
+
+    def connect(self):
+        '''
+        Connect every robot that isn't connected yet
+        :return: (dict) address -> report of the connection: connected, attempts, latency of the successful
+            attempt and total seconds including retries, errors of the failed attempts
+        '''
+        threads = []
+        for (addr, robot) in self._robots.items():
+            if robot._connected:
+                continue
+            thread = threading.Thread(target=self._connect_one, args=(addr, robot), name="sphero-connect-" + addr)
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        return self.report
+
+    def metrics(self):
+        '''
+        :return: (list of Metrics) of every robot, e.g. for metrics.PrometheusExporter(fleet.metrics, port=9477)
+        '''
+        return [robot.metrics for robot in self._robots.values()]
+
+    def disconnect(self):
+        for robot in self.connected():
+            try:
+                robot.disconnect()
+            except Exception:
+                pass
+
+    def broadcast(self, method, *args, **kwargs):
+        '''
+        Call a method of every connected robot at the same time
+        :param method: (str) name of the Sphero method, e.g. "roll"
+        :return: (dict) address -> result, or the exception raised for that robot
+        '''
+        robots = self.connected()
+        if len(robots) == 0:
+            return {}
+        barrier = threading.Barrier(len(robots))
+        results = {}
+        started = {}
+
+        def call(robot):
+            barrier.wait()
+            started[robot._addr] = time.monotonic()
+            try:
+                results[robot._addr] = getattr(robot, method)(*args, **kwargs)
+            except Exception as e:
+                results[robot._addr] = e
+
+        threads = [threading.Thread(target=call, args=(robot,)) for robot in robots]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.last_skew = max(started.values()) - min(started.values())
+        return results
+
+    def roll(self, speed, heading, resp=False):
+        return self.broadcast("roll", speed, heading, resp=resp)
+
+    def set_rgb_led(self, red, green, blue, persist=False, resp=False):
+        return self.broadcast("set_rgb_led", red, green, blue, persist=persist, resp=resp)
+
+    def set_raw_motor_values(self, lmode, lpower, rmode, rpower, resp=False):
+        return self.broadcast("set_raw_motor_values", lmode, lpower, rmode, rpower, resp=resp)
+
+    def set_tail_light(self, brightness, resp=False):
+        return self.broadcast("set_tail_light", brightness, resp=resp)
+
+    def ping(self):
+        return self.broadcast("ping")
+
+    def upload_orb_basic_program(self, program, area="00", force=False):
+        return self.broadcast("upload_orb_basic_program", program, area=area, force=force)
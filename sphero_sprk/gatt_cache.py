@@ -0,0 +1,86 @@
+#!/usr/bin/python3
+
+import json
+import threading
+
+import sphero_sprk.util as util
+
+
+class HandleCharacteristic(object):
+    """
+    Writes to a characteristic by its value handle, without discovering the service first.
+    Has the write() of bluepy.btle.Characteristic.
+    """
+
+    __slots__ = ('peripheral', 'valHandle')
+
+    def __init__(self, peripheral, handle):
+        self.peripheral = peripheral
+        self.valHandle = handle
+
+    def getHandle(self):
+        return self.valHandle
+
+    def write(self, val, withResponse=False):
+        return self.peripheral.writeCharacteristic(self.valHandle, val, withResponse)
+
+
+class GattHandleCache(object):
+    """
+    Value handles of the characteristics of each robot, by address and hex UUID.
+
+    The handles of a peripheral don't change between connections, so a reconnect can write to them
+    without enumerating the services again. With a path the cache is kept in a JSON file as well.
+    """
+
+    def __init__(self, path=None):
+        '''
+        :param path: (str) JSON file of the on-disk cache, None keeps it in memory
+        '''
+        self.path = path
+        self._lock = threading.Lock()
+        #one save at a time, so an older snapshot never replaces a newer one
+        self._save_lock = threading.Lock()
+        self._handles = {}
+        if path is not None:
+            self.load()
+
+    def get(self, addr):
+        '''
+        :return: (dict) hex UUID -> value handle, None if the robot isn't cached
+        '''
+        with self._lock:
+            handles = self._handles.get(addr)
+            return None if handles is None else dict(handles)
+
+    def put(self, addr, handles):
+        with self._lock:
+            self._handles[addr] = dict(handles)
+        if self.path is not None:
+            self.save()
+
+    def forget(self, addr):
+        with self._lock:
+            found = self._handles.pop(addr, None) is not None
+        if found and self.path is not None:
+            self.save()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            for (addr, handles) in data.items():
+                self._handles.setdefault(addr, dict(handles))
+
+    def save(self):
+        with self._save_lock:
+            with self._lock:
+                data = dict(self._handles)
+            util.write_file_atomic(self.path, json.dumps(data))
+
+
+#shared by every Sphero that isn't given its own cache
+HANDLE_CACHE = GattHandleCache()
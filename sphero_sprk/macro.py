@@ -0,0 +1,205 @@
+#!/usr/bin/python3
+
+import contextlib
+import struct
+
+from sphero_sprk.sphero_constants import MACRO_CODES
+
+#argument layout of the opcodes of MACRO_CODES, big endian. PCD is the post command delay in ms (0-255).
+#Only the commands the builder emits and the flow control are covered, not every opcode of the firmware
+MACRO_LAYOUTS = {
+    MACRO_CODES.END: '>',
+    MACRO_CODES.SET_SD1: '>H',                  # system delay 1 in ms
+    MACRO_CODES.SET_SD2: '>H',                  # system delay 2 in ms
+    MACRO_CODES.SET_STABILIZATION: '>BB',       # flag, PCD
+    MACRO_CODES.SET_HEADING: '>HB',             # heading, PCD
+    MACRO_CODES.ROLL: '>BHB',                   # speed, heading, PCD
+    MACRO_CODES.SET_RGB_LED: '>BBBB',           # red, green, blue, PCD
+    MACRO_CODES.SET_BACK_LED: '>BB',            # brightness, PCD
+    MACRO_CODES.SET_RAW_MOTORS: '>BBBBB',       # left mode, left power, right mode, right power, PCD
+    MACRO_CODES.DELAY: '>H',                    # ms
+    MACRO_CODES.GOTO: '>B',                     # macro id
+    MACRO_CODES.GOSUB: '>B',                    # macro id
+    MACRO_CODES.SLEEP: '>H',                    # seconds until waking up, 0 sleeps until a tap
+    MACRO_CODES.SET_SPD1: '>B',                 # system speed 1
+    MACRO_CODES.SET_SPD2: '>B',                 # system speed 2
+    MACRO_CODES.ROLL_SD1: '>BH',                # speed, heading, then SD1
+    MACRO_CODES.SET_RGB_LED_SD2: '>BBB',        # red, green, blue, then SD2
+    MACRO_CODES.SET_ROTATION_RATE: '>B',        # rate
+    MACRO_CODES.FADE_TO_LED: '>BBBH',           # red, green, blue, duration in ms
+    MACRO_CODES.EMIT_MARKER: '>B',              # marker, sent as an async message
+    MACRO_CODES.WAIT_UNTIL_STOPPED: '>H',       # timeout in ms
+    MACRO_CODES.ROTATE_OVER_TIME: '>hH',        # angle in degrees, duration in ms
+    MACRO_CODES.LOOP_START: '>B',               # count
+    MACRO_CODES.LOOP_END: '>',
+    MACRO_CODES.COMMENT: '>H',                  # length, followed by the text
+}
+
+_STRUCTS = dict((code, struct.Struct(fmt)) for (code, fmt) in MACRO_LAYOUTS.items())
+
+#commands whose last argument is a delay in ms
+TIMED_CODES = (
+    MACRO_CODES.SET_STABILIZATION, MACRO_CODES.SET_HEADING, MACRO_CODES.ROLL, MACRO_CODES.SET_RGB_LED,
+    MACRO_CODES.SET_BACK_LED, MACRO_CODES.SET_RAW_MOTORS, MACRO_CODES.DELAY, MACRO_CODES.FADE_TO_LED,
+    MACRO_CODES.ROTATE_OVER_TIME,
+)
+
+#id of the macro saved with CMD_SAVE_TEMP_MACRO
+TEMP_MACRO_ID = 255
+
+
+class MacroBuilder(object):
+    """
+    Builds the bytecode of a macro, so timing critical motion runs on the robot without a round trip per step.
+
+        macro = MacroBuilder()
+        with macro.loop(3):
+            macro.set_rgb_led(255, 0, 0).roll(80, 0).delay(1000)
+            macro.fade_to_led(0, 0, 255, 500).roll(80, 180).delay(1000)
+        macro.roll(0, 0)
+        orb.upload_macro(macro)
+        orb.run_macro(TEMP_MACRO_ID)
+
+    Every method returns the builder. compile() terminates the macro with END.
+    """
+
+    def __init__(self):
+        self._code = bytearray()
+        self._loops = 0
+
+    def emit(self, code, *args):
+        '''
+        Append any opcode of MACRO_CODES with its arguments (see MACRO_LAYOUTS)
+        '''
+        self._code.append(code.value)
+        self._code += _STRUCTS[code].pack(*args)
+        return self
+
+    def roll(self, speed, heading, pcd=0):
+        return self.emit(MACRO_CODES.ROLL, speed, heading % 360, pcd)
+
+    def stop(self, pcd=0):
+        return self.roll(0, 0, pcd)
+
+    def set_heading(self, heading, pcd=0):
+        return self.emit(MACRO_CODES.SET_HEADING, heading % 360, pcd)
+
+    def set_stabilization(self, flag, pcd=0):
+        return self.emit(MACRO_CODES.SET_STABILIZATION, 1 if flag else 0, pcd)
+
+    def set_rgb_led(self, red, green, blue, pcd=0):
+        return self.emit(MACRO_CODES.SET_RGB_LED, red, green, blue, pcd)
+
+    def set_back_led(self, brightness, pcd=0):
+        return self.emit(MACRO_CODES.SET_BACK_LED, brightness, pcd)
+
+    def set_raw_motor_values(self, lmode, lpower, rmode, rpower, pcd=0):
+        return self.emit(MACRO_CODES.SET_RAW_MOTORS, lmode, lpower, rmode, rpower, pcd)
+
+    def set_rotation_rate(self, rate):
+        return self.emit(MACRO_CODES.SET_ROTATION_RATE, rate)
+
+    def delay(self, ms):
+        return self.emit(MACRO_CODES.DELAY, ms)
+
+    def fade_to_led(self, red, green, blue, ms):
+        return self.emit(MACRO_CODES.FADE_TO_LED, red, green, blue, ms)
+
+    def rotate_over_time(self, angle, ms):
+        return self.emit(MACRO_CODES.ROTATE_OVER_TIME, angle, ms)
+
+    def wait_until_stopped(self, timeout_ms):
+        return self.emit(MACRO_CODES.WAIT_UNTIL_STOPPED, timeout_ms)
+
+    def emit_marker(self, marker):
+        return self.emit(MACRO_CODES.EMIT_MARKER, marker)
+
+    def comment(self, text):
+        data = text.encode("utf-8")
+        self.emit(MACRO_CODES.COMMENT, len(data))
+        self._code += data
+        return self
+
+    @contextlib.contextmanager
+    def loop(self, count):
+        '''
+        Repeat the commands of the block count times, loops can't be nested
+        '''
+        if self._loops > 0:
+            raise ValueError("Macro loops can't be nested")
+        if not 1 <= count <= 255:
+            raise ValueError("Loop count must be between 1 and 255")
+        self._loops += 1
+        self.emit(MACRO_CODES.LOOP_START, count)
+        try:
+            yield self
+        finally:
+            self._loops -= 1
+        self.emit(MACRO_CODES.LOOP_END)
+
+    def compile(self):
+        '''
+        :return: (bytes) the bytecode, terminated with END
+        '''
+        if self._loops > 0:
+            raise ValueError("Loop not closed")
+        return bytes(self._code) + bytes([MACRO_CODES.END.value])
+
+    def __len__(self):
+        return len(self._code) + 1
+
+    @property
+    def duration(self):
+        '''
+        (int) ms the macro takes at least, see macro_duration()
+        '''
+        return macro_duration(self._code)
+
+
+def disassemble(code):
+    '''
+    :param code: (bytes) macro bytecode
+    :return: (list) (MACRO_CODES, arguments) of every command up to END, the text of a COMMENT is its argument
+    :raises ValueError: on an opcode missing from MACRO_CODES or a truncated command
+    '''
+    commands = []
+    i = 0
+    while i < len(code):
+        try:
+            opcode = MACRO_CODES(code[i])
+        except ValueError:
+            raise ValueError("Unsupported macro opcode {:#04x} at offset {}".format(code[i], i))
+        layout = _STRUCTS[opcode]
+        if i + 1 + layout.size > len(code):
+            raise ValueError("Macro command {} at offset {} is truncated".format(opcode.name, i))
+        args = layout.unpack_from(code, i + 1)
+        i += 1 + layout.size
+        if opcode == MACRO_CODES.COMMENT:
+            length = args[0]
+            args = (bytes(code[i:i + length]).decode("utf-8"),)
+            i += length
+        commands.append((opcode, args))
+        if opcode == MACRO_CODES.END:
+            break
+    return commands
+
+
+def macro_duration(code):
+    '''
+    :param code: (bytes) macro bytecode
+    :return: (int) ms of the delays of the macro, loops included (system delays and waits are not counted)
+    '''
+    total = 0
+    loop = None
+    for (opcode, args) in disassemble(code):
+        if opcode == MACRO_CODES.LOOP_START:
+            loop = [args[0], 0]
+        elif opcode == MACRO_CODES.LOOP_END and loop is not None:
+            total += loop[0] * loop[1]
+            loop = None
+        elif opcode in TIMED_CODES:
+            if loop is None:
+                total += args[-1]
+            else:
+                loop[1] += args[-1]
+    return total
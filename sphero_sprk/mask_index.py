@@ -0,0 +1,146 @@
+#!/usr/bin/python3
+
+import struct
+
+from sphero_sprk.stream_decoder import mask_value
+
+# N, M, MASK, PCNT, MASK2 of CMD_SET_DATA_STREAMING
+STREAMING_PAYLOAD = struct.Struct('>HHIBI')
+
+
+class MaskIndex(object):
+    """
+    Precompiled index of the stream masks: group or field name -> (mask id, 32 bit int)
+
+    Groups are looked up by name ('odometer'), fields by group and name ('odometer.x').
+    """
+
+    def __init__(self, mask_list1, mask_list2):
+        self._entries = {}
+        for (mask_id, mask_list) in ((1, mask_list1), (2, mask_list2)):
+            for group in mask_list:
+                group_bits = 0
+                for value in group["values"]:
+                    bit = mask_value(value["mask"])
+                    group_bits |= bit
+                    self._entries["{}.{}".format(group["name"], value["name"])] = (mask_id, bit)
+                self._entries[group["name"]] = (mask_id, group_bits)
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def lookup(self, name):
+        '''
+        :param name: (str) group ('accel_filtered') or field ('accel_filtered.x')
+        :return: (tuple) mask id (1 or 2) and the bits of the mask
+        '''
+        entry = self._entries.get(name)
+        if entry is None:
+            raise ValueError("Unknown stream group or field {}".format(name))
+        return entry
+
+    def mask_id(self, name):
+        return self.lookup(name)[0]
+
+    def names(self):
+        return list(self._entries)
+
+
+class StreamMask(object):
+    """
+    MASK1 and MASK2 of the sensor stream with reference counted subscriptions.
+
+    Every (name, subscriber) pair holds a reference on the bits of the name, a bit is set while it has
+    at least one reference and cleared with & ~ when the last one is released. Subscribing the same
+    pair twice is a no-op, so the masks never get bits that nobody asked for or lose bits still in use.
+    """
+
+    def __init__(self, index):
+        self._index = index
+        self.mask1 = 0
+        self.mask2 = 0
+        self._subscriptions = {}  # (name, subscriber) -> (mask id, bits)
+        self._bit_refs = {}  # (mask id, bit) -> references
+
+    def masks(self):
+        return (self.mask1, self.mask2)
+
+    def _bits(self, bits):
+        while bits:
+            bit = bits & -bits
+            yield bit
+            bits ^= bit
+
+    def add(self, name, subscriber=None):
+        '''
+        Subscribe to a group or field
+        :return: (bool) True if the masks changed
+        '''
+        key = (name, subscriber)
+        if key in self._subscriptions:
+            return False
+        (mask_id, bits) = self._index.lookup(name)
+        self._subscriptions[key] = (mask_id, bits)
+        changed = 0
+        for bit in self._bits(bits):
+            refs = self._bit_refs.get((mask_id, bit), 0)
+            self._bit_refs[(mask_id, bit)] = refs + 1
+            if refs == 0:
+                changed |= bit
+        if mask_id == 1:
+            self.mask1 |= changed
+        else:
+            self.mask2 |= changed
+        return changed != 0
+
+    def remove(self, name, subscriber=None):
+        '''
+        Release the subscription of a group or field
+        :return: (bool) True if the masks changed
+        '''
+        entry = self._subscriptions.pop((name, subscriber), None)
+        if entry is None:
+            return False
+        (mask_id, bits) = entry
+        changed = 0
+        for bit in self._bits(bits):
+            refs = self._bit_refs[(mask_id, bit)] - 1
+            if refs == 0:
+                del self._bit_refs[(mask_id, bit)]
+                changed |= bit
+            else:
+                self._bit_refs[(mask_id, bit)] = refs
+        if mask_id == 1:
+            self.mask1 &= ~changed
+        else:
+            self.mask2 &= ~changed
+        return changed != 0
+
+    def remove_subscriber(self, subscriber):
+        '''
+        Release every subscription of a subscriber
+        :return: (bool) True if the masks changed
+        '''
+        changed = False
+        for (name, owner) in [key for key in self._subscriptions if key[1] == subscriber]:
+            changed = self.remove(name, owner) or changed
+        return changed
+
+    def subscribers(self, name):
+        return [owner for (sub_name, owner) in self._subscriptions if sub_name == name]
+
+    def clear(self):
+        self._subscriptions = {}
+        self._bit_refs = {}
+        self.mask1 = 0
+        self.mask2 = 0
+
+    def pack(self, rate, samples=1, packets=0):
+        '''
+        Payload of CMD_SET_DATA_STREAMING for the current masks
+        :param rate: (int) frames per second, the divisor N is 400 / rate
+        :param samples: (int) samples per frame (M)
+        :param packets: (int) number of frames to send, 0 streams forever (PCNT)
+        :return: (bytes) the payload
+        '''
+        return STREAMING_PAYLOAD.pack(int(400 / rate), samples, self.mask1, packets, self.mask2)
@@ -0,0 +1,52 @@
+#!/usr/bin/python3
+"""
+The stream mask schema, parsed once per process.
+
+data/mask_list1.yaml and data/mask_list2.yaml are the source, they are compiled into _mask_data.py so
+importing the package needs neither yaml nor any file parsing. After editing the YAML files run:
+
+    python -m sphero_sprk.mask_schema
+"""
+
+import os
+
+from sphero_sprk._mask_data import MASK_LIST1, MASK_LIST2
+from sphero_sprk.mask_index import MaskIndex
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+GENERATED_MODULE = os.path.join(os.path.dirname(__file__), '_mask_data.py')
+
+# shared by every Sphero
+MASK_INDEX = MaskIndex(MASK_LIST1, MASK_LIST2)
+# compiled StreamLayouts keyed by (mask1, mask2), shared by every StreamDecoder of the schema
+LAYOUT_CACHE = {}
+
+
+def load_yaml_schema(data_dir=DATA_DIR):
+    '''
+    Parse the YAML source of the schema
+    :return: (tuple) mask list 1 and mask list 2
+    '''
+    import yaml
+    with open(os.path.join(data_dir, 'mask_list1.yaml'), 'r') as mask_file1:
+        mask_list1 = yaml.safe_load(mask_file1)
+    with open(os.path.join(data_dir, 'mask_list2.yaml'), 'r') as mask_file2:
+        mask_list2 = yaml.safe_load(mask_file2)
+    return (mask_list1, mask_list2)
+
+
+def generate_module_source(mask_list1, mask_list2):
+    import pprint
+    return ('# Generated from data/mask_list1.yaml and data/mask_list2.yaml by '
+            '"python -m sphero_sprk.mask_schema", do not edit\n\n'
+            'MASK_LIST1 = {}\n\nMASK_LIST2 = {}\n').format(pprint.pformat(mask_list1), pprint.pformat(mask_list2))
+
+
+def regenerate(path=GENERATED_MODULE, data_dir=DATA_DIR):
+    (mask_list1, mask_list2) = load_yaml_schema(data_dir)
+    with open(path, 'w') as module_file:
+        module_file.write(generate_module_source(mask_list1, mask_list2))
+
+
+if __name__ == '__main__':
+    regenerate()
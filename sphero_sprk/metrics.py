@@ -0,0 +1,299 @@
+#!/usr/bin/python3
+
+import bisect
+import logging
+import threading
+import time
+
+import sphero_sprk.util as util
+
+logger = logging.getLogger("sphero_sprk")
+
+#upper bounds of the round trip time buckets in seconds, +Inf is implied
+RTT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram(object):
+    """
+    Fixed bucket histogram, cumulative counts like the Prometheus histograms
+    """
+
+    __slots__ = ('bounds', 'counts', 'count', 'sum', 'max')
+
+    def __init__(self, bounds=RTT_BUCKETS):
+        self.bounds = tuple(bounds)
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+        if value > self.max:
+            self.max = value
+
+    def quantile(self, q):
+        '''
+        Upper bound of the bucket holding the q quantile, max for the +Inf bucket
+        '''
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        total = 0
+        for (i, count) in enumerate(self.counts):
+            total += count
+            if total >= rank and count > 0:
+                return self.bounds[i] if i < len(self.bounds) else self.max
+        return self.max
+
+    def cumulative(self):
+        '''
+        :return: (list) (upper bound, count of values <= bound) pairs, the last bound is float('inf')
+        '''
+        result = []
+        total = 0
+        for (bound, count) in zip(self.bounds + (float('inf'),), self.counts):
+            total += count
+            result.append((bound, total))
+        return result
+
+    def as_dict(self):
+        return {
+            'count': self.count,
+            'sum': self.sum,
+            'max': self.max,
+            'p50': self.quantile(0.5),
+            'p99': self.quantile(0.99),
+        }
+
+
+class Metrics(object):
+    """
+    Counters of one connection: TX/RX traffic, round trip times per command, health of the sensor stream
+    and the packets that couldn't be used.
+
+    Problems are logged to the "sphero_sprk" logger at most once per log_interval seconds for each kind,
+    the rest is only counted.
+    """
+
+    COUNTERS = (
+        'tx_packets', 'tx_bytes', 'tx_writes',
+        'rx_notifications', 'rx_bytes', 'rx_packets',
+        'stream_frames', 'unknown_responses', 'unknown_async', 'length_mismatches', 'late_responses',
+        'error_responses', 'setpoint_errors', 'tx_errors',
+    )
+
+    def __init__(self, name=None, log_interval=10.0):
+        '''
+        :param name: (str) label of the connection, e.g. the address of the robot
+        :param log_interval: (float) seconds between two log messages of the same kind
+        '''
+        self.name = name
+        self.log_interval = log_interval
+        for counter in Metrics.COUNTERS:
+            setattr(self, counter, 0)
+        self.rtt = {}
+        self.tx_latency = {}  # priority -> Histogram of the seconds packets waited in the TransmitQueue
+        #new histograms are added by the pump and the queue threads while an exporter reads them
+        self._histograms_lock = threading.Lock()
+        self.stream_fps = 0.0
+        self.stream_jitter = 0.0
+        self._last_frame = None
+        self._interval = None
+        self._last_log = {}
+        self._suppressed = {}
+        self._sources = {}
+
+    def add_source(self, name, function):
+        '''
+        Add the dict returned by function to the snapshot, e.g. the counters of the reassembler
+        '''
+        self._sources[name] = function
+
+    def observe_rtt(self, command, seconds):
+        self._histogram(self.rtt, command).observe(seconds)
+
+    def observe_tx_latency(self, priority, seconds):
+        self._histogram(self.tx_latency, priority).observe(seconds)
+
+    def _histogram(self, histograms, key):
+        histogram = histograms.get(key)
+        if histogram is None:
+            with self._histograms_lock:
+                histogram = histograms.setdefault(key, Histogram())
+        return histogram
+
+    def histograms(self, attribute):
+        '''
+        :param attribute: (str) 'rtt' or 'tx_latency'
+        :return: (list) (key, Histogram) pairs, safe to iterate while other threads observe
+        '''
+        with self._histograms_lock:
+            return list(getattr(self, attribute).items())
+
+    def frame(self, timestamp):
+        '''
+        Count a sensor frame, the rate and the jitter are smoothed like the interarrival jitter of RTP (RFC 3550)
+        '''
+        self.stream_frames += 1
+        last = self._last_frame
+        self._last_frame = timestamp
+        if last is None:
+            return
+        interval = timestamp - last
+        if self._interval is None:
+            self._interval = interval
+        else:
+            self.stream_jitter += (abs(interval - self._interval) - self.stream_jitter) / 16.0
+            self._interval += (interval - self._interval) / 16.0
+        if self._interval > 0:
+            self.stream_fps = 1.0 / self._interval
+
+    def problem(self, counter, message, *args):
+        '''
+        Count a problem and log it unless the same kind was logged less than log_interval seconds ago
+        '''
+        setattr(self, counter, getattr(self, counter) + 1)
+        now = time.monotonic()
+        last = self._last_log.get(counter)
+        if last is not None and now - last < self.log_interval:
+            self._suppressed[counter] = self._suppressed.get(counter, 0) + 1
+            return
+        suppressed = self._suppressed.pop(counter, 0)
+        self._last_log[counter] = now
+        if suppressed > 0:
+            message += " ({} more since the last message)".format(suppressed)
+        logger.warning("%s: " + message, self.name, *args)
+
+    def snapshot(self):
+        '''
+        :return: (dict) copy of every counter, the round trip times per command and the sources
+        '''
+        data = dict((counter, getattr(self, counter)) for counter in Metrics.COUNTERS)
+        data['name'] = self.name
+        data['stream_fps'] = self.stream_fps
+        data['stream_jitter'] = self.stream_jitter
+        data['rtt'] = dict((command, histogram.as_dict()) for (command, histogram) in self.histograms('rtt'))
+        data['tx_latency'] = dict((priority, histogram.as_dict())
+                                  for (priority, histogram) in self.histograms('tx_latency'))
+        for (name, function) in self._sources.items():
+            data[name] = dict(function())
+        return data
+
+
+def _labels(labels):
+    return ",".join('{}="{}"'.format(key, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                    for (key, value) in labels)
+
+
+def prometheus_text(metrics_list, prefix="sphero"):
+    '''
+    Format the metrics of several connections in the Prometheus text exposition format
+    :param metrics_list: (list of Metrics)
+    :return: (str) the text
+    '''
+    lines = []
+    for counter in Metrics.COUNTERS:
+        lines.append("# TYPE {}_{}_total counter".format(prefix, counter))
+        for metrics in metrics_list:
+            lines.append("{}_{}_total{{{}}} {}".format(prefix, counter, _labels([('robot', metrics.name)]),
+                                                       getattr(metrics, counter)))
+    for gauge in ('stream_fps', 'stream_jitter'):
+        lines.append("# TYPE {}_{} gauge".format(prefix, gauge))
+        for metrics in metrics_list:
+            lines.append("{}_{}{{{}}} {}".format(prefix, gauge, _labels([('robot', metrics.name)]), getattr(metrics, gauge)))
+    for (name, attribute, label) in (('rtt_seconds', 'rtt', 'command'), ('tx_queue_seconds', 'tx_latency', 'priority')):
+        lines.append("# TYPE {}_{} histogram".format(prefix, name))
+        for metrics in metrics_list:
+            for (key, histogram) in sorted(metrics.histograms(attribute)):
+                labels = [('robot', metrics.name), (label, key)]
+                for (bound, count) in histogram.cumulative():
+                    le = "+Inf" if bound == float('inf') else repr(bound)
+                    lines.append("{}_{}_bucket{{{}}} {}".format(prefix, name, _labels(labels + [('le', le)]), count))
+                lines.append("{}_{}_sum{{{}}} {}".format(prefix, name, _labels(labels), histogram.sum))
+                lines.append("{}_{}_count{{{}}} {}".format(prefix, name, _labels(labels), histogram.count))
+    return "\n".join(lines) + "\n"
+
+
+class PrometheusExporter(object):
+    """
+    Publishes the metrics of robots in the Prometheus text format, either by rewriting a file every
+    interval seconds (for the textfile collector of node_exporter) or on a local HTTP endpoint.
+
+        exporter = PrometheusExporter(lambda: [robot.metrics for robot in fleet], port=9477).start()
+    """
+
+    def __init__(self, source, path=None, port=None, host="127.0.0.1", interval=5.0):
+        '''
+        :param source: (list of Metrics or function returning one) the connections to export
+        :param path: (str) file to write
+        :param port: (int) port of the HTTP endpoint, served on every path
+        :param host: (str) address the HTTP endpoint listens on
+        :param interval: (float) seconds between two writes of the file
+        '''
+        if path is None and port is None:
+            raise ValueError("Give a path or a port")
+        self._source = source
+        self.path = path
+        self.port = port
+        self.host = host
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = None
+        self._server = None
+
+    def text(self):
+        metrics_list = self._source() if callable(self._source) else self._source
+        return prometheus_text(metrics_list)
+
+    def write(self):
+        util.write_file_atomic(self.path, self.text())
+
+    def _write_loop(self):
+        while not self._stop_event.is_set():
+            try:
+                self.write()
+            except OSError as e:
+                logger.warning("Could not write the metrics to %s: %s", self.path, e)
+            self._stop_event.wait(self.interval)
+
+    def start(self):
+        if self.path is not None:
+            self._thread = threading.Thread(target=self._write_loop, name="sphero-metrics-file")
+            self._thread.daemon = True
+            self._thread.start()
+        if self.port is not None:
+            #imported here, only the HTTP endpoint needs it
+            from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+            exporter = self
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    body = exporter.text().encode("utf-8")
+                    self.send_response(200)
+                    self.send_header("Content-Type", "text/plain; version=0.0.4")
+                    self.send_header("Content-Length", str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    pass
+
+            self._server = ThreadingHTTPServer((self.host, self.port), Handler)
+            self.port = self._server.server_address[1]
+            server_thread = threading.Thread(target=self._server.serve_forever, name="sphero-metrics-http")
+            server_thread.daemon = True
+            server_thread.start()
+        return self
+
+    def stop(self):
+        self._stop_event.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
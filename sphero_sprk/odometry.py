@@ -0,0 +1,248 @@
+#!/usr/bin/python3
+
+import threading
+import time
+from collections import namedtuple
+
+from sphero_sprk.sphero_constants import CMD_CODES
+
+#x, y in cm, vx, vy in cm/s, yaw in degrees (None if not streamed), timestamp is time.monotonic()
+Pose = namedtuple('Pose', 'timestamp x y vx vy yaw')
+
+#stream groups the estimator uses
+ESTIMATOR_GROUPS = ('odometer', 'velocity', 'imu_filtered')
+
+
+def _angle_between(a, b, ratio):
+    '''
+    Interpolate between two angles in degrees on the shorter arc, result in -180..180
+    '''
+    diff = (b - a + 180.0) % 360.0 - 180.0
+    return (a + diff * ratio + 180.0) % 360.0 - 180.0
+
+
+class StateEstimator(object):
+    """
+    Pose and velocity of a robot over the last `capacity` updates.
+
+    Fed by the odometer, velocity and imu_filtered groups of the sensor stream, or by CMD_READ_LOCATOR
+    when the stream is off (see LocatorPoller). The history is a ring of parallel lists ordered by time,
+    pose_at(t) finds the neighbours of t with a binary search and interpolates between them, a time after
+    the last update is extrapolated with the last velocity.
+
+        estimator = StateEstimator(orb)
+        orb.update_streaming(rate=50)
+        estimator.pose_at(time.monotonic() + 0.05)
+    """
+
+    def __init__(self, sphero=None, capacity=1024):
+        '''
+        :param sphero: (Sphero) attach to the frame stream of this Sphero, None to feed update() yourself
+        :param capacity: (int) number of poses to keep
+        '''
+        if capacity < 2:
+            raise ValueError("capacity must be at least 2")
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self._time = [0.0] * capacity
+        self._x = [0.0] * capacity
+        self._y = [0.0] * capacity
+        self._vx = [0.0] * capacity
+        self._vy = [0.0] * capacity
+        self._yaw = [None] * capacity
+        self._start = 0
+        self._count = 0
+        self.last_frame = None  # time.monotonic() of the last stream frame
+        self._sphero = None
+        if sphero is not None:
+            self.attach(sphero)
+
+    def attach(self, sphero, groups=ESTIMATOR_GROUPS):
+        self.detach()
+        self._sphero = sphero
+        sphero.add_frame_callback(self.on_frame, groups)
+
+    def detach(self):
+        if self._sphero is not None:
+            self._sphero.remove_frame_callback(self.on_frame)
+            self._sphero = None
+
+    def __len__(self):
+        return self._count
+
+    def on_frame(self, frame):
+        '''
+        Frame callback, uses the odometer, velocity and imu_filtered values of the frame
+        '''
+        index = frame.INDEX
+        if 'odometer.x' not in index:
+            return
+        values = frame.values
+        x = values[index['odometer.x']]
+        y = values[index['odometer.y']]
+        vx = vy = None
+        if 'velocity.x' in index:
+            #the stream sends mm/s
+            vx = values[index['velocity.x']] / 10.0
+            vy = values[index['velocity.y']] / 10.0
+        yaw = values[index['imu_filtered.yaw']] if 'imu_filtered.yaw' in index else None
+        self.last_frame = frame.timestamp
+        self.update(frame.timestamp, x, y, vx, vy, yaw)
+
+    def update(self, timestamp, x, y, vx=None, vy=None, yaw=None):
+        '''
+        Add a pose, older than the last one it is dropped
+        :param vx, vy: (float) cm/s, derived from the previous pose when None
+        :param yaw: (float) degrees, the previous yaw when None
+        '''
+        with self._lock:
+            capacity = self.capacity
+            if self._count > 0:
+                last = (self._start + self._count - 1) % capacity
+                dt = timestamp - self._time[last]
+                if dt < 0:
+                    return
+                if vx is None:
+                    (vx, vy) = ((x - self._x[last]) / dt, (y - self._y[last]) / dt) if dt > 0 else \
+                        (self._vx[last], self._vy[last])
+                if yaw is None:
+                    yaw = self._yaw[last]
+            elif vx is None:
+                (vx, vy) = (0.0, 0.0)
+            if self._count < capacity:
+                i = (self._start + self._count) % capacity
+                self._count += 1
+            else:
+                i = self._start
+                self._start = (self._start + 1) % capacity
+            self._time[i] = timestamp
+            self._x[i] = x
+            self._y[i] = y
+            self._vx[i] = vx
+            self._vy[i] = vy
+            self._yaw[i] = yaw
+
+    def _pose(self, i):
+        return Pose(self._time[i], self._x[i], self._y[i], self._vx[i], self._vy[i], self._yaw[i])
+
+    def latest(self):
+        with self._lock:
+            if self._count == 0:
+                return None
+            return self._pose((self._start + self._count - 1) % self.capacity)
+
+    def pose_at(self, t):
+        '''
+        Pose at time t (time.monotonic()), interpolated between the two closest poses of the history, or
+        extrapolated with the velocity of the first/last pose outside of it. O(log n)
+        :return: (Pose) None if there is no pose yet
+        '''
+        with self._lock:
+            count = self._count
+            if count == 0:
+                return None
+            capacity = self.capacity
+            start = self._start
+            times = self._time
+            #first pose later than t
+            (lo, hi) = (0, count)
+            while lo < hi:
+                mid = (lo + hi) // 2
+                if times[(start + mid) % capacity] <= t:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            if lo == 0 or lo == count:
+                i = (start + (0 if lo == 0 else count - 1)) % capacity
+                dt = t - times[i]
+                return Pose(t, self._x[i] + self._vx[i] * dt, self._y[i] + self._vy[i] * dt,
+                            self._vx[i], self._vy[i], self._yaw[i])
+            a = (start + lo - 1) % capacity
+            b = (start + lo) % capacity
+            span = times[b] - times[a]
+            ratio = (t - times[a]) / span if span > 0 else 1.0
+            yaw = self._yaw[b]
+            if self._yaw[a] is not None and yaw is not None:
+                yaw = _angle_between(self._yaw[a], yaw, ratio)
+            return Pose(t,
+                        self._x[a] + (self._x[b] - self._x[a]) * ratio,
+                        self._y[a] + (self._y[b] - self._y[a]) * ratio,
+                        self._vx[a] + (self._vx[b] - self._vx[a]) * ratio,
+                        self._vy[a] + (self._vy[b] - self._vy[a]) * ratio,
+                        yaw)
+
+    def stream_active(self, stale_after=0.5, now=None):
+        now = time.monotonic() if now is None else now
+        return self.last_frame is not None and now - self.last_frame < stale_after
+
+
+class LocatorPoller(threading.Thread):
+    """
+    Reads the locator of robots whose sensor stream is off, every `interval` seconds.
+
+    All the CMD_READ_LOCATOR of a tick are sent before waiting for the first response, a fleet is polled
+    in about one round trip. The pose is stamped with the middle of the round trip.
+
+        poller = LocatorPoller([(orb1, estimator1), (orb2, estimator2)], interval=0.1)
+        poller.start()
+    """
+
+    def __init__(self, robots, interval=0.1, stale_after=0.5, timeout=1.0):
+        '''
+        :param robots: (list) (Sphero, StateEstimator) pairs
+        :param interval: (float) seconds between two polls
+        :param stale_after: (float) a robot is polled when its last stream frame is older than this
+        :param timeout: (float) seconds to wait for a response
+        '''
+        super(LocatorPoller, self).__init__(name="sphero-locator")
+        self.daemon = True
+        self.robots = list(robots)
+        self.interval = interval
+        self.stale_after = stale_after
+        self.timeout = timeout
+        self.polls = 0
+        self.errors = 0
+        self._stop_event = threading.Event()
+
+    def poll(self):
+        '''
+        Poll the robots without an active stream once
+        :return: (int) number of poses added
+        '''
+        sent = []
+        for (orb, estimator) in self.robots:
+            if estimator.stream_active(self.stale_after):
+                continue
+            try:
+                start = time.monotonic()
+                (seq, future) = orb.command(CMD_CODES.CMD_READ_LOCATOR, [], future=True, timeout=self.timeout)
+                sent.append((orb, estimator, start, seq, future))
+            except Exception:
+                self.errors += 1
+        added = 0
+        for (orb, estimator, start, seq, future) in sent:
+            try:
+                response = orb._notifier.wait(future, self.timeout, seq)
+            except Exception:
+                self.errors += 1
+                continue
+            locator = orb._decode(CMD_CODES.CMD_READ_LOCATOR, response)
+            if locator is None:
+                self.errors += 1
+                continue
+            stamp = (start + time.monotonic()) / 2.0
+            estimator.update(stamp, locator.x, locator.y, locator.vx, locator.vy)
+            added += 1
+        self.polls += 1
+        return added
+
+    def run(self):
+        while not self._stop_event.is_set():
+            started = time.monotonic()
+            self.poll()
+            self._stop_event.wait(max(0.0, self.interval - (time.monotonic() - started)))
+
+    def stop(self, timeout=1.0):
+        self._stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
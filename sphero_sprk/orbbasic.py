@@ -0,0 +1,191 @@
+#!/usr/bin/python3
+
+import collections
+import hashlib
+import json
+import threading
+
+import sphero_sprk.util as util
+
+from sphero_sprk.encoder import MAX_PAYLOAD
+from sphero_sprk.sphero_constants import CMD_CODES
+
+STORAGE_RAM = "00"
+STORAGE_PERSISTENT = "01"
+
+#the area takes one byte of the payload
+MAX_FRAGMENT = MAX_PAYLOAD - 1
+
+
+def program_text(program):
+    '''
+    :param program: (str or list of str) the program, or its lines
+    :return: (bytes) the lines separated by newlines and terminated with NUL, as the firmware stores them
+    '''
+    if not isinstance(program, str):
+        program = "\n".join(line.rstrip("\n") for line in program)
+    return program.rstrip("\n").encode("utf-8") + b"\n\x00"
+
+
+def pack_fragments(text, size=MAX_FRAGMENT):
+    '''
+    Pack whole lines into fragments of at most size bytes, only a longer line is split
+    :param text: (bytes) from program_text
+    :return: (list of bytes) the fragments
+    '''
+    fragments = []
+    current = bytearray()
+    for line in text.splitlines(True):
+        if len(current) + len(line) > size and len(current) > 0:
+            fragments.append(bytes(current))
+            current = bytearray()
+        while len(line) > size:
+            fragments.append(line[:size])
+            line = line[size:]
+        current += line
+    if len(current) > 0:
+        fragments.append(bytes(current))
+    return fragments
+
+
+class ProgramCache(object):
+    """
+    Content hash of the program in each storage area of each robot.
+
+    Programs in RAM are only trusted during the connection they were uploaded on, the robot may have been
+    restarted since. With a path the hashes of the persistent area are kept in a JSON file as well.
+    """
+
+    def __init__(self, path=None):
+        '''
+        :param path: (str) JSON file of the on-disk cache, None keeps it in memory
+        '''
+        self.path = path
+        self._lock = threading.Lock()
+        #one save at a time, so an older snapshot never replaces a newer one
+        self._save_lock = threading.Lock()
+        self._hashes = {}  # (addr, area) -> (hash, connection)
+        if path is not None:
+            self.load()
+
+    def get(self, addr, area, connection=None):
+        '''
+        :param connection: the peripheral of the current connection
+        :return: (str) hash of the program, None if unknown
+        '''
+        with self._lock:
+            entry = self._hashes.get((addr, area))
+        if entry is None or (area == STORAGE_RAM and entry[1] is not connection):
+            return None
+        return entry[0]
+
+    def put(self, addr, area, digest, connection=None):
+        with self._lock:
+            self._hashes[(addr, area)] = (digest, connection if area == STORAGE_RAM else None)
+        if self.path is not None and area != STORAGE_RAM:
+            self.save()
+
+    def forget(self, addr, area):
+        with self._lock:
+            found = self._hashes.pop((addr, area), None) is not None
+        if found and self.path is not None and area != STORAGE_RAM:
+            self.save()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        with self._lock:
+            for (addr, areas) in data.items():
+                for (area, digest) in areas.items():
+                    self._hashes.setdefault((addr, area), (digest, None))
+
+    def save(self):
+        with self._save_lock:
+            data = {}
+            with self._lock:
+                for ((addr, area), (digest, connection)) in self._hashes.items():
+                    if area != STORAGE_RAM:
+                        data.setdefault(addr, {})[area] = digest
+            util.write_file_atomic(self.path, json.dumps(data))
+
+
+#shared by every Sphero of the process
+PROGRAM_CACHE = ProgramCache()
+
+
+class OrbBasicUploader(object):
+    """
+    Uploads an OrbBasic program: lines are packed into fragments of up to fragment_size bytes, and up to window
+    CMD_APPEND_FRAG are in flight at the same time. A program whose content hash matches the one uploaded to
+    the same area of the robot is not uploaded again.
+
+        uploader = OrbBasicUploader(orb, progress=lambda sent, total: print(sent, "/", total))
+        uploader.upload(lines, STORAGE_PERSISTENT)
+        orb.run_orb_basic_program(STORAGE_PERSISTENT, 10)
+    """
+
+    def __init__(self, sphero, window=4, fragment_size=MAX_FRAGMENT, timeout=2.0, progress=None, cache=None):
+        '''
+        :param sphero: (Sphero) connected robot
+        :param window: (int) fragments waiting for their response at the same time
+        :param fragment_size: (int) bytes of program per fragment
+        :param timeout: (float) seconds to wait for the response of a fragment
+        :param progress: (function) called with (bytes acknowledged, total bytes) after every fragment
+        :param cache: (ProgramCache) hashes of the uploaded programs, PROGRAM_CACHE by default
+        '''
+        if not 1 <= fragment_size <= MAX_FRAGMENT:
+            raise ValueError("fragment_size must be between 1 and {}".format(MAX_FRAGMENT))
+        self._sphero = sphero
+        self.window = window
+        self.fragment_size = fragment_size
+        self.timeout = timeout
+        self.progress = progress
+        self.cache = PROGRAM_CACHE if cache is None else cache
+
+    def upload(self, program, area=STORAGE_RAM, force=False):
+        '''
+        Erase the area and upload the program, unless it is already there
+        :param program: (str or list of str) the program, or its lines
+        :param area: (str) STORAGE_RAM or STORAGE_PERSISTENT
+        :param force: (bool) upload even if the hash matches
+        :return: (bool) False if the upload was skipped
+        '''
+        orb = self._sphero
+        text = program_text(program)
+        digest = hashlib.sha256(text).hexdigest()
+        if not force and self.cache.get(orb._addr, area, orb._device) == digest:
+            return False
+        self.cache.forget(orb._addr, area)
+        if not orb.erase_orb_basic_storage(area):
+            raise RuntimeError("Could not erase the OrbBasic area {}".format(area))
+        fragments = pack_fragments(text, self.fragment_size)
+        total = len(text)
+        acknowledged = 0
+        in_flight = collections.deque()
+        area_byte = bytes.fromhex(area)
+        for fragment in fragments:
+            if len(in_flight) >= self.window:
+                acknowledged += self._wait(in_flight.popleft())
+                self._report(acknowledged, total)
+            (seq, future) = orb.command(CMD_CODES.CMD_APPEND_FRAG, [area_byte, fragment], future=True,
+                                        timeout=self.timeout)
+            in_flight.append((seq, future, len(fragment)))
+        while len(in_flight) > 0:
+            acknowledged += self._wait(in_flight.popleft())
+            self._report(acknowledged, total)
+        self.cache.put(orb._addr, area, digest, orb._device)
+        return True
+
+    def _wait(self, entry):
+        (seq, future, size) = entry
+        response = self._sphero._notifier.wait(future, self.timeout, seq)
+        if response[2] != 0:
+            raise RuntimeError("OrbBasic fragment {} was rejected with MRSP {}".format(seq, response[2]))
+        return size
+
+    def _report(self, acknowledged, total):
+        if self.progress is not None:
+            self.progress(acknowledged, total)
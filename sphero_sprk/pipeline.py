@@ -0,0 +1,247 @@
+#!/usr/bin/python3
+
+import heapq
+import itertools
+import threading
+import time
+
+from sphero_sprk.sphero_constants import CMD_CODES
+
+#transmit priorities, the lowest is written first (see TransmitQueue)
+PRIORITY_STOP = 0       # roll at speed 0, raw motors braking
+PRIORITY_STREAM = 1     # streaming configuration
+PRIORITY_NORMAL = 2     # every other command
+PRIORITY_COSMETIC = 3   # LEDs and tail light
+PRIORITY_NAMES = ('stop', 'stream', 'normal', 'cosmetic')
+
+#priority of the commands that are not PRIORITY_NORMAL, stops are chosen by roll() and set_raw_motor_values()
+TX_PRIORITIES = {
+    CMD_CODES.CMD_SET_DATA_STREAMING: PRIORITY_STREAM,
+    CMD_CODES.CMD_SET_RGB_LED: PRIORITY_COSMETIC,
+    CMD_CODES.CMD_SET_BACK_LED: PRIORITY_COSMETIC,
+}
+
+
+def tx_priority(cmd):
+    return TX_PRIORITIES.get(cmd, PRIORITY_NORMAL)
+
+
+class SequenceAllocator(object):
+    """
+    Thread safe allocation of the 8 bit sequence numbers.
+
+    Numbers reserved for a response that is still pending are skipped until they are released,
+    so two requests in flight never share a sequence number.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counter = 0
+        self._in_use = set()
+        self._held = {}  # seq -> time.monotonic() it is released
+
+    def allocate(self, reserve=False):
+        '''
+        :param reserve: (bool) keep the number until release() is called
+        :return: (int) the sequence number
+        '''
+        with self._lock:
+            if len(self._held) > 0:
+                self._release_held(time.monotonic())
+            for _ in range(256):
+                seq = self._counter
+                self._counter = (self._counter + 1) % 256
+                if seq not in self._in_use:
+                    if reserve:
+                        self._in_use.add(seq)
+                    return seq
+        raise RuntimeError("All 256 sequence numbers are waiting for a response")
+
+    def release(self, seq, hold=0):
+        '''
+        :param seq: (int) the sequence number
+        :param hold: (float) seconds before the number is used again, e.g. while a late response can still come
+        '''
+        with self._lock:
+            if hold > 0:
+                self._held[seq] = time.monotonic() + hold
+            else:
+                self._in_use.discard(seq)
+                self._held.pop(seq, None)
+
+    def _release_held(self, now):
+        for (seq, until) in list(self._held.items()):
+            if until <= now:
+                del self._held[seq]
+                self._in_use.discard(seq)
+
+    def in_flight(self):
+        '''
+        :return: (int) numbers waiting for a response, the ones held back after a timeout are not counted
+        '''
+        with self._lock:
+            return len(self._in_use) - len(self._held)
+
+    def held(self):
+        with self._lock:
+            return len(self._held)
+
+
+class NotificationPump(threading.Thread):
+    """
+    Thread that pumps the notifications of a connection so responses and streams are handled
+    without a caller blocking in waitForNotifications.
+
+    The device is polled with a short timeout while holding the notification lock, writers get the
+    lock between polls. Pending responses past their deadline are failed after every poll.
+    """
+
+    def __init__(self, device, notifier, lock, poll_interval=0.01, on_error=None):
+        threading.Thread.__init__(self, name="sphero-pump")
+        self.daemon = True
+        self._device = device
+        self._notifier = notifier
+        self._lock = lock
+        self.poll_interval = poll_interval
+        #called with the exception when the connection fails, e.g. to reconnect
+        self._on_error = on_error
+        self._stop_event = threading.Event()
+        self.error = None
+
+    def run(self):
+        try:
+            while not self._stop_event.is_set():
+                #packets waiting to be written go first
+                timeout = self._notifier.yield_to_transmitter(self.poll_interval)
+                with self._lock:
+                    self._device.waitForNotifications(timeout)
+                self._notifier.expire_pending()
+                #let writers waiting on the lock in
+                time.sleep(0)
+        except Exception as e:
+            if not self._stop_event.is_set():
+                self.error = e
+                self._notifier.fail_pending(e)
+                if self._on_error is not None:
+                    self._on_error(e)
+
+    def stop(self, timeout=None):
+        self._stop_event.set()
+        if self is not threading.current_thread():
+            self.join(timeout)
+
+
+class TransmitQueue(threading.Thread):
+    """
+    Thread writing the packets of a connection in priority order, so a stop is never stuck behind a burst of
+    LED updates or behind a caller waiting for its response.
+
+    put() only queues the packet, senders never take the notification lock. The thread holds the lock for
+    one write at a time. The readers (NotificationPump, blocking calls) let the queue drain before each poll
+    and poll in short slices, so a packet waits for at most one slice of reading: bluepy reads the
+    notifications and the write acknowledgments from the same pipe, a write can't go in the middle of a read.
+    Packets of the same priority keep their order. The time every packet spent in the queue is recorded
+    per priority.
+
+    A failed write is reported to the metrics as tx_errors and put() raises ConnectionError from then on,
+    the senders of commands without a response learn the link is down. clear_error() accepts packets again
+    once the link is restored.
+    """
+
+    def __init__(self, write, lock, metrics=None):
+        '''
+        :param write: (function) writes a chunk to the commands characteristic
+        :param lock: the notification lock, held for each write
+        :param metrics: (Metrics) of the connection, gets the queueing times as tx_latency
+        '''
+        threading.Thread.__init__(self, name="sphero-tx")
+        self.daemon = True
+        self._write = write
+        self._lock = lock
+        self.metrics = metrics
+        self._cond = threading.Condition()
+        self._heap = []
+        self._order = itertools.count()
+        self._writing = False
+        self._stopping = False
+        self.written = 0
+        self.errors = 0
+        self.error = None
+
+    def put(self, chunk, priority=PRIORITY_NORMAL):
+        '''
+        Queue a chunk
+        :param chunk: (bytes) one or more packets, not a view of a buffer that is reused
+        :param priority: (int) one of the PRIORITY_* constants
+        :raises ConnectionError: the queue is stopped or a write failed since the last clear_error()
+        '''
+        with self._cond:
+            if self._stopping:
+                raise ConnectionError("The transmit queue is stopped")
+            if self.error is not None:
+                raise ConnectionError("Write failed: {!r}".format(self.error)) from self.error
+            heapq.heappush(self._heap, (priority, next(self._order), time.monotonic(), chunk))
+            self._cond.notify_all()
+
+    def pending(self):
+        '''
+        :return: (int) chunks not written yet
+        '''
+        return len(self._heap) + (1 if self._writing else 0)
+
+    def wait_drained(self, timeout=None):
+        '''
+        Block until every queued chunk is written
+        :return: (bool) False on timeout
+        '''
+        with self._cond:
+            return self._cond.wait_for(lambda: len(self._heap) == 0 and not self._writing, timeout)
+
+    def run(self):
+        while True:
+            with self._cond:
+                while len(self._heap) == 0 and not self._stopping:
+                    self._cond.wait()
+                if len(self._heap) == 0:
+                    return
+                (priority, order, queued, chunk) = heapq.heappop(self._heap)
+                self._writing = True
+            try:
+                with self._lock:
+                    self._write(chunk)
+                self.written += 1
+            except Exception as e:
+                #the responses of the lost packets time out, the pump notices the lost link
+                with self._cond:
+                    self.errors += 1
+                    self.error = e
+                if self.metrics is not None:
+                    self.metrics.problem('tx_errors', "write of %d bytes failed: %r", len(chunk), e)
+            if self.metrics is not None:
+                self.metrics.observe_tx_latency(PRIORITY_NAMES[priority], time.monotonic() - queued)
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+    def clear_error(self):
+        '''
+        Accept packets again after a write error, e.g. once the link is restored
+        '''
+        with self._cond:
+            self.error = None
+
+    def stats(self):
+        '''
+        :return: (dict) chunks waiting and written, and the write errors
+        '''
+        return {'pending': self.pending(), 'written': self.written, 'errors': self.errors}
+
+    def stop(self, timeout=None):
+        '''
+        Write the queued chunks and stop the thread
+        '''
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        if self is not threading.current_thread():
+            self.join(timeout)
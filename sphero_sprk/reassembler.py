@@ -0,0 +1,161 @@
+#!/usr/bin/python3
+
+SOP1 = 0xff
+SOP2_SYNC = 0xff
+SOP2_ASYNC = 0xfe
+
+MIN_PACKET_SIZE = 6  # SOP1 SOP2 + 3 header bytes + checksum
+
+
+class PacketReassembler(object):
+    """
+    Reassembles Sphero packets from BLE notifications.
+
+    Bytes are appended to a single bytearray and consumed by moving a read offset, the consumed part is
+    compacted away only once it is large, so every byte is copied at most a constant number of times.
+    Complete packets are handed out as memoryview slices of the buffer, nothing is copied per packet.
+
+    Both headers are understood:
+        sync  (response): FF FF MRSP SEQ DLEN <data> CHK
+        async (message):  FF FE ID DLEN_MSB DLEN_LSB <data> CHK
+
+    Packets with a bad checksum are dropped and the reader resyncs on the next 0xFF, as it does on garbage.
+
+    A view that is kept after the packet was handled stays valid: the buffer is never modified while views
+    are exported, a new buffer is started instead.
+    """
+
+    def __init__(self, max_packet_size=2048, compact_threshold=4096):
+        '''
+        :param max_packet_size: (int) bigger async DLEN values are treated as corruption
+        :param compact_threshold: (int) consumed bytes kept before the buffer is compacted
+        '''
+        self.max_packet_size = max_packet_size
+        self.compact_threshold = compact_threshold
+        self._buffer = bytearray()
+        self._start = 0
+        self._iterating = False
+        self._pending = []
+
+        self.packets_ok = 0
+        self.resyncs = 0
+        self.checksum_failures = 0
+        self.bytes_discarded = 0
+
+    def __len__(self):
+        '''
+        Number of bytes waiting for the rest of their packet
+        '''
+        return len(self._buffer) - self._start + sum(map(len, self._pending))
+
+    def stats(self):
+        return {
+            'packets': self.packets_ok,
+            'resyncs': self.resyncs,
+            'checksum_failures': self.checksum_failures,
+            'bytes_discarded': self.bytes_discarded,
+            'buffered': len(self),
+        }
+
+    def reset(self):
+        self._buffer = bytearray()
+        self._start = 0
+        self._pending = []
+
+    def feed(self, data):
+        '''
+        Append the data of a notification
+        :param data: (bytes) received bytes
+        '''
+        if self._iterating:
+            #fed from inside a packet handler, picked up once the current packets are handled
+            self._pending.append(bytes(data))
+            return
+        self._append(data)
+
+    def _append(self, data):
+        buf = self._buffer
+        start = self._start
+        try:
+            if start > 0 and (start >= self.compact_threshold or start * 2 >= len(buf)):
+                del buf[:start]
+                self._start = 0
+            buf += data
+        except BufferError:
+            #somebody still holds a view of a packet, leave that buffer alone
+            self._buffer = bytearray(buf[self._start:])
+            self._buffer += data
+            self._start = 0
+
+    def _discard(self, count):
+        self.bytes_discarded += count
+        self.resyncs += 1
+
+    def packets(self):
+        '''
+        Generator of the complete, valid packets in the buffer
+        :return: memoryview of each packet
+        '''
+        if self._iterating:
+            return
+        self._iterating = True
+        try:
+            while True:
+                yield from self._parse()
+                if len(self._pending) == 0:
+                    break
+                pending = self._pending
+                self._pending = []
+                for data in pending:
+                    self._append(data)
+        finally:
+            self._iterating = False
+
+    def __iter__(self):
+        return self.packets()
+
+    def _parse(self):
+        buf = self._buffer
+        view = memoryview(buf)
+        pos = self._start
+        end = len(buf)
+        try:
+            while end - pos >= MIN_PACKET_SIZE:
+                if buf[pos] != SOP1:
+                    nxt = buf.find(SOP1, pos + 1, end)
+                    nxt = end if nxt < 0 else nxt
+                    self._discard(nxt - pos)
+                    pos = nxt
+                    continue
+
+                sop2 = buf[pos + 1]
+                if sop2 == SOP2_SYNC:
+                    dlen = buf[pos + 4]
+                elif sop2 == SOP2_ASYNC:
+                    dlen = (buf[pos + 3] << 8) | buf[pos + 4]
+                else:
+                    dlen = 0
+                pkt_len = dlen + 5
+                if dlen == 0 or pkt_len > self.max_packet_size:
+                    self._discard(1)
+                    pos += 1
+                    continue
+
+                if end - pos < pkt_len:
+                    break
+
+                chk = pos + pkt_len - 1
+                if 255 - (sum(view[pos + 2:chk]) % 256) != buf[chk]:
+                    self.checksum_failures += 1
+                    self._discard(1)
+                    pos += 1
+                    continue
+
+                packet = view[pos:pos + pkt_len]
+                pos += pkt_len
+                self._start = pos
+                self.packets_ok += 1
+                yield packet
+        finally:
+            self._start = pos
+            view.release()
@@ -0,0 +1,154 @@
+#!/usr/bin/python3
+
+import time
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, only the recorder needs it
+    np = None
+
+
+class SensorRecorder(object):
+    """
+    Records the sensor stream of a Sphero into preallocated NumPy ring arrays.
+
+    There is one int16 column per streamed field (the fields of the active masks, e.g. 'accel_filtered.x')
+    and a float64 'timestamp' column with the host time.monotonic() of every frame.
+
+    Every sample is written twice, at i and i + capacity, so the last `capacity` samples are always
+    contiguous and last()/column() return views instead of copies. Views point into the ring, they are
+    overwritten by later frames; use snapshot() or copy them to keep the data.
+
+    Hooks:
+        on_rollover(callback) - callback(views) every time the ring completes a lap, before it is overwritten
+        on_snapshot(callback) - callback(arrays) with every snapshot(), one is taken when the fields change
+
+    Usage:
+        recorder = SensorRecorder(orb, seconds=30, groups=['accel_filtered', 'odometer'])
+        orb.update_streaming(rate=400)
+        ...
+        x = recorder.column('odometer.x', seconds=5)
+    """
+
+    def __init__(self, sphero=None, seconds=60.0, rate=None, capacity=None, groups=()):
+        '''
+        :param sphero: (Sphero) attach to the frame stream of this Sphero, None to feed record() yourself
+        :param seconds: (float) history to keep, used with the rate to size the ring
+        :param rate: (int) expected frames per second, defaults to the stream rate of the sphero
+        :param capacity: (int) number of samples to keep, overrides seconds and rate
+        :param groups: (list of str) stream groups to enable on the sphero
+        '''
+        if np is None:
+            raise ImportError("SensorRecorder requires numpy (pip install sphero_sprk[numpy])")
+        if capacity is None:
+            if rate is None:
+                rate = sphero._stream_rate if sphero is not None else 10
+            capacity = int(seconds * rate)
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self._sphero = None
+        self._rollover_hooks = []
+        self._snapshot_hooks = []
+        self._allocate(())
+        if sphero is not None:
+            self.attach(sphero, groups)
+
+    def _allocate(self, fields):
+        self.fields = tuple(fields)
+        self._index = dict((name, i) for (i, name) in enumerate(self.fields))
+        self._data = np.zeros((len(self.fields), 2 * self.capacity), dtype=np.int16)
+        self._time = np.zeros(2 * self.capacity, dtype=np.float64)
+        self._pos = 0
+        self.count = 0
+
+    def attach(self, sphero, groups=()):
+        self.detach()
+        self._sphero = sphero
+        sphero.add_frame_callback(self.record, groups)
+
+    def detach(self):
+        if self._sphero is not None:
+            self._sphero.remove_frame_callback(self.record)
+            self._sphero = None
+
+    def on_rollover(self, callback):
+        self._rollover_hooks.append(callback)
+
+    def on_snapshot(self, callback):
+        self._snapshot_hooks.append(callback)
+
+    def __len__(self):
+        return min(self.count, self.capacity)
+
+    def record(self, frame):
+        '''
+        Store a StreamFrame, this is the frame callback
+        '''
+        if frame.FIELDS != self.fields:
+            if self.count > 0:
+                self.snapshot()
+            self._allocate(frame.FIELDS)
+        pos = self._pos
+        capacity = self.capacity
+        data = self._data
+        column = data[:, pos]
+        column[:] = frame.values
+        data[:, pos + capacity] = column
+        self._time[pos] = self._time[pos + capacity] = frame.timestamp
+        self.count += 1
+        pos += 1
+        if pos == capacity:
+            pos = 0
+            if len(self._rollover_hooks) > 0:
+                views = self._views(0, capacity)
+                for hook in self._rollover_hooks:
+                    hook(views)
+        self._pos = pos
+
+    def _window(self, seconds=None, samples=None, now=None):
+        available = len(self)
+        end = self._pos + self.capacity
+        start = end - available
+        if samples is not None:
+            start = max(start, end - samples)
+        if seconds is not None:
+            now = time.monotonic() if now is None else now
+            start += int(np.searchsorted(self._time[start:end], now - seconds, side='left'))
+        return (start, end)
+
+    def _views(self, start, end):
+        views = dict((name, self._data[i, start:end]) for (i, name) in enumerate(self.fields))
+        views['timestamp'] = self._time[start:end]
+        return views
+
+    def last(self, seconds=None, samples=None, now=None):
+        '''
+        Views of every column for the most recent samples, oldest first
+        :param seconds: (float) only samples newer than now - seconds
+        :param samples: (int) at most this many samples
+        :param now: (float) reference time.monotonic(), defaults to now
+        :return: (dict) column name -> numpy view
+        '''
+        (start, end) = self._window(seconds, samples, now)
+        return self._views(start, end)
+
+    def column(self, name, seconds=None, samples=None, now=None):
+        '''
+        View of a single column, see last()
+        :param name: (str) field name like 'odometer.x' or 'timestamp'
+        '''
+        (start, end) = self._window(seconds, samples, now)
+        if name == 'timestamp':
+            return self._time[start:end]
+        return self._data[self._index[name], start:end]
+
+    def snapshot(self):
+        '''
+        Copy of everything in the ring, oldest first, and pass it to the snapshot hooks
+        :return: (dict) column name -> numpy array
+        '''
+        arrays = dict((name, view.copy()) for (name, view) in self.last().items())
+        for hook in self._snapshot_hooks:
+            hook(arrays)
+        return arrays
@@ -0,0 +1,314 @@
+#!/usr/bin/python3
+"""
+Decoders of the responses to the query commands, one table entry per command code.
+
+    FF FF MRSP SEQ DLEN <data> CHK
+
+decode_response() checks the response code and DLEN, then unpacks the data with the precompiled struct of
+the command into a typed result. Only the packet is needed, so the responses of a wire log decode the same
+way as the ones of a live connection:
+
+    for (timestamp, cmd, packet) in WireLog("field.spwl").responses():
+        if cmd in DECODERS:
+            print(decode_response(cmd, packet))
+"""
+
+import struct
+
+from sphero_sprk.events import POWER_STATES
+from sphero_sprk.sphero_constants import CMD_CODES
+
+#response codes of the firmware (MRSP)
+MRSP_OK = 0x00
+MRSP_EGEN = 0x01
+MRSP_ECHKSUM = 0x02
+MRSP_EFRAG = 0x03
+MRSP_EBAD_CMD = 0x04
+MRSP_EUNSUPP = 0x05
+MRSP_EBAD_MSG = 0x06
+MRSP_EPARAM = 0x07
+MRSP_EEXEC = 0x08
+MRSP_EBAD_DID = 0x09
+MRSP_MEM_BUSY = 0x0A
+MRSP_BAD_PASSWORD = 0x0B
+MRSP_POWER_NOGOOD = 0x31
+MRSP_PAGE_ILLEGAL = 0x32
+MRSP_FLASH_FAIL = 0x33
+MRSP_MA_CORRUPT = 0x34
+MRSP_MSG_TIMEOUT = 0x35
+
+MRSP_NAMES = {
+    MRSP_OK: 'ok',
+    MRSP_EGEN: 'general error',
+    MRSP_ECHKSUM: 'bad checksum',
+    MRSP_EFRAG: 'command fragment',
+    MRSP_EBAD_CMD: 'unknown command',
+    MRSP_EUNSUPP: 'command not supported',
+    MRSP_EBAD_MSG: 'bad message format',
+    MRSP_EPARAM: 'bad parameter',
+    MRSP_EEXEC: 'execution failed',
+    MRSP_EBAD_DID: 'unknown device',
+    MRSP_MEM_BUSY: 'memory busy',
+    MRSP_BAD_PASSWORD: 'bad password',
+    MRSP_POWER_NOGOOD: 'voltage too low',
+    MRSP_PAGE_ILLEGAL: 'illegal flash page',
+    MRSP_FLASH_FAIL: 'flash write failed',
+    MRSP_MA_CORRUPT: 'main application corrupt',
+    MRSP_MSG_TIMEOUT: 'message timeout',
+}
+
+#bits of CMD_GET_OPTIONS_FLAG
+OPTION_STAY_AWAKE_CHARGING = 0x01
+OPTION_VECTOR_DRIVE = 0x02
+OPTION_NO_LEVELING_CHARGING = 0x04
+OPTION_TAIL_LIGHT_ALWAYS_ON = 0x08
+OPTION_MOTION_TIMEOUTS = 0x10
+OPTION_DEMO_MODE = 0x20
+OPTION_TAP_LIGHT = 0x40
+OPTION_TAP_HEAVY = 0x80
+OPTION_GYRO_MAX_ASYNC = 0x100
+
+
+class ResponseError(ValueError):
+    """
+    A response that can't be decoded: the firmware answered with an error code or the length is wrong.
+    mrsp is the response code of the packet.
+    """
+
+    def __init__(self, message, mrsp=MRSP_OK):
+        super(ResponseError, self).__init__(message)
+        self.mrsp = mrsp
+
+
+class Response(object):
+    """
+    The decoded data of a response.
+
+    Fields are attributes (version.msa_version) and items by name or index (version['msa_version'],
+    version[3]). ALIASES keeps the keys of the dicts the getters used to return (version['MSA-ver']).
+    A result is equal to the tuple of its values and to the dict of its fields.
+
+    LAYOUT lists the (field, struct code) pairs of the data, compiled once into STRUCT. Firmware that sends
+    fewer bytes than STRUCT.size but at least MIN_SIZE leaves the fields it didn't send at None.
+    """
+
+    __slots__ = ('values',)
+
+    LAYOUT = ()
+    MIN_SIZE = None
+    ALIASES = {}
+    FIELDS = ()
+    STRUCT = None
+    _SHORT = ()  # (size, struct.Struct) of the shorter layouts, longest first
+
+    def __init__(self, values):
+        self.values = values
+
+    @classmethod
+    def unpack(cls, data):
+        '''
+        :param data: (bytes-like) the data of the response, without header and checksum
+        :return: (Response) the result, None if there is less than MIN_SIZE bytes
+        '''
+        if len(data) >= cls.STRUCT.size:
+            return cls(cls.convert(cls.STRUCT.unpack_from(data)))
+        for (size, layout) in cls._SHORT:
+            if len(data) >= size:
+                values = layout.unpack_from(data)
+                return cls(cls.convert(values + (None,) * (len(cls.FIELDS) - len(values))))
+        return None
+
+    @staticmethod
+    def convert(values):
+        '''
+        Turn the unpacked values into the ones of the fields
+        '''
+        return values
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                return self.values[self.INDEX[self.ALIASES.get(key, key)]]
+            except KeyError:
+                raise KeyError(key)
+        return self.values[key]
+
+    def __iter__(self):
+        return iter(self.values)
+
+    def __len__(self):
+        return len(self.values)
+
+    def as_dict(self):
+        return dict(zip(self.FIELDS, self.values))
+
+    def __eq__(self, other):
+        if isinstance(other, Response):
+            return type(self) is type(other) and self.values == other.values
+        if isinstance(other, tuple):
+            return self.values == other
+        if isinstance(other, dict):
+            return self.as_dict() == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = None
+
+    def __repr__(self):
+        return "{}({})".format(type(self).__name__, ", ".join("{}={!r}".format(field, value)
+                                                               for (field, value) in zip(self.FIELDS, self.values)))
+
+
+def _field_property(i):
+    return property(lambda self: self.values[i])
+
+
+def _compile(cls):
+    '''
+    Build the struct, the field index and the attributes of a Response class from its LAYOUT
+    '''
+    cls.FIELDS = tuple(field for (field, code) in cls.LAYOUT)
+    cls.INDEX = dict((field, i) for (i, field) in enumerate(cls.FIELDS))
+    codes = [code for (field, code) in cls.LAYOUT]
+    cls.STRUCT = struct.Struct('>' + ''.join(codes))
+    min_size = cls.STRUCT.size if cls.MIN_SIZE is None else cls.MIN_SIZE
+    short = []
+    for count in range(len(codes) - 1, 0, -1):
+        layout = struct.Struct('>' + ''.join(codes[:count]))
+        if layout.size >= min_size:
+            short.append((layout.size, layout))
+    cls._SHORT = tuple(short)
+    cls.MIN_SIZE = min_size
+    for (i, field) in enumerate(cls.FIELDS):
+        setattr(cls, field, _field_property(i))
+    return cls
+
+
+class Version(Response):
+    '''
+    CMD_VERSION: record version, model, hardware, main application version and revision, bootloader,
+    orbBasic, macro executive and API versions. The versions are packed in nibbles (0x36 is 3.6)
+    '''
+    __slots__ = ()
+    LAYOUT = (('record', 'B'), ('model', 'B'), ('hardware', 'B'), ('msa_version', 'B'), ('msa_revision', 'B'),
+              ('bootloader', 'B'), ('basic', 'B'), ('macro', 'B'), ('api_major', 'B'), ('api_minor', 'B'))
+    MIN_SIZE = 6
+    ALIASES = {'RECV': 'record', 'MDL': 'model', 'HW': 'hardware', 'MSA-ver': 'msa_version',
+               'MSA-rev': 'msa_revision', 'BL': 'bootloader', 'BAS': 'basic', 'MACRO': 'macro',
+               'API-maj': 'api_major', 'API-min': 'api_minor'}
+
+
+class DeviceName(Response):
+    '''
+    CMD_GET_BT_NAME: Bluetooth name, address as hex text and the three colors blinked at pairing
+    '''
+    __slots__ = ()
+    LAYOUT = (('name', '16s'), ('bta', '12s'), ('color', '3s'))
+
+    @staticmethod
+    def convert(values):
+        (name, bta, color) = values
+        return (name.decode('utf-8', 'replace').rstrip(' \t\r\n\0'), bta.decode('utf-8', 'replace'),
+                color.decode('utf-8', 'replace'))
+
+
+class AutoReconnect(Response):
+    '''
+    CMD_GET_AUTO_RECONNECT: whether the robot reconnects to the last host, seconds after power on
+    '''
+    __slots__ = ()
+    LAYOUT = (('enabled', '?'), ('seconds', 'B'))
+
+
+class PowerState(Response):
+    '''
+    CMD_GET_PWR_STATE: state is a key of events.POWER_STATES, voltage in volts, seconds since the last charge
+    '''
+    __slots__ = ()
+    LAYOUT = (('record', 'B'), ('state', 'B'), ('voltage', 'H'), ('charges', 'H'), ('since_charge', 'H'))
+
+    @staticmethod
+    def convert(values):
+        (record, state, voltage, charges, since_charge) = values
+        return (record, state, voltage / 100.0, charges, since_charge)
+
+    @property
+    def state_name(self):
+        return POWER_STATES.get(self.state, self.state)
+
+
+class OptionsFlags(Response):
+    '''
+    CMD_GET_OPTIONS_FLAG and CMD_GET_TEMP_OPTIONS_FLAG: bit field of the OPTION_* options
+    '''
+    __slots__ = ()
+    LAYOUT = (('flags', 'I'),)
+
+    def is_set(self, option):
+        return self.flags & option == option
+
+
+class RgbLed(Response):
+    '''
+    CMD_GET_RGB_LED: the user LED color
+    '''
+    __slots__ = ()
+    LAYOUT = (('red', 'B'), ('green', 'B'), ('blue', 'B'))
+
+
+class Locator(Response):
+    '''
+    CMD_READ_LOCATOR: x, y in cm, vx, vy and sog (speed over ground) in cm/s
+    '''
+    __slots__ = ()
+    LAYOUT = (('x', 'h'), ('y', 'h'), ('vx', 'h'), ('vy', 'h'), ('sog', 'H'))
+
+
+class MacroStatus(Response):
+    '''
+    CMD_MACRO_STATUS: id of the running macro (0 if none) and the number of the command it executes
+    '''
+    __slots__ = ()
+    LAYOUT = (('macro_id', 'B'), ('command', 'H'))
+
+
+for _cls in (Version, DeviceName, AutoReconnect, PowerState, OptionsFlags, RgbLed, Locator, MacroStatus):
+    _compile(_cls)
+
+#command -> Response class of its data
+DECODERS = {
+    CMD_CODES.CMD_VERSION: Version,
+    CMD_CODES.CMD_GET_BT_NAME: DeviceName,
+    CMD_CODES.CMD_GET_AUTO_RECONNECT: AutoReconnect,
+    CMD_CODES.CMD_GET_PWR_STATE: PowerState,
+    CMD_CODES.CMD_GET_OPTIONS_FLAG: OptionsFlags,
+    CMD_CODES.CMD_GET_TEMP_OPTIONS_FLAG: OptionsFlags,
+    CMD_CODES.CMD_GET_RGB_LED: RgbLed,
+    CMD_CODES.CMD_READ_LOCATOR: Locator,
+    CMD_CODES.CMD_MACRO_STATUS: MacroStatus,
+}
+
+
+def decode_response(cmd, packet):
+    '''
+    Decode the response to a query command
+    :param cmd: (CMD_CODES) the command answered, a key of DECODERS
+    :param packet: (bytes-like) the whole response packet, FF FF to the checksum
+    :return: (Response) the result of the type of the command
+    :raises ResponseError: on an error code, a DLEN that doesn't match the packet or data too short
+    '''
+    if len(packet) < 6 or packet[0] != 0xff or packet[1] != 0xff:
+        raise ResponseError("{} is not a response packet".format(bytes(packet).hex()))
+    mrsp = packet[2]
+    if mrsp != MRSP_OK:
+        raise ResponseError("{} failed: {} (MRSP {:#04x})".format(cmd.name, MRSP_NAMES.get(mrsp, 'unknown error'),
+                                                                 mrsp), mrsp)
+    if packet[4] != len(packet) - 5:
+        raise ResponseError("{} response has DLEN {} for {} bytes".format(cmd.name, packet[4], len(packet) - 5))
+    result = DECODERS[cmd].unpack(memoryview(packet)[5:-1])
+    if result is None:
+        raise ResponseError("{} response is too short: {}".format(cmd.name, bytes(packet).hex()))
+    return result
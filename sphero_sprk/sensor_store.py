@@ -0,0 +1,354 @@
+#!/usr/bin/python3
+
+import json
+import os
+import re
+import threading
+import time
+
+import sphero_sprk.util as util
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, only the store needs it
+    np = None
+
+#index entry of a chunk: first and last timestamp, byte offset in the data file, number of samples
+INDEX_DTYPE = [('first', '<f8'), ('last', '<f8'), ('offset', '<u8'), ('count', '<u4')]
+
+
+def _robot_dir(robot):
+    return re.sub(r'[^0-9A-Za-z_.-]', '-', str(robot))
+
+
+def _write_json(path, data):
+    util.write_file_atomic(path, json.dumps(data))
+
+
+class Segment(object):
+    """
+    One session of a robot on disk, all its frames have the same fields.
+
+    <name>.json - fields, chunk size, closed flag, first and last timestamp
+    <name>.data - the chunks one after the other: count float64 timestamps, then count int16 per field
+    <name>.idx  - one INDEX_DTYPE entry per chunk, written after the chunk so a crash never indexes a partial one
+    """
+
+    def __init__(self, directory, name):
+        self.directory = directory
+        self.name = name
+        base = os.path.join(directory, name)
+        self.meta_path = base + ".json"
+        self.data_path = base + ".data"
+        self.index_path = base + ".idx"
+        with open(self.meta_path) as f:
+            self.meta = json.load(f)
+        self.fields = tuple(self.meta['fields'])
+        self._index = None
+
+    @property
+    def closed(self):
+        return self.meta['closed']
+
+    def index(self):
+        '''
+        :return: (numpy array of INDEX_DTYPE) the chunks, kept in memory once the segment is closed
+        '''
+        if self._index is not None:
+            return self._index
+        index = np.fromfile(self.index_path, dtype=INDEX_DTYPE) if os.path.exists(self.index_path) \
+            else np.zeros(0, dtype=INDEX_DTYPE)
+        if self.closed:
+            self._index = index
+        return index
+
+    def chunks(self, t0=None, t1=None):
+        '''
+        Chunks holding samples between t0 and t1, found with a binary search of the index
+        :return: (numpy array of INDEX_DTYPE)
+        '''
+        index = self.index()
+        start = 0 if t0 is None else int(np.searchsorted(index['last'], t0, side='left'))
+        end = len(index) if t1 is None else int(np.searchsorted(index['first'], t1, side='right'))
+        return index[start:end]
+
+    def read(self, chunks, fields, t0=None, t1=None):
+        '''
+        Read columns of the chunks through a memory map, only the pages of the requested columns are loaded
+        :return: (list of dict) column name -> numpy array per chunk, trimmed to [t0, t1]
+        '''
+        if len(chunks) == 0:
+            return []
+        columns = [self.fields.index(name) for name in fields]
+        data = np.memmap(self.data_path, dtype=np.uint8, mode='r')
+        parts = []
+        for (first, last, offset, count) in chunks:
+            offset = int(offset)
+            count = int(count)
+            timestamps = data[offset:offset + 8 * count].view('<f8')
+            start = 0 if t0 is None else int(np.searchsorted(timestamps, t0, side='left'))
+            end = count if t1 is None else int(np.searchsorted(timestamps, t1, side='right'))
+            part = {'timestamp': timestamps[start:end]}
+            for (name, column) in zip(fields, columns):
+                column_offset = offset + 8 * count + 2 * count * column
+                part[name] = data[column_offset:column_offset + 2 * count].view('<i2')[start:end]
+            parts.append(part)
+        return parts
+
+    def remove(self):
+        for path in (self.data_path, self.index_path, self.meta_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+class SessionWriter(object):
+    """
+    Appends samples to a new segment, in chunks of chunk_size samples.
+
+    It is also a frame callback: attach() streams the frames of a Sphero into the store. Frames are stamped
+    with the wall clock time (time.time()), the frames of later sessions and processes can be compared.
+    When the fields of the frames change, the segment is closed and a new one started.
+    """
+
+    def __init__(self, store, robot, chunk_size):
+        self.store = store
+        self.robot = robot
+        self.chunk_size = chunk_size
+        self.segment = None
+        self.count = 0
+        self._sphero = None
+        self._lock = threading.Lock()
+        self._clock_offset = time.time() - time.monotonic()
+        self._fields = None
+
+    def _open(self, fields):
+        self._fields = tuple(fields)
+        self.segment = self.store._create_segment(self.robot, self._fields, self.chunk_size)
+        self._data = open(self.segment.data_path, 'ab')
+        self._index = open(self.segment.index_path, 'ab')
+        self._offset = 0
+        self._time = np.zeros(self.chunk_size, dtype='<f8')
+        self._columns = np.zeros((len(self._fields), self.chunk_size), dtype='<i2')
+        self._pos = 0
+
+    def attach(self, sphero, groups=()):
+        self.detach()
+        self._sphero = sphero
+        sphero.add_frame_callback(self.record, groups)
+
+    def detach(self):
+        if self._sphero is not None:
+            self._sphero.remove_frame_callback(self.record)
+            self._sphero = None
+
+    def record(self, frame):
+        '''
+        Store a StreamFrame, this is the frame callback
+        '''
+        with self._lock:
+            if frame.FIELDS != self._fields:
+                self._close_segment()
+                self._open(frame.FIELDS)
+            pos = self._pos
+            self._time[pos] = frame.timestamp + self._clock_offset
+            self._columns[:, pos] = frame.values
+            self._pos = pos + 1
+            self.count += 1
+            if self._pos == self.chunk_size:
+                self._write_chunk()
+
+    def extend(self, fields, timestamps, columns):
+        '''
+        Append many samples at once
+        :param fields: (tuple of str) name of every column
+        :param timestamps: (numpy array) wall clock time of the samples, increasing
+        :param columns: (list of numpy arrays) one int16 array per field
+        '''
+        with self._lock:
+            if tuple(fields) != self._fields:
+                self._close_segment()
+                self._open(fields)
+            done = 0
+            total = len(timestamps)
+            while done < total:
+                size = min(total - done, self.chunk_size - self._pos)
+                self._time[self._pos:self._pos + size] = timestamps[done:done + size]
+                for (i, column) in enumerate(columns):
+                    self._columns[i, self._pos:self._pos + size] = column[done:done + size]
+                self._pos += size
+                done += size
+                if self._pos == self.chunk_size:
+                    self._write_chunk()
+            self.count += total
+
+    def _write_chunk(self):
+        count = self._pos
+        if count == 0:
+            return
+        self._data.write(self._time[:count].tobytes())
+        self._data.write(self._columns[:, :count].tobytes())
+        self._data.flush()
+        entry = np.array([(self._time[0], self._time[count - 1], self._offset, count)], dtype=INDEX_DTYPE)
+        self._index.write(entry.tobytes())
+        self._index.flush()
+        meta = self.segment.meta
+        if meta['first'] is None:
+            meta['first'] = float(self._time[0])
+        meta['last'] = float(self._time[count - 1])
+        self._offset += count * (8 + 2 * len(self._fields))
+        self._pos = 0
+
+    def flush(self):
+        '''
+        Write the samples of the current chunk, they become visible to queries (as a shorter chunk)
+        '''
+        with self._lock:
+            if self.segment is not None:
+                self._write_chunk()
+                _write_json(self.segment.meta_path, self.segment.meta)
+
+    def _close_segment(self):
+        if self.segment is None:
+            return
+        self._write_chunk()
+        self._data.close()
+        self._index.close()
+        self.segment.meta['closed'] = True
+        _write_json(self.segment.meta_path, self.segment.meta)
+        self.segment = None
+        self._fields = None
+
+    def close(self):
+        self.detach()
+        with self._lock:
+            self._close_segment()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class SensorStore(object):
+    """
+    On-disk store of decoded sensor frames, one directory per robot and one segment per session.
+
+    Segments are columnar chunks with a sparse time index (one entry per chunk): a query finds the chunks
+    with a binary search and reads only the requested columns through a memory map, the whole file is
+    never loaded. Closed sessions with the same fields can be compacted into a single segment of full chunks.
+
+    Usage:
+        store = SensorStore("/data/spheros")
+        writer = store.attach(orb, groups=['odometer', 'accel_filtered'])
+        orb.update_streaming(rate=400)
+        ...
+        writer.close()
+        data = store.query(orb._addr, t0, t1, ['odometer.x', 'odometer.y'])
+        data['timestamp'], data['odometer.x']
+    """
+
+    def __init__(self, root, chunk_size=4096):
+        '''
+        :param root: (str) directory of the store, created if needed
+        :param chunk_size: (int) samples per chunk
+        '''
+        if np is None:
+            raise ImportError("SensorStore requires numpy (pip install sphero_sprk[numpy])")
+        if chunk_size <= 0:
+            raise ValueError("chunk_size must be positive")
+        self.root = root
+        self.chunk_size = chunk_size
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _directory(self, robot):
+        return os.path.join(self.root, _robot_dir(robot))
+
+    def _create_segment(self, robot, fields, chunk_size):
+        directory = self._directory(robot)
+        with self._lock:
+            os.makedirs(directory, exist_ok=True)
+            numbers = [int(name[8:-5]) for name in os.listdir(directory) if re.match(r'^session-\d+\.json$', name)]
+            name = "session-{:06d}".format(max(numbers, default=0) + 1)
+            meta = {'robot': str(robot), 'fields': list(fields), 'chunk_size': chunk_size, 'closed': False,
+                    'first': None, 'last': None}
+            _write_json(os.path.join(directory, name + ".json"), meta)
+        return Segment(directory, name)
+
+    def robots(self):
+        return sorted(name for name in os.listdir(self.root) if os.path.isdir(os.path.join(self.root, name)))
+
+    def segments(self, robot):
+        '''
+        :return: (list of Segment) sessions of the robot, oldest first
+        '''
+        directory = self._directory(robot)
+        if not os.path.isdir(directory):
+            return []
+        names = sorted(name[:-5] for name in os.listdir(directory) if re.match(r'^session-\d+\.json$', name))
+        return [Segment(directory, name) for name in names]
+
+    def writer(self, robot, chunk_size=None):
+        '''
+        :param robot: (str) name of the robot, e.g. its address
+        :return: (SessionWriter) writer of a new session
+        '''
+        return SessionWriter(self, robot, self.chunk_size if chunk_size is None else chunk_size)
+
+    def attach(self, sphero, groups=(), robot=None):
+        '''
+        Store the frames of a Sphero in a new session
+        :param groups: (list of str) stream groups to enable on the sphero
+        :param robot: (str) name of the robot, the address of the sphero by default
+        :return: (SessionWriter) close it to end the session
+        '''
+        writer = self.writer(sphero._addr if robot is None else robot)
+        writer.attach(sphero, groups)
+        return writer
+
+    def query(self, robot, t0=None, t1=None, fields=None):
+        '''
+        Samples of a robot between t0 and t1 (wall clock time, both included)
+        :param fields: (list of str) columns to read, all the fields of the first matching session by default.
+            Sessions without all of them are skipped
+        :return: (dict) column name -> numpy array, with a 'timestamp' column
+        '''
+        parts = []
+        for segment in self.segments(robot):
+            if fields is None:
+                fields = list(segment.fields)
+            if any(name not in segment.fields for name in fields):
+                continue
+            meta = segment.meta
+            if segment.closed and meta['first'] is not None and \
+                    ((t1 is not None and meta['first'] > t1) or (t0 is not None and meta['last'] < t0)):
+                continue
+            parts.extend(segment.read(segment.chunks(t0, t1), fields, t0, t1))
+        names = ['timestamp'] + list(fields or ())
+        if len(parts) == 0:
+            return dict((name, np.zeros(0, dtype='<f8' if name == 'timestamp' else '<i2')) for name in names)
+        return dict((name, np.concatenate([part[name] for part in parts])) for name in names)
+
+    def compact(self, robot):
+        '''
+        Rewrite the closed sessions of a robot that have the same fields into one segment of full chunks
+        :return: (int) number of sessions merged away
+        '''
+        groups = {}
+        for segment in self.segments(robot):
+            if segment.closed and len(segment.index()) > 0:
+                groups.setdefault(segment.fields, []).append(segment)
+        removed = 0
+        for (fields, segments) in groups.items():
+            if len(segments) == 1 and all(segments[0].index()['count'][:-1] == segments[0].meta['chunk_size']):
+                continue
+            segments.sort(key=lambda segment: segment.meta['first'])
+            with self.writer(robot) as writer:
+                for segment in segments:
+                    for part in segment.read(segment.index(), fields):
+                        writer.extend(fields, part['timestamp'], [part[name] for name in fields])
+            for segment in segments:
+                segment.remove()
+            removed += len(segments) - 1
+        return removed
@@ -0,0 +1,103 @@
+#!/usr/bin/python3
+
+import threading
+import time
+
+
+class SetpointChannel(threading.Thread):
+    """
+    Sends the latest motion setpoint of a Sphero at a fixed rate.
+
+    roll() and set_raw_motor_values() only replace the pending setpoint, the thread transmits it on
+    the next tick. A setpoint replaced before it was sent is dropped, so a planner calling faster than
+    the link can carry never builds up a queue of stale commands. Both kinds share one slot: the
+    last one written wins.
+
+    A setpoint that fails to send is reported to the metrics of the robot and sent again on the next
+    tick unless a newer one replaced it, the thread keeps running.
+    """
+
+    def __init__(self, sphero, rate=20):
+        '''
+        :param sphero: (Sphero) the connected robot
+        :param rate: (float) setpoints sent per second at most
+        '''
+        threading.Thread.__init__(self, name="sphero-setpoint")
+        self.daemon = True
+        self._sphero = sphero
+        self.period = 1.0 / rate
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._pending = None
+        self.sent = 0
+        self.dropped = 0
+        self.errors = 0
+        self.error = None  # the last exception of a send
+
+    def _submit(self, method, args):
+        with self._lock:
+            if self._stop_event.is_set() or (self.ident is not None and not self.is_alive()):
+                raise RuntimeError("The setpoint channel is stopped")
+            if self._pending is not None:
+                self.dropped += 1
+            self._pending = (method, args)
+
+    def roll(self, speed, heading):
+        self._submit(self._sphero.roll, (speed, heading))
+
+    def set_raw_motor_values(self, lmode, lpower, rmode, rpower):
+        self._submit(self._sphero.set_raw_motor_values, (lmode, lpower, rmode, rpower))
+
+    def stats(self):
+        '''
+        :return: (dict) setpoints sent, dropped because a newer one replaced them, failed sends, and whether
+            one is pending
+        '''
+        with self._lock:
+            return {'sent': self.sent, 'dropped': self.dropped, 'errors': self.errors,
+                    'pending': self._pending is not None}
+
+    def _send_pending(self):
+        with self._lock:
+            pending = self._pending
+            self._pending = None
+        if pending is None:
+            return
+        (method, args) = pending
+        try:
+            method(*args)
+        except Exception:
+            with self._lock:
+                self.errors += 1
+                if self._pending is None:
+                    #try again on the next tick, a stop must not be lost
+                    self._pending = pending
+            raise
+        with self._lock:
+            self.sent += 1
+
+    def run(self):
+        next_tick = time.monotonic()
+        while not self._stop_event.is_set():
+            try:
+                self._send_pending()
+            except Exception as e:
+                self.error = e
+                self._sphero.metrics.problem('setpoint_errors', "setpoint failed: %r", e)
+            next_tick += self.period
+            now = time.monotonic()
+            if next_tick < now:
+                #we fell behind, skip the missed ticks instead of bursting
+                next_tick = now
+            self._stop_event.wait(next_tick - now)
+
+    def stop(self, flush=True, timeout=None):
+        '''
+        Stop the thread
+        :param flush: (bool) send the pending setpoint before returning
+        '''
+        self._stop_event.set()
+        if self is not threading.current_thread():
+            self.join(timeout)
+        if flush:
+            self._send_pending()
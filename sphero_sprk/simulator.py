@@ -0,0 +1,672 @@
+#!/usr/bin/python3
+
+import heapq
+import math
+import random
+import threading
+import time
+
+import sphero_sprk.util as util
+from sphero_sprk.sphero import (Sphero, RobotControlService, BLEService, AntiDosCharacteristic,
+                                TXPowerCharacteristic, WakeCharacteristic, ResponseCharacteristic,
+                                CommandsCharacteristic)
+from sphero_sprk.events import ASYNC_COLLISION, ASYNC_POWER, COLLISION
+from sphero_sprk.macro import TEMP_MACRO_ID, macro_duration
+from sphero_sprk.responses import MRSP_OK, MRSP_ECHKSUM, MRSP_EBAD_CMD, MRSP_EPARAM
+from sphero_sprk.sphero_constants import CMD_CODES
+
+ASYNC_SENSOR_DATA = 0x03
+
+#the code the firmware expects on the AntiDos characteristic before it accepts commands
+ANTI_DOS_CODE = "011i3".encode()
+
+
+def build_sync_packet(mrsp, seq, payload=b''):
+    '''
+    Build a response packet the way the firmware does
+    :param mrsp: (int) response code
+    :param seq: (int) sequence number echoed from the command
+    :param payload: (bytes) data of the response
+    :return: (bytes) complete packet including checksum
+    '''
+    body = bytes([mrsp, seq, len(payload) + 1]) + bytes(payload)
+    return b'\xff\xff' + body + bytes([util.cal_packet_checksum([body])])
+
+
+def build_async_packet(id_code, payload):
+    '''
+    Build an asynchronous message (sensor data, orbBasic output, ...)
+    :param id_code: (int) async ID code
+    :param payload: (bytes) data of the message
+    :return: (bytes) complete packet including checksum
+    '''
+    body = bytes([id_code]) + (len(payload) + 1).to_bytes(2, 'big') + bytes(payload)
+    return b'\xff\xfe' + body + bytes([util.cal_packet_checksum([body])])
+
+
+def mask_bits(mask):
+    '''
+    List the bits set in a 32 bit mask in the order the firmware sends them (MSB first)
+    '''
+    return [1 << i for i in range(31, -1, -1) if mask & (1 << i)]
+
+
+class _SimUUID(object):
+
+    def __init__(self, uuid_str):
+        self.binVal = bytes.fromhex(uuid_str)
+
+    def __str__(self):
+        return self.binVal.hex()
+
+
+class SimulatedCharacteristic(object):
+    """
+    Mimics bluepy.btle.Characteristic
+    """
+
+    def __init__(self, peripheral, uuid_str, handle):
+        self.peripheral = peripheral
+        self.uuid = _SimUUID(uuid_str)
+        self.valHandle = handle
+
+    def getHandle(self):
+        return self.valHandle
+
+    def write(self, val, withResponse=False):
+        return self.peripheral.writeCharacteristic(self.valHandle, val, withResponse)
+
+
+class SimulatedService(object):
+    """
+    Mimics bluepy.btle.Service
+    """
+
+    def __init__(self, uuid_str, characteristics):
+        self.uuid = _SimUUID(uuid_str)
+        self._characteristics = characteristics
+
+    def getCharacteristics(self, forUUID=None):
+        if forUUID is None:
+            return list(self._characteristics)
+        return [c for c in self._characteristics if str(c.uuid) == forUUID]
+
+
+class SimulatedSphero(object):
+    """
+    In-process stand in for bluepy.btle.Peripheral that behaves like a Sphero SPRK+.
+
+    It parses the command packets written to the Commands characteristic and answers them
+    on the Response characteristic, including the sensor stream configured by CMD_SET_DATA_STREAMING.
+    Notifications are cut in `mtu` sized chunks, delayed by `latency` (+ random `jitter`) seconds
+    and dropped with the probability `loss`. Commands are dropped with the probability `write_loss`.
+
+    Usage:
+        orb = Sphero("00:00:00:00:00:00", peripheral_factory=SimulatedSphero.factory(latency=0.01))
+    """
+
+    MTU_PAYLOAD = 20
+    MAX_STREAM_BACKLOG = 400
+
+    VERSION = bytes([0x02, 0x03, 0x01, 0x03, 0x02, 0x36, 0x33, 0x00, 0x03, 0x00])
+
+    def __init__(self, addr="00:00:00:00:00:00", name="SK-SIM", mtu=MTU_PAYLOAD, latency=0.0, jitter=0.0,
+                 loss=0.0, write_loss=0.0, seed=None, require_dev_mode=True, sensor_source=None):
+        self.addr = addr
+        self.name = name
+        self.mtu = mtu
+        self.latency = latency
+        self.jitter = jitter
+        self.loss = loss
+        self.write_loss = write_loss
+        self.require_dev_mode = require_dev_mode
+        self.sensor_source = sensor_source if sensor_source is not None else self._default_sensor_value
+
+        self.delegate = None
+        self.connected = True
+        self.dev_mode = False
+        self.awake = False
+        self.tx_power = None
+
+        self.rgb = (0, 0, 0)
+        self.user_rgb = (0, 0, 0)
+        self.back_led = 0
+        self.heading = 0
+        self.speed = 0
+        self.stabilization = True
+        self.position = [0.0, 0.0]
+        self.yaw_tare = 0
+        self._motion_time = time.monotonic()
+
+        self.collision_method = 0
+        self.power_notify = False
+        self.power_state = 2
+        self.voltage = 7.9
+        self.charges = 0
+        self.auto_reconnect = (False, 0)
+        self.options_flags = 0
+        self.temp_options_flags = 0
+        self._power_on = time.monotonic()
+
+        self.orbbasic = {0: bytearray(), 1: bytearray()}
+        self.temp_macro = bytearray()
+        self.macro_id = 0
+        self._macro_end = None
+
+        self.stream_mask1 = 0
+        self.stream_mask2 = 0
+        self.stream_samples = 1
+        self.stream_divisor = 1
+        self.stream_period = None
+        self.stream_remaining = 0
+        self._next_frame = None
+
+        self.stats = {
+            'writes': 0,
+            'bytes_written': 0,
+            'commands': 0,
+            'commands_lost': 0,
+            'checksum_errors': 0,
+            'notifications': 0,
+            'bytes_notified': 0,
+            'chunks_lost': 0,
+            'stream_frames': 0,
+            'stream_frames_skipped': 0,
+            'service_lookups': 0,
+        }
+
+        self._random = random.Random(seed)
+        self._cond = threading.Condition()
+        self._queue = []
+        self._queue_counter = 0
+        self._last_due = 0.0
+        self._cmd_buffer = bytearray()
+
+        handle = 0x0e
+        self._characteristics = {}
+        services = {}
+        for service_uuid, char_uuids in ((BLEService, (AntiDosCharacteristic, TXPowerCharacteristic, WakeCharacteristic)),
+                                         (RobotControlService, (CommandsCharacteristic, ResponseCharacteristic))):
+            char_list = []
+            for char_uuid in char_uuids:
+                characteristic = SimulatedCharacteristic(self, char_uuid, handle)
+                self._characteristics[handle] = char_uuid
+                char_list.append(characteristic)
+                if char_uuid == ResponseCharacteristic:
+                    self.response_handle = handle
+                handle += 3
+            services[service_uuid] = SimulatedService(service_uuid, char_list)
+        self._services = services
+
+        self._handlers = {
+            tuple(CMD_CODES.CMD_PING.value): self._handle_simple,
+            tuple(CMD_CODES.CMD_VERSION.value): self._handle_version,
+            tuple(CMD_CODES.CMD_GET_BT_NAME.value): self._handle_get_bt_name,
+            tuple(CMD_CODES.CMD_SET_RGB_LED.value): self._handle_set_rgb_led,
+            tuple(CMD_CODES.CMD_GET_RGB_LED.value): self._handle_get_rgb_led,
+            tuple(CMD_CODES.CMD_SET_BACK_LED.value): self._handle_set_back_led,
+            tuple(CMD_CODES.CMD_SET_HEADING.value): self._handle_set_heading,
+            tuple(CMD_CODES.CMD_SET_STABILIZ.value): self._handle_set_stabilization,
+            tuple(CMD_CODES.CMD_ROLL.value): self._handle_roll,
+            tuple(CMD_CODES.CMD_SET_RAW_MOTORS.value): self._handle_raw_motors,
+            tuple(CMD_CODES.CMD_LOCATOR.value): self._handle_config_locator,
+            tuple(CMD_CODES.CMD_READ_LOCATOR.value): self._handle_read_locator,
+            tuple(CMD_CODES.CMD_SET_DATA_STREAMING.value): self._handle_set_data_streaming,
+            tuple(CMD_CODES.CMD_SET_COLLISION_DET.value): self._handle_set_collision_detection,
+            tuple(CMD_CODES.CMD_SET_PWR_NOTIFY.value): self._handle_set_power_notify,
+            tuple(CMD_CODES.CMD_GET_PWR_STATE.value): self._handle_get_power_state,
+            tuple(CMD_CODES.CMD_SET_AUTO_RECONNECT.value): self._handle_set_auto_reconnect,
+            tuple(CMD_CODES.CMD_GET_AUTO_RECONNECT.value): self._handle_get_auto_reconnect,
+            tuple(CMD_CODES.CMD_SET_OPTIONS_FLAG.value): self._handle_set_options_flag,
+            tuple(CMD_CODES.CMD_GET_OPTIONS_FLAG.value): self._handle_get_options_flag,
+            tuple(CMD_CODES.CMD_SET_TEMP_OPTIONS_FLAG.value): self._handle_set_temp_options_flag,
+            tuple(CMD_CODES.CMD_GET_TEMP_OPTIONS_FLAG.value): self._handle_get_temp_options_flag,
+            tuple(CMD_CODES.CMD_ERASE_ORBBAS.value): self._handle_erase_orbbasic,
+            tuple(CMD_CODES.CMD_APPEND_FRAG.value): self._handle_append_fragment,
+            tuple(CMD_CODES.CMD_SAVE_TEMP_MACRO.value): self._handle_save_temp_macro,
+            tuple(CMD_CODES.CMD_APPEND_TEMP_MACRO_CHUNK.value): self._handle_append_macro_chunk,
+            tuple(CMD_CODES.CMD_RUN_MACRO.value): self._handle_run_macro,
+            tuple(CMD_CODES.CMD_ABORT_MACRO.value): self._handle_abort_macro,
+            tuple(CMD_CODES.CMD_INIT_MACRO_EXECUTIVE.value): self._handle_abort_macro,
+            tuple(CMD_CODES.CMD_MACRO_STATUS.value): self._handle_macro_status,
+        }
+        #everything else the firmware knows is acknowledged with a simple response
+        for cmd in CMD_CODES:
+            self._handlers.setdefault(tuple(cmd.value), self._handle_simple)
+
+    @classmethod
+    def factory(cls, **kwargs):
+        '''
+        Returns a function that can be passed as `peripheral_factory` to Sphero
+        '''
+        def create(addr):
+            return cls(addr, **kwargs)
+        return create
+
+    @classmethod
+    def connected(cls, testcase=None, addr="00:11:22:33:44:55", policy=None, handle_cache=None, **kwargs):
+        '''
+        Returns a Sphero connected to a new simulated robot
+        :param testcase: (unittest.TestCase) disconnects the Sphero in its cleanup
+        :param policy: (CommandPolicy) policy of the Sphero
+        :param handle_cache: (GattHandleCache) handle cache of the Sphero
+        :param kwargs: arguments of the simulated robot (latency, loss, ...)
+        '''
+        orb = Sphero(addr, peripheral_factory=cls.factory(**kwargs), policy=policy, handle_cache=handle_cache)
+        orb.connect()
+        if testcase is not None:
+            testcase.addCleanup(orb.disconnect)
+        return orb
+
+    """ bluepy.btle.Peripheral interface """
+
+    def withDelegate(self, delegate):
+        self.delegate = delegate
+        return self
+
+    def setDelegate(self, delegate):
+        return self.withDelegate(delegate)
+
+    def getServiceByUUID(self, uuid):
+        self._check_connected()
+        self.stats['service_lookups'] += 1
+        uuid_str = str(uuid).replace('-', '')
+        if uuid_str not in self._services:
+            raise KeyError("Service {} not found".format(uuid_str))
+        return self._services[uuid_str]
+
+    def getServices(self):
+        return list(self._services.values())
+
+    def disconnect(self):
+        with self._cond:
+            self.connected = False
+            self._queue = []
+            self._cond.notify_all()
+
+    def writeCharacteristic(self, handle, val, withResponse=False):
+        self._check_connected()
+        uuid_str = self._characteristics.get(handle)
+        if uuid_str is None:
+            raise KeyError("Unknown handle {}".format(handle))
+        val = bytes(val)
+        with self._cond:
+            self.stats['writes'] += 1
+            self.stats['bytes_written'] += len(val)
+            if uuid_str == AntiDosCharacteristic:
+                self.dev_mode = (val == ANTI_DOS_CODE)
+            elif uuid_str == TXPowerCharacteristic:
+                self.tx_power = val[0] if len(val) > 0 else None
+            elif uuid_str == WakeCharacteristic:
+                self.awake = (val == b'\x01')
+            elif uuid_str == CommandsCharacteristic:
+                if self.dev_mode or not self.require_dev_mode:
+                    self._cmd_buffer += val
+                    self._process_commands()
+            self._cond.notify_all()
+        return {'rsp': ['wr']}
+
+    def waitForNotifications(self, timeout):
+        '''
+        Deliver at most one notification to the delegate, waiting up to timeout seconds (None blocks)
+        :return: True if a notification was delivered
+        '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            with self._cond:
+                self._check_connected()
+                now = time.monotonic()
+                self._generate_stream(now)
+                if len(self._queue) > 0 and self._queue[0][0] <= now:
+                    (_, _, handle, chunk) = heapq.heappop(self._queue)
+                    break
+                wake_at = deadline
+                if len(self._queue) > 0:
+                    wake_at = self._queue[0][0] if wake_at is None else min(wake_at, self._queue[0][0])
+                if self._next_frame is not None:
+                    wake_at = self._next_frame if wake_at is None else min(wake_at, self._next_frame)
+                if deadline is not None and now >= deadline:
+                    return False
+                self._cond.wait(None if wake_at is None else max(0.0, wake_at - now))
+
+        self.stats['notifications'] += 1
+        self.stats['bytes_notified'] += len(chunk)
+        if self.delegate is not None:
+            self.delegate.handleNotification(handle, chunk)
+        return True
+
+    """ firmware emulation """
+
+    def _check_connected(self):
+        if not self.connected:
+            raise ConnectionError("Simulated Sphero {} is disconnected".format(self.addr))
+
+    def _notify(self, packet, at=None):
+        '''
+        Queue a packet on the response characteristic, split in MTU sized chunks
+        '''
+        due = time.monotonic() if at is None else at
+        due += self.latency
+        if self.jitter > 0:
+            due += self._random.uniform(0, self.jitter)
+        #BLE never reorders notifications
+        due = max(due, self._last_due)
+        self._last_due = due
+        for i in range(0, len(packet), self.mtu):
+            if self.loss > 0 and self._random.random() < self.loss:
+                self.stats['chunks_lost'] += 1
+                continue
+            heapq.heappush(self._queue, (due, self._queue_counter, self.response_handle, packet[i:i + self.mtu]))
+            self._queue_counter += 1
+
+    def _process_commands(self):
+        buf = self._cmd_buffer
+        while len(buf) >= 6:
+            if buf[0] != 0xff or buf[1] not in (0xfe, 0xff):
+                #not a start of packet, resync on the next byte
+                del buf[0]
+                continue
+            pkt_len = 6 + buf[5]
+            if len(buf) < pkt_len:
+                return
+            packet = bytes(buf[0:pkt_len])
+            del buf[0:pkt_len]
+            self._handle_packet(packet)
+
+    def _handle_packet(self, packet):
+        if self.write_loss > 0 and self._random.random() < self.write_loss:
+            self.stats['commands_lost'] += 1
+            return
+        self.stats['commands'] += 1
+        answer = packet[1] == 0xff
+        seq = packet[4]
+        if util.cal_packet_checksum([packet[2:-1]]) != packet[-1]:
+            self.stats['checksum_errors'] += 1
+            if answer:
+                self._notify(build_sync_packet(MRSP_ECHKSUM, seq))
+            return
+        handler = self._handlers.get((packet[2], packet[3]))
+        if handler is None:
+            if answer:
+                self._notify(build_sync_packet(MRSP_EBAD_CMD, seq))
+            return
+        (mrsp, payload) = handler(packet[6:-1])
+        if answer:
+            self._notify(build_sync_packet(mrsp, seq, payload))
+
+    def _update_motion(self, now=None):
+        now = time.monotonic() if now is None else now
+        dt = now - self._motion_time
+        self._motion_time = now
+        (vx, vy) = self._velocity()
+        self.position[0] += vx * dt / 10.0  # odometer is in cm, velocity in mm/s
+        self.position[1] += vy * dt / 10.0
+
+    def _velocity(self):
+        speed = self.speed * 8.0  # roughly mm/s per unit of speed
+        rad = math.radians(self.heading)
+        return (speed * math.sin(rad), speed * math.cos(rad))
+
+    def _handle_simple(self, data):
+        return (MRSP_OK, b'')
+
+    def _handle_version(self, data):
+        return (MRSP_OK, SimulatedSphero.VERSION)
+
+    def _handle_get_bt_name(self, data):
+        name = self.name.encode('utf-8')[:16].ljust(16, b'\x00')
+        bta = self.addr.replace(':', '').lower().encode('utf-8')[:12].ljust(12, b'0')
+        return (MRSP_OK, name + bta + b'bgr')
+
+    def _handle_set_rgb_led(self, data):
+        if len(data) < 4:
+            return (MRSP_EPARAM, b'')
+        self.rgb = (data[0], data[1], data[2])
+        if data[3]:
+            self.user_rgb = self.rgb
+        return (MRSP_OK, b'')
+
+    def _handle_get_rgb_led(self, data):
+        return (MRSP_OK, bytes(self.user_rgb))
+
+    def _handle_set_back_led(self, data):
+        if len(data) < 1:
+            return (MRSP_EPARAM, b'')
+        self.back_led = data[0]
+        return (MRSP_OK, b'')
+
+    def _handle_set_heading(self, data):
+        if len(data) < 2:
+            return (MRSP_EPARAM, b'')
+        self._update_motion()
+        self.heading = (self.heading + int.from_bytes(data[0:2], 'big')) % 360
+        return (MRSP_OK, b'')
+
+    def _handle_set_stabilization(self, data):
+        self.stabilization = len(data) > 0 and data[0] != 0
+        return (MRSP_OK, b'')
+
+    def _handle_roll(self, data):
+        if len(data) < 3:
+            return (MRSP_EPARAM, b'')
+        self._update_motion()
+        self.speed = data[0]
+        self.heading = int.from_bytes(data[1:3], 'big') % 360
+        return (MRSP_OK, b'')
+
+    def _handle_raw_motors(self, data):
+        if len(data) < 4:
+            return (MRSP_EPARAM, b'')
+        self._update_motion()
+        self.speed = 0
+        return (MRSP_OK, b'')
+
+    def _handle_config_locator(self, data):
+        if len(data) < 7:
+            return (MRSP_EPARAM, b'')
+        self._update_motion()
+        self.position = [float(int.from_bytes(data[1:3], 'big', signed=True)),
+                         float(int.from_bytes(data[3:5], 'big', signed=True))]
+        self.yaw_tare = int.from_bytes(data[5:7], 'big')
+        return (MRSP_OK, b'')
+
+    def _handle_read_locator(self, data):
+        self._update_motion()
+        (vx, vy) = self._velocity()
+        values = [int(self.position[0]), int(self.position[1]), int(vx / 10.0), int(vy / 10.0),
+                  int(math.hypot(vx, vy) / 10.0)]
+        payload = b''.join(v.to_bytes(2, 'big', signed=True) for v in values[:4])
+        return (MRSP_OK, payload + values[4].to_bytes(2, 'big'))
+
+    def _handle_set_data_streaming(self, data):
+        if len(data) < 9:
+            return (MRSP_EPARAM, b'')
+        divisor = int.from_bytes(data[0:2], 'big')
+        samples = int.from_bytes(data[2:4], 'big')
+        self.stream_mask1 = int.from_bytes(data[4:8], 'big')
+        pcnt = data[8]
+        self.stream_mask2 = int.from_bytes(data[9:13], 'big') if len(data) >= 13 else 0
+        if divisor == 0 or samples == 0 or (self.stream_mask1 == 0 and self.stream_mask2 == 0):
+            self.stream_period = None
+            self._next_frame = None
+            return (MRSP_OK, b'')
+        self.stream_samples = samples
+        self.stream_divisor = divisor
+        #the sensors are sampled at 400Hz / N, a frame is sent every M samples
+        self.stream_period = divisor * samples / 400.0
+        self.stream_remaining = pcnt if pcnt > 0 else None
+        self._next_frame = time.monotonic() + self.stream_period
+        return (MRSP_OK, b'')
+
+    def _handle_set_collision_detection(self, data):
+        if len(data) < 6:
+            return (MRSP_EPARAM, b'')
+        self.collision_method = data[0]
+        return (MRSP_OK, b'')
+
+    def _handle_set_power_notify(self, data):
+        self.power_notify = len(data) > 0 and data[0] != 0
+        return (MRSP_OK, b'')
+
+    def bump(self, x=0, y=-300, z=50):
+        '''
+        Hit the robot, a collision message is sent if the detection is on
+        :param x, y, z: acceleration of the impact
+        '''
+        with self._cond:
+            if self.collision_method == 0:
+                return
+            self._update_motion()
+            axis = (1 if x != 0 else 0) | (2 if y != 0 else 0)
+            timestamp = int((time.monotonic() * 1000)) & 0xffffffff
+            payload = COLLISION.pack(x, y, z, axis, abs(x), abs(y), self.speed, timestamp)
+            self._notify(build_async_packet(ASYNC_COLLISION, payload))
+            self._cond.notify_all()
+
+    def set_power_state(self, state):
+        '''
+        Change the battery state (1 charging, 2 ok, 3 low, 4 critical), notified if asked
+        '''
+        with self._cond:
+            self.power_state = state
+            if self.power_notify:
+                self._notify(build_async_packet(ASYNC_POWER, bytes([state])))
+                self._cond.notify_all()
+
+    def _handle_get_power_state(self, data):
+        since_charge = min(0xffff, int(time.monotonic() - self._power_on))
+        return (MRSP_OK, bytes([1, self.power_state]) + int(self.voltage * 100).to_bytes(2, 'big') +
+                self.charges.to_bytes(2, 'big') + since_charge.to_bytes(2, 'big'))
+
+    def _handle_set_auto_reconnect(self, data):
+        if len(data) < 2:
+            return (MRSP_EPARAM, b'')
+        self.auto_reconnect = (data[0] != 0, data[1])
+        return (MRSP_OK, b'')
+
+    def _handle_get_auto_reconnect(self, data):
+        return (MRSP_OK, bytes([int(self.auto_reconnect[0]), self.auto_reconnect[1]]))
+
+    def _handle_set_options_flag(self, data):
+        if len(data) < 4:
+            return (MRSP_EPARAM, b'')
+        self.options_flags = int.from_bytes(data[0:4], 'big')
+        return (MRSP_OK, b'')
+
+    def _handle_get_options_flag(self, data):
+        return (MRSP_OK, self.options_flags.to_bytes(4, 'big'))
+
+    def _handle_set_temp_options_flag(self, data):
+        if len(data) < 4:
+            return (MRSP_EPARAM, b'')
+        self.temp_options_flags = int.from_bytes(data[0:4], 'big')
+        return (MRSP_OK, b'')
+
+    def _handle_get_temp_options_flag(self, data):
+        return (MRSP_OK, self.temp_options_flags.to_bytes(4, 'big'))
+
+    def _handle_erase_orbbasic(self, data):
+        if len(data) < 1 or data[0] not in self.orbbasic:
+            return (MRSP_EPARAM, b'')
+        del self.orbbasic[data[0]][:]
+        return (MRSP_OK, b'')
+
+    def _handle_append_fragment(self, data):
+        if len(data) < 2 or data[0] not in self.orbbasic:
+            return (MRSP_EPARAM, b'')
+        self.orbbasic[data[0]] += data[1:]
+        return (MRSP_OK, b'')
+
+    def orbbasic_program(self, area=0):
+        '''
+        :return: (str) the program stored in the area, up to the NUL
+        '''
+        return bytes(self.orbbasic[area]).split(b'\x00')[0].decode('utf-8')
+
+    def _handle_save_temp_macro(self, data):
+        self.temp_macro = bytearray(data)
+        return (MRSP_OK, b'')
+
+    def _handle_append_macro_chunk(self, data):
+        self.temp_macro += data
+        return (MRSP_OK, b'')
+
+    def _handle_run_macro(self, data):
+        if len(data) < 1 or data[0] != TEMP_MACRO_ID or len(self.temp_macro) == 0:
+            return (MRSP_EPARAM, b'')
+        #the macro "runs" for the time of its delays
+        duration = macro_duration(self.temp_macro)
+        self.macro_id = data[0]
+        self._macro_end = time.monotonic() + duration / 1000.0
+        return (MRSP_OK, b'')
+
+    def _handle_abort_macro(self, data):
+        self.macro_id = 0
+        self._macro_end = None
+        return (MRSP_OK, b'')
+
+    def _handle_macro_status(self, data):
+        if self._macro_end is not None and time.monotonic() >= self._macro_end:
+            self._handle_abort_macro(data)
+        return (MRSP_OK, bytes([self.macro_id, 0, 0]))
+
+    def _generate_stream(self, now):
+        if self._next_frame is None or self._next_frame > now:
+            return
+        behind = int((now - self._next_frame) / self.stream_period)
+        if behind > SimulatedSphero.MAX_STREAM_BACKLOG:
+            #a real robot would have overflowed its TX buffer
+            self.stats['stream_frames_skipped'] += behind - SimulatedSphero.MAX_STREAM_BACKLOG
+            self._next_frame += (behind - SimulatedSphero.MAX_STREAM_BACKLOG) * self.stream_period
+        while self._next_frame is not None and self._next_frame <= now:
+            frame_time = self._next_frame
+            self._notify(self.build_sensor_frame(frame_time), at=frame_time)
+            self.stats['stream_frames'] += 1
+            self._next_frame += self.stream_period
+            if self.stream_remaining is not None:
+                self.stream_remaining -= 1
+                if self.stream_remaining <= 0:
+                    self._next_frame = None
+
+    def build_sensor_frame(self, t=None, mask1=None, mask2=None, samples=None):
+        '''
+        Build an async sensor data packet for the given masks (defaults to the streaming configuration)
+        :param t: (float) time of the frame, monotonic
+        :return: (bytes) complete packet
+        '''
+        t = time.monotonic() if t is None else t
+        mask1 = self.stream_mask1 if mask1 is None else mask1
+        mask2 = self.stream_mask2 if mask2 is None else mask2
+        samples = self.stream_samples if samples is None else samples
+        bits = [(1, bit) for bit in mask_bits(mask1)] + [(2, bit) for bit in mask_bits(mask2)]
+        payload = bytearray()
+        for i in range(samples):
+            sample_time = t - (samples - 1 - i) * self.stream_divisor / 400.0
+            for (mask_id, bit) in bits:
+                value = int(self.sensor_source(mask_id, bit, sample_time))
+                payload += max(-32768, min(32767, value)).to_bytes(2, 'big', signed=True)
+        return build_async_packet(ASYNC_SENSOR_DATA, payload)
+
+    def _default_sensor_value(self, mask_id, bit, t):
+        '''
+        A simple model of a robot rolling on a flat floor
+        '''
+        if mask_id == 1:
+            if bit == 0x00010000:   # yaw
+                return self.heading if self.heading <= 180 else self.heading - 360
+            if bit == 0x00002000:   # accel z, 1g
+                return 4096
+            return 0
+        dt = t - self._motion_time
+        (vx, vy) = self._velocity()
+        if bit == 0x08000000:   # odometer x
+            return self.position[0] + vx * dt / 10.0
+        if bit == 0x04000000:   # odometer y
+            return self.position[1] + vy * dt / 10.0
+        if bit == 0x02000000:   # accelone
+            return 4096
+        if bit == 0x01000000:   # velocity x
+            return vx
+        if bit == 0x00800000:   # velocity y
+            return vy
+        return 0
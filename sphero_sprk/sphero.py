@@ -1,15 +1,30 @@
 #!/usr/bin/python3
 
 import binascii
-import os
+import concurrent.futures
+import contextlib
 import threading
+import time
 
-import bluepy
-import yaml
-import sphero_sprk.util as util
-from sphero_sprk.timeout import Timeout
+import sphero_sprk.orbbasic as orbbasic
+import sphero_sprk.mask_schema as mask_schema
+import sphero_sprk.discovery as discovery
+import sphero_sprk.gatt_cache as gatt_cache
+from sphero_sprk.timeout import call_with_timeout
 
+from sphero_sprk.command_policy import CommandPolicy
 from sphero_sprk.delegate_object import DelegateObj
+from sphero_sprk.dispatch import Dispatcher, DROP_OLDEST
+from sphero_sprk.gatt_cache import HandleCharacteristic
+from sphero_sprk.encoder import MAX_PAYLOAD, PacketEncoder
+from sphero_sprk.events import AsyncRouter
+from sphero_sprk.stream_decoder import StreamDecoder, mask_value
+from sphero_sprk.mask_index import StreamMask, STREAMING_PAYLOAD
+from sphero_sprk.metrics import Metrics
+from sphero_sprk.pipeline import NotificationPump, SequenceAllocator, TransmitQueue, PRIORITY_NORMAL, PRIORITY_STOP, \
+    tx_priority
+from sphero_sprk.responses import ResponseError, decode_response
+from sphero_sprk.setpoint import SetpointChannel
 from sphero_sprk.sphero_constants import CMD_CODES, MACRO_CODES
 
 #should it be in a different format?
@@ -21,6 +36,9 @@ WakeCharacteristic = "22bb746f2bbf75542d6f726568705327"
 ResponseCharacteristic = "22bb746f2ba675542d6f726568705327"
 CommandsCharacteristic = "22bb746f2ba175542d6f726568705327"
 
+DEFAULT_ATT_MTU = 23
+ATT_WRITE_HEADER = 3  # opcode and handle of a write command
+
 # class DATA_MASK_LIST(object):
 #     IMU_PITCH = bytes.fromhex("0004 0000")
 #     IMU_ROLL = bytes.fromhex("0002 0000")
@@ -33,6 +51,17 @@ CommandsCharacteristic = "22bb746f2ba175542d6f726568705327"
 #     GYRO_Z = bytes.fromhex("0000 0400")
 
 
+class _BatchState(threading.local):
+    """
+    The batch of one thread: nesting depth, packets waiting and the most urgent priority among them
+    """
+
+    def __init__(self):
+        self.depth = 0
+        self.buffer = bytearray()
+        self.priority = None
+
+
 class Sphero(object):
 
     RAW_MOTOR_MODE_OFF = "00"
@@ -41,6 +70,14 @@ class Sphero(object):
     RAW_MOTOR_MODE_BRAKE = "03"
     RAW_MOTOR_MODE_IGNORE = "04"
 
+    _RAW_MOTOR_MODES = {
+        RAW_MOTOR_MODE_OFF: 0x00,
+        RAW_MOTOR_MODE_FORWARD: 0x01,
+        RAW_MOTOR_MODE_REVERSE: 0x02,
+        RAW_MOTOR_MODE_BRAKE: 0x03,
+        RAW_MOTOR_MODE_IGNORE: 0x04,
+    }
+
     MASK_ORDER = [
         {"name":"accel_raw", "size":3},
         {"name":"gyro_raw", "size":3},
@@ -56,74 +93,357 @@ class Sphero(object):
         {"name":"velocity", "size":2},
     ]
 
-    def __init__(self, addr=None):
-
+    def __init__(self, addr=None, peripheral_factory=None, iface=None, handle_cache=None, policy=None,
+                 discovery_cache=None):
+        '''
+        :param addr: (str) MAC address of the Sphero, the strongest one found by discovery.default_service(iface) when None
+        :param peripheral_factory: (function) called with the address in connect() to create the peripheral,
+            defaults to bluepy.btle.Peripheral. Used to swap in sphero_sprk.simulator.SimulatedSphero
+        :param iface: (int) number of the HCI adapter (0 for hci0), None for the default one
+        :param handle_cache: (GattHandleCache) characteristic handles of known robots, defaults to the cache
+            shared by the process (gatt_cache.HANDLE_CACHE). Give one with a path to keep them on disk
+        :param policy: (CommandPolicy) timeouts and retries of the commands, a CommandPolicy() by default
+        :param discovery_cache: (str) on-disk cache of the shared discovery service when addr is None
+            (discovery.DEFAULT_CACHE_PATH for warm restarts), None keeps the scan results in memory only
+        '''
 
         if(addr == None):
-            #search for sphero
-            sphero_list = search_for_sphero()
-            if(len(sphero_list) == 0):
+            #take the strongest sphero of the discovery cache, only waits when the cache is empty
+            try:
+                addr = discovery.default_service(iface, discovery_cache).wait_for(1, timeout=5.0)[0].addr
+            except TimeoutError:
                 raise Exception("No Sphero Found in Vicinity")
-            addr = sphero_list[0]
 
         self._addr = addr
+        self._iface = iface
+        self._peripheral_factory = peripheral_factory
+        self._handle_cache = gatt_cache.HANDLE_CACHE if handle_cache is None else handle_cache
         self._connected = False
-        self._seq_counter = 0
+        self.policy = CommandPolicy() if policy is None else policy
+        self._notifier = None
+        self._pump_config = None
+        self._auto_reconnect = None
+        self._reconnect_thread = None
+        self._streaming_payload = None
+        self.link_stats = {
+            'connects': 0,
+            'handle_cache_hits': 0,
+            'discoveries': 0,
+            'last_connect_seconds': None,
+            'reconnects': 0,
+            'reconnect_failures': 0,
+            'last_reconnect_seconds': None,
+            'total_reconnect_seconds': 0.0,
+            'command_timeouts': 0,
+            'retransmissions': 0,
+        }
+        #counters of the connection, see metrics.Metrics.snapshot
+        self.metrics = Metrics(addr)
+        self.metrics.add_source('link', lambda: self.link_stats)
+        #typed async messages, see add_event_callback
+        self.events = AsyncRouter(self.metrics)
+        #subscribers called from their own threads, see subscribe
+        self.dispatcher = Dispatcher()
+        self.metrics.add_source('subscriptions', self.dispatcher.stats)
+        self._sequence = SequenceAllocator()
+        self._pump = None
+        self._setpoints = None
+        self._window = None
+        self._response_timeout = None
+        self._att_mtu = DEFAULT_ATT_MTU
+        #each thread batches on its own, the others keep writing directly (see batch())
+        self._batch = _BatchState()
+        self._tx_queue = None  # TransmitQueue
+        #the encoder reuses its buffer, encoding doesn't need the notification lock when the queue writes
+        self._encode_lock = threading.Lock()
+        self._wire_tap = None  # WireRecorder
+        self._encoder = PacketEncoder()
         self._stream_rate = 10
-        #load the mask list
-        with open(os.path.join(os.path.dirname(__file__),'data','mask_list1.yaml'),'r') as mask_file1:
-            self._mask_list1 = yaml.load(mask_file1)
-        with open(os.path.join(os.path.dirname(__file__),'data','mask_list2.yaml'),'r') as mask_file2:
-            self._mask_list2 = yaml.load(mask_file2)
-        self._data_mask1 = bytes.fromhex("0000 0000")
-        self._data_mask2 = bytes.fromhex("0000 0000")
+        self._stream_samples = 1  # samples per frame
+        #the mask lists are parsed once per process and shared
+        self._mask_list1 = mask_schema.MASK_LIST1
+        self._mask_list2 = mask_schema.MASK_LIST2
+        self._mask_index = mask_schema.MASK_INDEX
+        self._stream_mask = StreamMask(self._mask_index)
 
         self._active_masks = {}
         self._active_mask_callbacks = []
+        self._frame_decoder = StreamDecoder(self._mask_list1, self._mask_list2, layouts=mask_schema.LAYOUT_CACHE)
+        self._frame_callbacks = []
+        self._frame_batch_callbacks = []
 
         self._notification_lock = threading.RLock()
         #start a listener loop
 
-    def connect(self):
+    def connect(self, timeout=5.0, on_attempt_done=None):
         '''
         Connects the sphero with the address given in the constructor
-        :return: True if it succeeds, False if it times out
+        :param timeout: (float) seconds to wait for the connection, works from any thread
+        :param on_attempt_done: (function) called without arguments once the connection attempt of the adapter
+            returned, which is after the timeout when it is abandoned
+        :return: True if it succeeds, raises TimeoutError if it times out
         '''
 
+        start = time.monotonic()
         try:
-            with Timeout(5):
-                self._device = bluepy.btle.Peripheral(self._addr, addrType=bluepy.btle.ADDR_TYPE_RANDOM)
-        except Timeout:
+            #a scan on the same adapter makes the LE connection fail
+            with discovery.paused(self._iface):
+                self._device = call_with_timeout(self._create_peripheral, timeout,
+                                                 on_late=lambda device: device.disconnect(), on_done=on_attempt_done)
+        except TimeoutError:
             raise TimeoutError("Device Timed out")
 
-        self._notifier = DelegateObj(self, self._notification_lock)
-        #set notifier to be notified
-        self._device.withDelegate(self._notifier)
-
-        self._devModeOn()
+        try:
+            if self._notifier is None:
+                self._notifier = DelegateObj(self, self._notification_lock)
+                self._notifier.late_window = self.policy.late_window
+            else:
+                #reconnecting: the callbacks are kept, the bytes of the old link are dropped
+                self._notifier.reset_buffer()
+            #set notifier to be notified
+            self._device.withDelegate(self._notifier)
+
+            handles = self._handle_cache.get(self._addr)
+            if handles is not None:
+                self.link_stats['handle_cache_hits'] += 1
+                self._use_handles(handles)
+                try:
+                    self._devModeOn()
+                except Exception:
+                    #the cached handles are stale
+                    self._handle_cache.forget(self._addr)
+                    handles = None
+            if handles is None:
+                self._use_handles(self._discover_handles())
+                self._devModeOn()
+        except Exception:
+            #don't keep the LE connection of a failed handshake, a retry opens a new one
+            self._device.disconnect()
+            raise
         self._connected = True #Might need to change to be a callback format
-        #get the command service
-        cmd_service = self._device.getServiceByUUID(RobotControlService)
-        self._cmd_characteristics = {}
-        characteristic_list = cmd_service.getCharacteristics()
-        for characteristic in characteristic_list:
-            uuid_str = binascii.b2a_hex(characteristic.uuid.binVal).decode('utf-8')
-            self._cmd_characteristics[uuid_str] = characteristic
 
+        self.link_stats['connects'] += 1
+        self.link_stats['last_connect_seconds'] = time.monotonic() - start
         return True
 
+    def _discover_handles(self):
+        """
+        Enumerate the characteristics of the BLE and the robot control services
+        -----
+
+        return - (dict) hex UUID -> value handle, also stored in the handle cache
+        """
+        handles = {}
+        for service_uuid in (BLEService, RobotControlService):
+            service = self._device.getServiceByUUID(service_uuid)
+            for characteristic in service.getCharacteristics():
+                uuid_str = binascii.b2a_hex(characteristic.uuid.binVal).decode('utf-8')
+                handles[uuid_str] = characteristic.getHandle()
+        self.link_stats['discoveries'] += 1
+        self._handle_cache.put(self._addr, handles)
+        return handles
+
+    def _use_handles(self, handles):
+        self._cmd_characteristics = {}
+        for (uuid_str, handle) in handles.items():
+            self._cmd_characteristics[uuid_str] = HandleCharacteristic(self._device, handle)
+
+    def _create_peripheral(self):
+        if self._peripheral_factory is not None:
+            return self._peripheral_factory(self._addr)
+        #imported here so the package can be used without bluepy (simulator, offline decoding)
+        import bluepy.btle
+        return bluepy.btle.Peripheral(self._addr, addrType=bluepy.btle.ADDR_TYPE_RANDOM, iface=self._iface)
+
+    def disconnect(self):
+        '''
+        Stop the notification pump and disconnect, pending responses fail with ConnectionError
+        '''
+        self.stop_setpoint_channel(flush=False)
+        self.stop_tx_queue()
+        self.stop_pump()
+        self._pump_config = None
+        if self._connected:
+            self._connected = False
+            self._notifier.fail_pending(ConnectionError("Disconnected"))
+            self._device.disconnect()
+
+    def start_pump(self, poll_interval=0.01, window=16, timeout=None):
+        '''
+        Pump the notifications in a background thread, so responses are matched to their futures and
+        streams are delivered without blocking calls. Commands can then be pipelined with command(..., future=True).
+
+        :param poll_interval: (float) seconds the thread waits for notifications before releasing the lock
+        :param window: (int) max number of responses in flight, command() blocks until one completes. None for no limit
+        :param timeout: (float) seconds before a pending response fails with TimeoutError, replaces the default
+            timeout of the policy (commands with their own policy keep theirs)
+        :return: (NotificationPump) the thread
+        '''
+        if self._pump is not None and self._pump.is_alive():
+            return self._pump
+        self._window = None if window is None else threading.BoundedSemaphore(window)
+        self._response_timeout = timeout
+        self._pump_config = {'poll_interval': poll_interval, 'window': window, 'timeout': timeout}
+        self._pump = NotificationPump(self._device, self._notifier, self._notification_lock, poll_interval,
+                                      on_error=self._on_link_lost)
+        self._notifier.set_pump(self._pump)
+        self._pump.start()
+        return self._pump
+
+    def stop_pump(self, timeout=1.0):
+        '''
+        Stop the notification pump, blocking calls pump the notifications themselves again
+        '''
+        pump = self._pump
+        if pump is None:
+            return
+        self._pump = None
+        self._notifier.set_pump(None)
+        pump.stop(timeout)
+        self._window = None
+        self._response_timeout = None
+
+    def start_tx_queue(self, rx_slice=0.005):
+        '''
+        Write the packets from a thread in priority order (see pipeline.TransmitQueue): stops first, then the
+        streaming configuration, the other commands and the LEDs last. Sending a command only queues it, it
+        never waits for the notification lock held by a reader.
+
+        :param rx_slice: (float) longest read of the pump and of the blocking calls, the longest a queued
+            packet waits for a reader
+        :return: (TransmitQueue) the thread, the queueing times per priority are in metrics.tx_latency
+        '''
+        if self._tx_queue is not None and self._tx_queue.is_alive():
+            return self._tx_queue
+        self._tx_queue = TransmitQueue(self._device_write, self._notification_lock, self.metrics)
+        self.metrics.add_source('tx_queue', self._tx_queue.stats)
+        self._tx_queue.start()
+        if self._notifier is not None:
+            self._notifier.rx_slice = rx_slice
+            self._notifier.set_transmitter(self._tx_queue)
+        return self._tx_queue
+
+    def stop_tx_queue(self, timeout=1.0):
+        '''
+        Write the queued packets and stop the thread, commands are written by their caller again
+        '''
+        tx_queue = self._tx_queue
+        if tx_queue is None:
+            return
+        self._tx_queue = None
+        if self._notifier is not None:
+            self._notifier.set_transmitter(None)
+        tx_queue.stop(timeout)
+
+    def reconnect(self, timeout=5.0):
+        '''
+        Connect again after the link dropped and restore the session: developer mode, the last
+        CMD_SET_DATA_STREAMING configuration, the stream callbacks and the notification pump.
+        The characteristic handles come from the handle cache, so no service is discovered.
+        :param timeout: (float) seconds to wait for the connection
+        :return: (float) seconds the reconnect took
+        '''
+        start = time.monotonic()
+        pump_config = self._pump_config
+        self.stop_pump()
+        if self._notifier is not None:
+            self._notifier.fail_pending(ConnectionError("Link lost"))
+        self._connected = False
+        try:
+            self._device.disconnect()
+        except Exception:
+            pass
+        try:
+            self.connect(timeout)
+            if self._tx_queue is not None:
+                self._tx_queue.clear_error()
+            self._restore_session()
+        except Exception:
+            self.link_stats['reconnect_failures'] += 1
+            raise
+        if pump_config is not None:
+            self.start_pump(**pump_config)
+        seconds = time.monotonic() - start
+        self.link_stats['reconnects'] += 1
+        self.link_stats['last_reconnect_seconds'] = seconds
+        self.link_stats['total_reconnect_seconds'] += seconds
+        return seconds
+
+    def _restore_session(self):
+        #one write re-enables the stream, the masks, decoder and callbacks are still set on this side
+        payload = self._streaming_payload
+        if payload is not None:
+            (did, cid) = CMD_CODES.CMD_SET_DATA_STREAMING.value
+            self._write(False, lambda seq, answer: self._encoder.encode_payload(answer, did, cid, seq, payload),
+                        priority=tx_priority(CMD_CODES.CMD_SET_DATA_STREAMING))
+            self._update_frame_decoder()
+        self._notifier.update_callbacks()
+
+    def enable_auto_reconnect(self, retries=5, backoff=0.5, timeout=5.0):
+        '''
+        Reconnect in the background when the notification pump (see start_pump) loses the link
+        :param retries: (int) attempts before giving up
+        :param backoff: (float) seconds before the second attempt, doubled after every failure
+        :param timeout: (float) seconds of each connection attempt
+        '''
+        self._auto_reconnect = {'retries': retries, 'backoff': backoff, 'timeout': timeout}
+
+    def disable_auto_reconnect(self):
+        self._auto_reconnect = None
+
+    def _on_link_lost(self, error):
+        config = self._auto_reconnect
+        if config is None or not self._connected:
+            return
+        self._reconnect_thread = threading.Thread(target=self._reconnect_loop, args=(config,), name="sphero-reconnect")
+        self._reconnect_thread.daemon = True
+        self._reconnect_thread.start()
+
+    def _reconnect_loop(self, config):
+        for attempt in range(config['retries']):
+            if attempt > 0:
+                time.sleep(config['backoff'] * 2 ** (attempt - 1))
+            if self._auto_reconnect is None:
+                return
+            try:
+                self.reconnect(config['timeout'])
+                return
+            except Exception:
+                pass
+        self._connected = False
+
+    def start_setpoint_channel(self, rate=20):
+        '''
+        Send roll and raw motor setpoints at a fixed rate, only the latest one is kept:
+
+            channel = orb.start_setpoint_channel(rate=20)
+            channel.roll(50, 90)  # returns at once, replaces the setpoint not sent yet
+
+        :param rate: (float) setpoints per second
+        :return: (SetpointChannel) the channel, its stats() count the sent and dropped setpoints
+        '''
+        if self._setpoints is not None and self._setpoints.is_alive():
+            return self._setpoints
+        self._setpoints = SetpointChannel(self, rate)
+        self._setpoints.start()
+        return self._setpoints
+
+    def stop_setpoint_channel(self, flush=True):
+        '''
+        Stop the setpoint channel
+        :param flush: (bool) send the pending setpoint first
+        '''
+        channel = self._setpoints
+        if channel is None:
+            return
+        self._setpoints = None
+        channel.stop(flush)
 
     def _devModeOn(self):
         """
         A sequence of read/write that enables the developer mode
         """
-        service = self._device.getServiceByUUID(BLEService)
-        characteristic_list = service.getCharacteristics()
-        #make it into a dict
-        characteristic_dict = {}
-        for characteristic in characteristic_list:
-            uuid_str = binascii.b2a_hex(characteristic.uuid.binVal).decode('utf-8')
-            characteristic_dict[uuid_str] = characteristic
+        characteristic_dict = self._cmd_characteristics
 
         characteristic = characteristic_dict[AntiDosCharacteristic]
         characteristic.write("011i3".encode(),True)
@@ -132,46 +452,292 @@ class Sphero(object):
         characteristic = characteristic_dict[WakeCharacteristic]
         characteristic.write((1).to_bytes(1, 'big'),True)       
 
-    def command(self, cmd, data, resp=True):
+    def command(self, cmd, data, resp=True, future=False, timeout=None, priority=None):
         """
         cmd - (str) Hex String that is the command's code(ff, no need to put \\x in front)
         data - [bytes/str/int] an array of values with what to send. We will reformat int and string
         resp - (bool) whether the command will only return after we get an acknowledgement from Sphero. If set to false, sphero will be set to NOT even send a response to save bandwidth
+        future - (bool) return at once with a concurrent.futures.Future of the response instead of blocking,
+            the future is resolved by the pump thread (see start_pump) or by the next blocking call
+        timeout - (float) seconds to wait for each attempt, defaults to the policy of cmd (see CommandPolicy)
+        priority - (int) PRIORITY_* of pipeline in the transmit queue (see start_tx_queue), defaults to the one of cmd
         -----
         
-        return - (tuple) A tuple with the first element being sequence number and second element being the response if blocked, None if not 
+        return - (tuple) A tuple with the first element being sequence number and second element being the response if blocked (the Future with future=True), None if not 
         """      
         #format data  
-        data_list = self._format_data_array(data)
-        #set the sop2 based on the blocking command
-        sop2 = "ff" if resp else "fe"
+        payload = b"".join(self._format_data_array(data))
+        did = cmd.value[0]
+        cid = cmd.value[1]
         #send command
-        seq_num = self._send_command(sop2, cmd.value[0], cmd.value[1], data_list)
-        #check if blocking
-        if(resp):
-            resp = self._notifier.wait_for_resp(seq_num)
-            #return the sequence number and response 
-            return (seq_num, resp)
-        else:
+        return self._request(cmd, resp, lambda seq, answer: self._encoder.encode_payload(answer, did, cid, seq, payload),
+                             timeout, future, priority)
+
+    def _command_packed(self, cmd, resp, *values, priority=None):
+        """
+        Same as command, but the payload is packed with the precompiled layout of cmd (see encoder.PAYLOAD_LAYOUTS)
+        cmd - (CMD_CODES) the command
+        resp - (bool) whether to wait for the response
+        values - the values of the payload
+        priority - (int) PRIORITY_* of pipeline, defaults to the one of cmd
+        -----
+
+        return - (tuple) sequence number and the response if blocked, None if not
+        """
+        return self._request(cmd, resp, lambda seq, answer: self._encoder.encode(cmd, seq, answer, *values),
+                             priority=priority)
+
+    def _policy_for(self, cmd, timeout=None):
+        policy = self.policy.get(cmd)
+        if timeout is not None:
+            return policy.copy(timeout=timeout)
+        if self._response_timeout is not None and cmd not in self.policy:
+            #the timeout given to start_pump replaces the default one
+            return policy.copy(timeout=self._response_timeout)
+        return policy
+
+    def _request(self, cmd, resp, encode, timeout=None, future=False, priority=None):
+        """
+        Send a command with the retry policy of cmd
+        resp - (bool) whether the caller gets the response
+        encode - (function) called with the sequence number and the answer flag, returns the packet
+        timeout - (float) seconds to wait for each attempt, replaces the one of the policy
+        future - (bool) return a Future instead of blocking
+        priority - (int) PRIORITY_* of pipeline, tx_priority(cmd) by default
+        -----
+
+        return - (tuple) sequence number of the attempt that was answered (the first one with a Future) and the
+            response, its Future or None
+        """
+        policy = self._policy_for(cmd, timeout)
+        priority = tx_priority(cmd) if priority is None else priority
+        pump_running = self._pump is not None and self._pump.is_alive()
+        if not resp:
+            if policy.confirm and pump_running:
+                #the response is checked in the background and the command sent again if it was lost
+                (seq_num, pending) = self._send_reliable(encode, policy, cmd.name, priority)
+                return (seq_num, None)
+            return self._write(False, encode, priority=priority)
+        if future:
+            return self._send_reliable(encode, policy, cmd.name, priority)
+
+        for attempt in range(policy.retries + 1):
+            if attempt > 0:
+                self.link_stats['retransmissions'] += 1
+                if policy.backoff > 0:
+                    time.sleep(policy.backoff)
+            (seq_num, pending) = self._write(True, encode, policy.timeout, label=cmd.name, priority=priority)
+            self.flush()
+            try:
+                return (seq_num, self._notifier.wait(pending, policy.timeout, seq_num))
+            except TimeoutError:
+                self.link_stats['command_timeouts'] += 1
+                if attempt == policy.retries:
+                    raise
+
+    def _send_reliable(self, encode, policy, label=None, priority=PRIORITY_NORMAL):
+        """
+        Send a command and send it again with a fresh sequence number when its response times out,
+        the attempts after the first one are sent from the thread that noticed the timeout
+        -----
+
+        return - (tuple) sequence number of the first attempt and the Future of the response
+        """
+        outer = concurrent.futures.Future()
+        state = {'attempt': 0}
+
+        def send():
+            (seq_num, pending) = self._write(True, encode, policy.timeout, use_window=(state['attempt'] == 0), label=label,
+                                             priority=priority)
+            pending.add_done_callback(done)
+            return seq_num
+
+        def retry():
+            try:
+                send()
+            except Exception as e:
+                if not outer.done():
+                    outer.set_exception(e)
+
+        def done(pending):
+            if outer.done():
+                return
+            if pending.cancelled():
+                outer.cancel()
+                return
+            error = pending.exception()
+            if error is None:
+                outer.set_result(pending.result())
+                return
+            if isinstance(error, TimeoutError):
+                self.link_stats['command_timeouts'] += 1
+                if state['attempt'] < policy.retries:
+                    state['attempt'] += 1
+                    self.link_stats['retransmissions'] += 1
+                    if policy.backoff > 0:
+                        timer = threading.Timer(policy.backoff, retry)
+                        timer.daemon = True
+                        timer.start()
+                    else:
+                        retry()
+                    return
+            outer.set_exception(error)
+
+        return (send(), outer)
+
+    def _write(self, resp, encode, timeout=None, use_window=True, label=None, priority=PRIORITY_NORMAL):
+        """
+        Write a command, the response is registered before the write so the pump can't miss it
+        resp - (bool) whether a response is expected
+        encode - (function) called with the sequence number and the answer flag, returns the packet
+        timeout - (float) seconds before the response fails with TimeoutError, None waits forever
+        use_window - (bool) count the response in the window of start_pump
+        label - (str) name of the command for the round trip time metrics
+        priority - (int) PRIORITY_* of pipeline in the transmit queue
+        -----
+
+        return - (tuple) sequence number and the Future of the response, None if no response is expected
+        """
+        if not resp:
+            seq_num = self._get_sequence()
+            self._send(encode, seq_num, False, priority)
             return (seq_num, None)
 
+        window = self._window if use_window else None
+        if window is not None and not window.acquire(blocking=False):
+            #the responses we wait for could be sitting in the batch
+            self.flush()
+            window.acquire()
+        #the sequence number stays reserved until the response arrived, after a timeout it is held
+        #back a while so a late response can't be taken for the answer of another command
+        seq_num = self._sequence.allocate(reserve=True)
+        pending = self._notifier.expect(seq_num, timeout, label=label)
+
+        def release(future):
+            timed_out = not future.cancelled() and isinstance(future.exception(), TimeoutError)
+            self._sequence.release(seq_num, hold=self.policy.late_window if timed_out else 0)
+            if window is not None:
+                window.release()
+        pending.add_done_callback(release)
+        try:
+            self._send(encode, seq_num, True, priority)
+        except Exception as e:
+            self._notifier.abandon(seq_num, e)
+            raise
+        return (seq_num, pending)
+
+    def _send(self, encode, seq_num, answer, priority=PRIORITY_NORMAL):
+        """
+        Encode a packet and write it, add it to the batch or queue it for the transmit queue (see start_tx_queue).
+        Only the batch needs the notification lock when the transmit queue runs
+        """
+        tx_queue = self._tx_queue
+        if tx_queue is not None and self._batch.depth == 0:
+            with self._encode_lock:
+                packet = bytes(encode(seq_num, answer))
+            self.metrics.tx_packets += 1
+            self.metrics.tx_bytes += len(packet)
+            tx_queue.put(packet, priority)
+            return
+        with self._notification_lock:
+            with self._encode_lock:
+                self._transmit(encode(seq_num, answer), priority)
+
     def _send_command(self,sop2,did,cid,data_list):
-        
-        sop1 = binascii.a2b_hex("ff")
-        sop2 = binascii.a2b_hex(sop2)
-        did = bytes([did])
-        cid = bytes([cid])
-        seq_val = self._get_sequence()
-        seq = seq_val.to_bytes(1,"big")
-        dlen = (util.count_data_size(data_list)+1).to_bytes(1,"big")#add one for checksum
-        packet = [sop1,sop2,did,cid,seq,dlen] + data_list
-        packet += [util.cal_packet_checksum(packet[2:]).to_bytes(1,'big')] #calculate the checksum
+
+        payload = b"".join(data_list)
         #write the command to Sphero
-        #print("cmd:{} packet:{}".format(cid, b"".join(packet)))
-        with self._notification_lock:
-            self._cmd_characteristics[CommandsCharacteristic].write(b"".join(packet))
+        seq_val = self._get_sequence()
+        self._send(lambda seq, answer: self._encoder.encode_payload(answer, did, cid, seq, payload), seq_val,
+                   sop2 == "ff")
         return seq_val
 
+    def _transmit(self, packet, priority=PRIORITY_NORMAL):
+        """
+        Write a complete packet to the commands characteristic, or add it to the batch (see batch()).
+        Must be called with the notification lock held.
+        """
+        metrics = self.metrics
+        metrics.tx_packets += 1
+        metrics.tx_bytes += len(packet)
+        batch = self._batch
+        if batch.depth == 0:
+            self._write_chunk(packet, priority)
+            return
+        limit = self._att_mtu - ATT_WRITE_HEADER
+        if len(batch.buffer) + len(packet) > limit:
+            self._flush_tx()
+        if len(packet) >= limit:
+            self._write_chunk(packet, priority)
+        else:
+            batch.buffer += packet
+            if batch.priority is None or priority < batch.priority:
+                batch.priority = priority
+
+    def _flush_tx(self):
+        batch = self._batch
+        if len(batch.buffer) > 0:
+            #the batch goes with the priority of its most urgent packet
+            self._write_chunk(bytes(batch.buffer), batch.priority)
+            del batch.buffer[:]
+            batch.priority = None
+
+    def _write_chunk(self, chunk, priority=PRIORITY_NORMAL):
+        tx_queue = self._tx_queue
+        if tx_queue is not None:
+            tx_queue.put(bytes(chunk), priority)
+            return
+        self._device_write(chunk)
+
+    def _device_write(self, chunk):
+        self.metrics.tx_writes += 1
+        characteristic = self._cmd_characteristics[CommandsCharacteristic]
+        if self._wire_tap is not None:
+            self._wire_tap.tx(characteristic.getHandle(), chunk)
+        characteristic.write(chunk)
+
+    def flush(self):
+        """
+        Write the packets waiting in the batch of the calling thread
+        """
+        if len(self._batch.buffer) > 0:
+            with self._notification_lock:
+                self._flush_tx()
+
+    @contextlib.contextmanager
+    def batch(self):
+        """
+        Pack the commands sent in the block into as few writes as the ATT MTU allows:
+
+            with orb.batch():
+                orb.roll(50, 90)
+                orb.set_rgb_led(255, 0, 0)
+                orb.set_tail_light(255)
+
+        The batch is written when it is full, on exit and before waiting for a response. Batches can be nested.
+        Only the commands of the calling thread are held, other threads (the setpoint channel) write directly.
+        """
+        batch = self._batch
+        batch.depth += 1
+        try:
+            yield self
+        finally:
+            batch.depth -= 1
+            if batch.depth == 0:
+                with self._notification_lock:
+                    self._flush_tx()
+
+    def set_mtu(self, mtu):
+        """
+        Negotiate the ATT MTU, a batch packs up to mtu - 3 bytes per write
+        mtu - (int) the MTU, 23 is the default of BLE 4.0
+        """
+        with self._notification_lock:
+            set_mtu = getattr(self._device, 'setMTU', None)
+            if set_mtu is not None:
+                set_mtu(mtu)
+            self._att_mtu = mtu
+
     def _listening_loop(self):
         pass
         #while(self._listening_flag):
@@ -179,21 +745,22 @@ class Sphero(object):
                 #self._device.waitForNotifications(0.001)
 
     def _get_sequence(self):
-        val = self._seq_counter
-        self._seq_counter += 1
-        self._seq_counter = self._seq_counter%256
-        return val
+        return self._sequence.allocate()
 
     def _format_data_array(self, arr):
         """
         helper function that converts int or string to bytes, just want to decrease the number of codes
         """
-        if isinstance(arr,list): 
-            for i,value in enumerate(arr):
+        if isinstance(arr,list):
+            formatted = []
+            for value in arr:
                 if isinstance(value, str):
-                    arr[i] = binascii.a2b_hex(value)
+                    formatted.append(binascii.a2b_hex(value))
                 elif isinstance(value, int):
-                    arr[i] = value.to_bytes(1,'big')
+                    formatted.append(value.to_bytes(1,'big'))
+                else:
+                    formatted.append(value)
+            return formatted
         return arr
 
     """ CORE functionality """
@@ -203,41 +770,111 @@ class Sphero(object):
         return resp
 
     def version(self):
-        #NOTE returning weird data not sure what's wrong
-        seq_num = self._send_command("ff",0,2,[])
-        response = self._notifier.wait_for_resp(seq_num)
-        data_response = response[5:-1]
-        version_data = {}
-        version_data["RECV"] = hex(data_response[0])
-        version_data["MDL"] = hex(data_response[1])
-        version_data["HW"] = data_response[2]
-        version_data["MSA-ver"] = data_response[3]
-        version_data["MSA-rev"] = data_response[4]
-        version_data["BL"] = hex(data_response[5])
-        return version_data
+        '''
+        :return: (responses.Version) firmware and hardware versions, None on error
+        '''
+        return self._query(CMD_CODES.CMD_VERSION)
 
     def get_device_name(self):
-        seq_num = self._send_command("ff",0x00, 0x11,[])
-        response = self._notifier.wait_for_resp(seq_num)
-        name_data = {}
-        name_data["name"] = str(response[5:21],'utf-8').rstrip(' \t\r\n\0')
-        name_data["bta"] = str(response[21:33],'utf-8')
-        name_data["color"] = str(response[33:36],'utf-8')
-        return name_data
+        '''
+        :return: (responses.DeviceName) name, bta and color, None on error
+        '''
+        return self._query(CMD_CODES.CMD_GET_BT_NAME)
+
+    def get_auto_reconnect(self):
+        '''
+        :return: (responses.AutoReconnect) enabled and seconds after power on, None on error
+        '''
+        return self._query(CMD_CODES.CMD_GET_AUTO_RECONNECT)
 
+    def get_power_state(self):
+        '''
+        :return: (responses.PowerState) battery state, voltage, charges and seconds since the last charge,
+            None on error
+        '''
+        return self._query(CMD_CODES.CMD_GET_PWR_STATE)
+
+    def get_options_flags(self, temporary=False):
+        '''
+        :param temporary: (bool) read the options that are reset at power off
+        :return: (responses.OptionsFlags) the flags, test them with is_set(responses.OPTION_*), None on error
+        '''
+        return self._query(CMD_CODES.CMD_GET_TEMP_OPTIONS_FLAG if temporary else CMD_CODES.CMD_GET_OPTIONS_FLAG)
+
+    def _query(self, cmd):
+        (seq_num, response) = self.command(cmd, [])
+        return self._decode(cmd, response)
+
+    def _decode(self, cmd, response):
+        '''
+        Decode the response to a query command with its entry of responses.DECODERS
+        :return: (responses.Response) None if the robot answered with an error or the response is malformed
+        '''
+        try:
+            return decode_response(cmd, response)
+        except ResponseError as e:
+            self.metrics.problem('error_responses', "%s", e)
+            return None
 
     """ Sphero functionality """
 
     def config_locator(self, x, y, yaw_tare, flag=0, resp=False):
+        '''
+        Configure the locator
+        :param x: (int) new x position in cm
+        :param y: (int) new y position in cm
+        :param yaw_tare: (int) yaw tare in degrees
+        :param flag: (int) locator flags
+        :param resp: Whether to wait for response
+        '''
+        self._command_packed(CMD_CODES.CMD_LOCATOR, resp, flag, x, y, yaw_tare)
 
+    def set_collision_detection(self, x_threshold=100, x_speed=100, y_threshold=100, y_speed=100, dead_time=100,
+                                method=1, resp=False):
+        '''
+        Configure the collision detection of the firmware, collisions are sent as events.CollisionEvent
+        (see add_event_callback) without streaming the accelerometer
+        :param x_threshold, y_threshold: (int) impact thresholds on the x and y axes, 0-255
+        :param x_speed, y_speed: (int) added to the thresholds at full speed, 0-255
+        :param dead_time: (int) ms before a new collision is reported, in steps of 10 ms
+        :param method: (int) detection method, 0 turns the detection off
+        :param resp: Whether to wait for response
+        '''
+        self._command_packed(CMD_CODES.CMD_SET_COLLISION_DET, resp, method, x_threshold, x_speed,
+                             y_threshold, y_speed, min(255, dead_time // 10))
+
+    def set_power_notify(self, enable=True, resp=False):
+        '''
+        Ask the robot to send its power state (events.PowerEvent) when it changes
+        '''
+        self._command_packed(CMD_CODES.CMD_SET_PWR_NOTIFY, resp, 1 if enable else 0)
 
-        x_bytes = x.to_bytes(2, byteorder='big', signed=True)
-        y_bytes = y.to_bytes(2, byteorder='big', signed=True)
-        yaw_tare_bytes = yaw_tare.to_bytes(2, byteorder='big')
+    def add_event_callback(self, event_type, callback):
+        '''
+        Call the callback with every async message of a type of sphero_sprk.events
+        (CollisionEvent, PowerEvent, OrbBasicPrintEvent, ...), from the thread reading the notifications
+        '''
+        self.events.subscribe(event_type, callback)
+
+    def remove_event_callback(self, event_type, callback):
+        self.events.unsubscribe(event_type, callback)
+
+    def subscribe_events(self, event_type, callback, maxsize=64, policy=DROP_OLDEST, every=1, name=None):
+        '''
+        Same as add_event_callback, the callback is called from its own thread (see subscribe)
+        :return: (Subscription) give it to unsubscribe()
+        '''
+        subscription = self.dispatcher.subscribe(callback, maxsize, policy, every, name)
+        subscription.on_close = lambda: self.remove_event_callback(event_type, subscription.offer)
+        self.add_event_callback(event_type, subscription.offer)
+        return subscription
 
-        data = [flag, x_bytes[0], x_bytes[1], y_bytes[0], y_bytes[1],
-                yaw_tare_bytes[0], yaw_tare_bytes[1]]
-        self.command(CMD_CODES.CMD_LOCATOR, data, resp=False)
+    def read_locator(self):
+        '''
+        Read the position and velocity estimated by the robot
+        :return: (responses.Locator) x, y in cm, vx, vy and sog (speed over ground) in cm/s, None on error
+        '''
+        return self._query(CMD_CODES.CMD_READ_LOCATOR)
 
     def roll(self, speed, heading, resp=False):
         """
@@ -247,10 +884,9 @@ class Sphero(object):
         heading - (int) which direction, 0 - 359
         resp - (bool) whether the code will wait for comfirmation from Sphero
         """
-        heading_bytes = heading.to_bytes(2,byteorder='big')
-        data = [speed,heading_bytes[0],heading_bytes[1], 1]
-        #send command
-        self.command(CMD_CODES.CMD_ROLL,data, resp=resp)
+        #a stop goes before everything else in the transmit queue
+        self._command_packed(CMD_CODES.CMD_ROLL, resp, speed, heading, 1,
+                             priority=PRIORITY_STOP if speed == 0 else None)
 
 
     def boost(self):
@@ -293,72 +929,53 @@ class Sphero(object):
         :param resp: Whether to wait for response
         :return:
         '''
-        #set data
-        data = [red, green, blue, int(persist)]
-        #send command
-        self.command(CMD_CODES.CMD_SET_RGB_LED, data, resp=resp)
+        self._command_packed(CMD_CODES.CMD_SET_RGB_LED, resp, red, green, blue, int(persist))
 
 
     def get_rgb_led(self):
         """
         Get the color of Sphero's LED
         ----
-        return - tuple of the color in RGB
-        """
-
-        #set the correct command
-        (seq_num, resp) = self.command(CMD_CODES.CMD_GET_RGB_LED,[])
-        #parse the response packet and make sure it's correct
-        if resp and resp[4] == 4:
-            MRSP = resp[2]
-            red = resp[5]
-            green = resp[6]
-            blue = resp[7]
-            return (red, green, blue)
-        else:
-            return None
+        return - (responses.RgbLed) the user color, equal to the (red, green, blue) tuple, None on error
+        """
+        return self._query(CMD_CODES.CMD_GET_RGB_LED)
+
+    @property
+    def _data_mask1(self):
+        return self._stream_mask.mask1
 
-    def _handle_mask(self,group_name, mask=1, remove=False):
+    @property
+    def _data_mask2(self):
+        return self._stream_mask.mask2
+
+    def _handle_mask(self,group_name, mask=1, remove=False, subscriber=None):
         '''
         Setup Mask for Data
-        :param group_name: Name of Group in Yaml File
-        :param mask: Which YAML file to use (1 or 2)
+        :param group_name: Name of Group (or group.field) in Yaml File
+        :param mask: Which YAML file to use (1 or 2), the index knows which one has the group
         :param remove: Whether this is a remove action
-        :return:
+        :param subscriber: who holds the group, a group stays enabled until all subscribers removed it
+        :return: (bool) whether the masks changed
         '''
-
         if(remove):
-            optr = util.XOR_mask
+            return self._stream_mask.remove(group_name, subscriber)
         else:
-            optr = util.OR_mask
-
-        if(mask==1):
-            for i,group in enumerate(self._mask_list1):
-                if(group["name"] == group_name):
-                    for i, value in enumerate(group["values"]):
-                        self._data_mask1 = optr(self._data_mask1, bytes.fromhex(value["mask"]))
-        elif(mask==2):
-            for i,group in enumerate(self._mask_list2):
-                if(group["name"] == group_name):
-                    for i, value in enumerate(group["values"]):
-                        self._data_mask2 = optr(self._data_mask2, bytes.fromhex(value["mask"]))
-
+            return self._stream_mask.add(group_name, subscriber)
 
     def _send_data_command(self,rate,mask1,mask2,sample=1):
-        N = ((int)(400/rate)).to_bytes(2,byteorder='big')
-        #N = (40).to_bytes(2,byteorder='big')
-        M = (sample).to_bytes(2,byteorder='big')
-        PCNT = (0).to_bytes(1,'big')
-        #MASK2 = (mask2).to_bytes(4,'big')
-        data = [N,M, mask1 ,PCNT,mask2]
-        resp = self.command(CMD_CODES.CMD_SET_DATA_STREAMING,data, resp=True) #make sure sphero actully receive this
+        payload = STREAMING_PAYLOAD.pack(int(400/rate), sample, mask_value(mask1), 0, mask_value(mask2))
+        #kept to restore the stream after a reconnect
+        self._streaming_payload = payload
+        resp = self.command(CMD_CODES.CMD_SET_DATA_STREAMING,[payload], resp=True) #make sure sphero actully receive this
         return resp
 
 
     def _stop_data_stream(self, group_name, mask_id = 1):
-        #handle mask
-        self._handle_mask(group_name, mask=mask_id, remove=True)
-        self._send_data_command(self._stream_rate, self._data_mask1, (0).to_bytes(4, 'big'))
+        #drop the stream callbacks of the group, then release its other subscribers
+        self.remove_stream_callback(group_name, mask_id)
+        for subscriber in self._stream_mask.subscribers(group_name):
+            self._handle_mask(group_name, mask=mask_id, remove=True, subscriber=subscriber)
+        self._send_data_command(self._stream_rate, self._data_mask1, self._data_mask2, self._stream_samples)
 
     def get_mask_order(self):
         mask_order = []
@@ -369,31 +986,62 @@ class Sphero(object):
             name = mask['name']
 
             if(name in mask_list):
-                if(not mask_list[name] is None):
-                    mask_order.append({'len': mask['size'], 'callback': self._active_masks[name]})
+                callbacks = list(mask_list[name])
+                if(len(callbacks) == 1):
+                    mask_order.append({'len': mask['size'], 'callback': callbacks[0]})
+                elif(len(callbacks) > 1):
+                    mask_order.append({'len': mask['size'], 'callback': Sphero._fan_out(callbacks)})
 
         return mask_order
 
+    @staticmethod
+    def _fan_out(callbacks):
+        def call_all(data):
+            for callback in callbacks:
+                callback(data)
+        return call_all
+
     def add_mask(self, mask, callback):
-        self._active_masks[mask] = callback
+        callbacks = self._active_masks.setdefault(mask, [])
+        if callback not in callbacks:
+            callbacks.append(callback)
 
-    def remove_mask(self, mask):
-        self._active_masks[mask] = None
+    def remove_mask(self, mask, callback=None):
+        '''
+        :param callback: (function) the callback to remove, all the callbacks of the group when None
+        :return: (list) the callbacks removed
+        '''
+        callbacks = self._active_masks.get(mask, [])
+        removed = list(callbacks) if callback is None else [callback] if callback in callbacks else []
+        for function in removed:
+            callbacks.remove(function)
+        return removed
 
-    def update_streaming(self, rate=10):
+    def update_streaming(self, rate=10, samples=1):
         '''
         Update Streaming
         :param rate: Rate of Streaming (Make sure factor of 400Hz)
+        :param samples: (int) samples per frame, the robot sends rate / samples frames per second. Fewer,
+            larger frames keep high rates within the notification budget of the link
         :return:
         '''
+        if not 1 <= samples <= 255:
+            raise ValueError("samples must be between 1 and 255")
         self._stream_rate = rate
-        self._send_data_command(rate, self._data_mask1, self._data_mask2)
+        self._stream_samples = samples
+        self._send_data_command(rate, self._data_mask1, self._data_mask2, samples)
+        self._update_frame_decoder()
         self._notifier.update_callbacks()
-        pass
+
+    def _update_frame_decoder(self):
+        #the samples of a frame are N / 400 s apart
+        self._frame_decoder.update(self._data_mask1, self._data_mask2, self._stream_samples,
+                                   int(400 / self._stream_rate) / 400.0)
 
     def set_stream_callback(self, name, callback, mask_id = 1):
         '''
-        Set a callback that streams the specified data to the callback
+        Add a callback that streams the specified data to the callback, a group can have several callbacks.
+        They are called on the thread reading the notifications, see subscribe() for slow callbacks
 
         :param name: Name of Group, must match mask_list1 or mask_list2
         :param callback: (function) function that we will pass the information when there is a callback
@@ -406,10 +1054,81 @@ class Sphero(object):
         self.add_mask(name, callback)
 
         # enable mask
-        self._handle_mask(name, mask=mask_id)
+        self._handle_mask(name, mask=mask_id, subscriber=('stream_callback', callback))
+
+    def remove_stream_callback(self, name, mask_id = 1, callback=None):
+        '''
+        :param callback: (function) the callback to remove, all the callbacks of the group when None
+        '''
+        for function in self.remove_mask(name, callback):
+            self._handle_mask(name, mask=mask_id, remove=True, subscriber=('stream_callback', function))
+
+    def get_frame_decoder(self):
+        return self._frame_decoder
 
-    def remove_stream_callback(self, name, mask_id = 1):
-        self._handle_mask(name, mask=mask_id, remove=True)
+    def get_frame_callbacks(self):
+        return self._frame_callbacks
+
+    def get_frame_batch_callbacks(self):
+        return self._frame_batch_callbacks
+
+    def add_frame_callback(self, callback, groups=(), batch=False):
+        '''
+        Receive every sensor frame decoded in one pass, as a StreamFrame with a namedtuple per group
+        (frame.accel_filtered.x, frame.odometer.y, ...)
+
+        With several samples per frame (see update_streaming) the callback is called once per sample, each
+        StreamFrame stamped with the time of its sample.
+
+        :param callback: (function) called with the StreamFrame of every sample
+        :param groups: (list of str) groups from mask_list1 or mask_list2 to enable
+        :param batch: (bool) call the callback once per frame with the list of its samples, oldest first
+        :return:
+        '''
+        for name in groups:
+            self._handle_mask(name, mask=self._mask_index.mask_id(name), subscriber=callback)
+        callbacks = self._frame_batch_callbacks if batch else self._frame_callbacks
+        if callback not in callbacks:
+            callbacks.append(callback)
+
+    def remove_frame_callback(self, callback):
+        '''
+        Stop calling the callback and release the groups it enabled, call update_streaming to apply
+        '''
+        for callbacks in (self._frame_callbacks, self._frame_batch_callbacks):
+            if callback in callbacks:
+                callbacks.remove(callback)
+        self._stream_mask.remove_subscriber(callback)
+
+    def subscribe(self, callback, groups=(), maxsize=64, policy=DROP_OLDEST, every=1, batch=False, name=None):
+        '''
+        Receive the sensor frames on a thread of the subscriber, a slow callback never holds up the reading of
+        the notifications. Each subscriber has its own queue, rate and overflow policy:
+
+            plot = orb.subscribe(update_plot, ['odometer'], every=10, policy=KEEP_LATEST)
+            log = orb.subscribe(write_row, ['odometer', 'accel_filtered'], maxsize=1024, policy=BLOCK)
+            orb.update_streaming(rate=100)
+
+        :param callback: (function) called with every StreamFrame kept (the list of samples with batch=True)
+        :param groups: (list of str) groups from mask_list1 or mask_list2 to enable
+        :param maxsize: (int) frames waiting for the callback at most
+        :param policy: (str) BLOCK, DROP_OLDEST or KEEP_LATEST of sphero_sprk.dispatch, what to do when maxsize
+            frames are waiting
+        :param every: (int) keep one frame out of every `every`
+        :param name: (str) name in metrics.snapshot()['subscriptions'], the name of the callback by default
+        :return: (Subscription) give it to unsubscribe(), its stats() count the frames dropped
+        '''
+        subscription = self.dispatcher.subscribe(callback, maxsize, policy, every, name)
+        subscription.on_close = lambda: self.remove_frame_callback(subscription.offer)
+        self.add_frame_callback(subscription.offer, groups, batch)
+        return subscription
+
+    def unsubscribe(self, subscription, drain=True):
+        '''
+        Stop a subscription of subscribe() or subscribe_events(), call update_streaming to release its groups
+        :param drain: (bool) deliver the frames already queued first
+        '''
+        self.dispatcher.unsubscribe(subscription, drain)
 
     def set_stabilization(self,bool_flag, resp=False):
         """
@@ -431,10 +1150,11 @@ class Sphero(object):
         rpower - (int) the value of the power from 0-255
         resp[Optional] - (bool) whether the code will wait for comfirmation from Sphero, default to False
         """
-        data = [lmode, int(lpower), rmode, int(rpower)]
-        
-        #By default, we going to cancel it
-        self.command(CMD_CODES.CMD_SET_RAW_MOTORS,data, resp=resp)
+        lmode = Sphero._RAW_MOTOR_MODES[lmode] if isinstance(lmode, str) else lmode
+        rmode = Sphero._RAW_MOTOR_MODES[rmode] if isinstance(rmode, str) else rmode
+        brake = Sphero._RAW_MOTOR_MODES[Sphero.RAW_MOTOR_MODE_BRAKE]
+        self._command_packed(CMD_CODES.CMD_SET_RAW_MOTORS, resp, lmode, int(lpower), rmode, int(rpower),
+                             priority=PRIORITY_STOP if brake in (lmode, rmode) else None)
 
     """ About MACRO  """
 
@@ -449,15 +1169,62 @@ class Sphero(object):
     def run_macro(self, id_):
         """
         Start the macro with the given ID
-        id_ - (int) the 8-bit ID of the macro
+        id_ - (int) the 8-bit ID of the macro, macro.TEMP_MACRO_ID for the one saved by upload_macro
         """
         data = [id_]
         self.command(CMD_CODES.CMD_RUN_MACRO,data)
 
+    def init_macro_executive(self):
+        """
+        Stop the running macro and reset the macro executive
+        """
+        (seq_num, response) = self.command(CMD_CODES.CMD_INIT_MACRO_EXECUTIVE, [])
+        return response[2] == 0
+
+    def upload_macro(self, macro, chunk_size=MAX_PAYLOAD):
+        """
+        Save a macro as the temporary macro (macro.TEMP_MACRO_ID). The first chunk replaces the temporary
+        macro (CMD_SAVE_TEMP_MACRO), the others are appended to it (CMD_APPEND_TEMP_MACRO_CHUNK)
+        macro - (MacroBuilder or bytes) the macro
+        chunk_size - (int) bytes of macro per command
+        return - (int) number of chunks sent
+        """
+        code = macro.compile() if hasattr(macro, 'compile') else bytes(macro)
+        chunks = [code[i:i + chunk_size] for i in range(0, len(code), chunk_size)]
+        for (i, chunk) in enumerate(chunks):
+            cmd = CMD_CODES.CMD_SAVE_TEMP_MACRO if i == 0 else CMD_CODES.CMD_APPEND_TEMP_MACRO_CHUNK
+            (seq_num, response) = self.command(cmd, [chunk])
+            if response[2] != 0:
+                raise RuntimeError("Macro chunk {} was rejected with MRSP {}".format(i, response[2]))
+        return len(chunks)
+
+    def macro_status(self):
+        """
+        return - (responses.MacroStatus) ID of the running macro (0 if none) and the number of the command it
+            executes, None on error
+        """
+        return self._query(CMD_CODES.CMD_MACRO_STATUS)
+
+    def wait_for_macro(self, timeout=None, interval=0.1):
+        """
+        Poll the macro status until no macro runs anymore
+        timeout - (float) seconds, None waits forever
+        interval - (float) seconds between two polls
+        return - (bool) False if the macro was still running at the timeout
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            status = self.macro_status()
+            if status is not None and status[0] == 0:
+                return True
+            if deadline is not None and time.monotonic() + interval > deadline:
+                return False
+            time.sleep(interval)
+
     """ OrbBasic the programming language """
 
-    STORAGE_RAM = "00"
-    STORAGE_PERSISTENT = "01"
+    STORAGE_RAM = orbbasic.STORAGE_RAM
+    STORAGE_PERSISTENT = orbbasic.STORAGE_PERSISTENT
 
     def erase_orb_basic_storage(self, area, block=True):
         """
@@ -465,9 +1232,9 @@ class Sphero(object):
         area - (str) hex name of the area to be cleaned
         """
         data = [area]
-        seq = self.command(CMD_CODES.CMD_ERASE_ORBBAS, data)
+        (seq_num, response) = self.command(CMD_CODES.CMD_ERASE_ORBBAS, data, resp=block)
         if(block):
-            return self._notifier.wait_for_sim_response(seq)
+            return response[2] == 0
         else:
             return True
 
@@ -479,16 +1246,16 @@ class Sphero(object):
         """
         data = [area,start_line.to_bytes(2,byteorder='big')]
 
-        seq = self.command(CMD_CODES.CMD_EXEC_ORBBAS, data)
-        return self._notifier.wait_for_sim_response(seq)
+        (seq_num, response) = self.command(CMD_CODES.CMD_EXEC_ORBBAS, data)
+        return response[2] == 0
 
     def abort_orb_basic_program(self):
         """
         Abort the orb_basic program
         """
         data = []
-        seq = self.command(CMD_CODES.CMD_ABORT_ORBBAS, data)
-        return self._notifier.wait_for_sim_response(seq)
+        (seq_num, response) = self.command(CMD_CODES.CMD_ABORT_ORBBAS, data)
+        return response[2] == 0
 
     def append_orb_basic_fragment(self, area,val):
         """
@@ -496,27 +1263,29 @@ class Sphero(object):
         val - (list of strings) the command broken down into a list of hex values
         area - (str) hex name of the area
         """
-        val.insert(0, area)
-        data = val
-        seq = self.command(CMD_CODES.CMD_APPEND_FRAG,data)
-        if self._notifier.wait_for_sim_response(seq):
-            pass
-        else:
-            print("error in appending orbbasic fragments")
+        data = [area] + list(val)
+        (seq_num, response) = self.command(CMD_CODES.CMD_APPEND_FRAG,data)
+        return response[2] == 0
 
     def append_orb_basic_line(self, area,code):
         """
         Append the line to the existing code
         """
-        #first convert the line into list of bytes
-        code_list = []
-        for c in code:
-            code_list.append(bytes(c,encoding="UTF-8"))
-        if len(code_list) == 0:
-            code_list.append(b'\x00') # NULL in the end
-        #code_list.append(b'\x0a')#append the terminating line
-        #send it to next part of the program
-        self.append_orb_basic_fragment(area,code_list)
+        fragment = code.encode("utf-8") if len(code) > 0 else b'\x00' # NULL in the end
+        return self.append_orb_basic_fragment(area, [fragment])
+
+    def upload_orb_basic_program(self, program, area=STORAGE_RAM, force=False, window=4, progress=None):
+        """
+        Upload a whole program, packed in large fragments with several in flight (see orbbasic.OrbBasicUploader).
+        Nothing is sent when the same program was already uploaded to the area
+        program - (str or list of str) the program, or its lines
+        area - (str) STORAGE_RAM or STORAGE_PERSISTENT
+        force - (bool) upload even if the program didn't change
+        progress - (function) called with (bytes acknowledged, total bytes)
+        return - (bool) False if the upload was skipped
+        """
+        uploader = orbbasic.OrbBasicUploader(self, window=window, progress=progress)
+        return uploader.upload(program, area, force)
 
 
 
@@ -61,6 +61,28 @@ class CMD_CODES(Enum):
     CMD_ANSWER_INPUT=[0x02, 0x64]
 
 class MACRO_CODES(Enum):
+    END=0x00
+    SET_SD1=0x01
+    SET_SD2=0x02
     SET_STABILIZATION=0x03
     SET_HEADING=0x04
-    SET_ROTATION_RATE=0x13
\ No newline at end of file
+    ROLL=0x05
+    SET_RGB_LED=0x07
+    SET_BACK_LED=0x09
+    SET_RAW_MOTORS=0x0A
+    DELAY=0x0B
+    GOTO=0x0C
+    GOSUB=0x0D
+    SLEEP=0x0E
+    SET_SPD1=0x0F
+    SET_SPD2=0x10
+    ROLL_SD1=0x11
+    SET_RGB_LED_SD2=0x12
+    SET_ROTATION_RATE=0x13
+    FADE_TO_LED=0x14
+    EMIT_MARKER=0x15
+    WAIT_UNTIL_STOPPED=0x19
+    ROTATE_OVER_TIME=0x1A
+    LOOP_START=0x1E
+    LOOP_END=0x1F
+    COMMENT=0x20
\ No newline at end of file
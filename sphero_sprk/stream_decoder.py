@@ -0,0 +1,183 @@
+#!/usr/bin/python3
+
+import struct
+import time
+from collections import namedtuple
+
+
+class StreamFrame(object):
+    """
+    A decoded sensor data frame.
+
+    values    - (tuple) every streamed value in the order of the frame
+    timestamp - (float) time.monotonic() when the frame was received
+
+    Each streamed group is available as an attribute holding a namedtuple, e.g. frame.accel_filtered.x,
+    and single values can be looked up with frame['odometer.y'].
+    """
+
+    __slots__ = ('values', 'timestamp')
+
+    FIELDS = ()
+    INDEX = {}
+
+    def __init__(self, values, timestamp):
+        self.values = values
+        self.timestamp = timestamp
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.values[self.INDEX[key]]
+        return self.values[key]
+
+    def __len__(self):
+        return len(self.values)
+
+    def as_dict(self):
+        return dict(zip(self.FIELDS, self.values))
+
+    def __repr__(self):
+        return "{}({}, timestamp={})".format(type(self).__name__, self.as_dict(), self.timestamp)
+
+
+def _group_property(tuple_cls, start, stop):
+    def getter(self):
+        return tuple_cls._make(self.values[start:stop])
+    return property(getter)
+
+
+def mask_value(mask):
+    '''
+    Convert a mask from the YAML files ("0000 8000") or bytes into an int
+    '''
+    if isinstance(mask, str):
+        return int(mask.replace(' ', ''), 16)
+    if isinstance(mask, (bytes, bytearray)):
+        return int.from_bytes(mask, 'big')
+    return mask
+
+
+class StreamLayout(object):
+    """
+    The layout of a frame for one combination of MASK1 and MASK2, compiled into a single struct.Struct
+    """
+
+    def __init__(self, mask_list1, mask_list2, mask1, mask2):
+        self.mask1 = mask1
+        self.mask2 = mask2
+        fields = []
+        # the firmware sends the values from the most significant bit of MASK1 to the least significant bit of MASK2
+        for (mask_list, mask) in ((mask_list1, mask1), (mask_list2, mask2)):
+            bits = {}
+            for group in mask_list:
+                for value in group["values"]:
+                    bits[mask_value(value["mask"])] = (group["name"], value["name"])
+            for i in range(31, -1, -1):
+                bit = 1 << i
+                if mask & bit:
+                    if bit not in bits:
+                        raise ValueError("Unknown bit {:08x} in mask".format(bit))
+                    fields.append(bits[bit])
+
+        self.fields = tuple("{}.{}".format(group, name) for (group, name) in fields)
+        self.struct = struct.Struct('>' + 'h' * len(fields))
+        self.size = self.struct.size
+
+        #group the consecutive values of the same group
+        groups = []
+        for (i, (group, name)) in enumerate(fields):
+            if len(groups) > 0 and groups[-1][0] == group:
+                groups[-1][1].append(name)
+            else:
+                groups.append((group, [name], i))
+        self.groups = tuple((group, tuple(names), start) for (group, names, start) in groups)
+
+        attrs = {
+            '__slots__': (),
+            'FIELDS': self.fields,
+            'INDEX': dict((name, i) for (i, name) in enumerate(self.fields)),
+        }
+        for (group, names, start) in self.groups:
+            tuple_cls = namedtuple(group, names)
+            attrs[group] = _group_property(tuple_cls, start, start + len(names))
+        self.record_class = type('StreamFrame', (StreamFrame,), attrs)
+
+
+class StreamDecoder(object):
+    """
+    Decodes sensor data frames with one unpack_from per frame.
+
+    The layout is compiled from the active masks and only rebuilt when the masks change (see update).
+    A frame can hold several samples (M of CMD_SET_DATA_STREAMING), decode_samples() splits it into one
+    StreamFrame per sample.
+    """
+
+    def __init__(self, mask_list1, mask_list2, layouts=None):
+        '''
+        :param mask_list1: groups of MASK1
+        :param mask_list2: groups of MASK2
+        :param layouts: (dict) cache of compiled layouts, can be shared by decoders of the same mask lists
+        '''
+        self._mask_list1 = mask_list1
+        self._mask_list2 = mask_list2
+        self._layouts = {} if layouts is None else layouts
+        self.layout = None
+        self.length_mismatches = 0
+        self.samples = 1
+        self.sample_period = 0.0
+        self.update(0, 0)
+
+    def update(self, mask1, mask2, samples=1, sample_period=0.0):
+        '''
+        Select the layout of the given masks, compiling it the first time it is used
+        :param mask1: (int/bytes) MASK1 sent with CMD_SET_DATA_STREAMING
+        :param mask2: (int/bytes) MASK2 sent with CMD_SET_DATA_STREAMING
+        :param samples: (int) samples per frame (M)
+        :param sample_period: (float) seconds between two samples (N / 400)
+        :return: (StreamLayout) the active layout
+        '''
+        self.samples = samples
+        self.sample_period = sample_period
+        key = (mask_value(mask1), mask_value(mask2))
+        layout = self._layouts.get(key)
+        if layout is None:
+            layout = StreamLayout(self._mask_list1, self._mask_list2, key[0], key[1])
+            self._layouts[key] = layout
+        self.layout = layout
+        return layout
+
+    def decode(self, packet, timestamp=None):
+        '''
+        Decode a sensor data packet (FF FE 03 DLEN_MSB DLEN_LSB <data> CHK)
+        :param packet: (bytes/memoryview) the complete packet
+        :param timestamp: (float) time of the frame, defaults to time.monotonic()
+        :return: (StreamFrame) the frame, None if the length doesn't match the active masks
+        '''
+        layout = self.layout
+        if len(packet) - 6 != layout.size:
+            self.length_mismatches += 1
+            return None
+        values = layout.struct.unpack_from(packet, 5)
+        return layout.record_class(values, time.monotonic() if timestamp is None else timestamp)
+
+    def decode_samples(self, packet, timestamp=None):
+        '''
+        Decode a sensor data packet holding `samples` samples
+        :param packet: (bytes/memoryview) the complete packet
+        :param timestamp: (float) time of the last sample, defaults to time.monotonic(). The samples before it
+            are stamped sample_period seconds apart
+        :return: (list of StreamFrame) the samples, oldest first, None if the length doesn't match
+        '''
+        layout = self.layout
+        samples = self.samples
+        if len(packet) - 6 != layout.size * samples or layout.size == 0:
+            self.length_mismatches += 1
+            return None
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        if samples == 1:
+            return [layout.record_class(layout.struct.unpack_from(packet, 5), timestamp)]
+        record_class = layout.record_class
+        period = self.sample_period
+        first = timestamp - (samples - 1) * period
+        return [record_class(values, first + i * period)
+                for (i, values) in enumerate(layout.struct.iter_unpack(memoryview(packet)[5:-1]))]
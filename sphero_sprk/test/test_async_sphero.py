@@ -0,0 +1,136 @@
+import asyncio
+import contextlib
+import os
+import select
+import threading
+import time
+import unittest
+
+from sphero_sprk.async_sphero import AsyncSphero
+from sphero_sprk.simulator import SimulatedSphero, build_sync_packet
+from sphero_sprk.sphero_constants import CMD_CODES
+
+
+class AsyncSpheroTestCase(unittest.TestCase):
+
+    def run_async(self, coro):
+        return asyncio.run(asyncio.wait_for(coro, 5.0))
+
+    async def connect(self, **kwargs):
+        robot = AsyncSphero("00:11:22:33:44:55", peripheral_factory=SimulatedSphero.factory(**kwargs))
+        await robot.connect()
+        return robot
+
+    def test_commands(self):
+        async def scenario():
+            robot = await self.connect(latency=0.005)
+            (seq, resp) = await robot.ping()
+            self.assertEqual(build_sync_packet(0, seq), resp)
+            self.assertEqual(3, (await robot.version())["MSA-ver"])
+            self.assertEqual("SK-SIM", (await robot.get_device_name())["name"])
+            await robot.set_rgb_led(5, 6, 7, persist=True, resp=True)
+            self.assertEqual((5, 6, 7), await robot.get_rgb_led())
+            await robot.roll(40, 180)
+            self.assertTrue(await robot.append_orb_basic_line("00", "10 RGB 255, 0, 0"))
+            await robot.disconnect()
+            self.assertEqual(40, robot.sphero._device.speed)
+        self.run_async(scenario())
+
+    def test_many_robots(self):
+        async def scenario():
+            robots = await asyncio.gather(*[self.connect(latency=0.01) for _ in range(12)])
+            results = await asyncio.gather(*[robot.ping() for robot in robots])
+            self.assertEqual(12, len(results))
+            await asyncio.gather(*[robot.disconnect() for robot in robots])
+        self.run_async(scenario())
+
+    def test_timeout(self):
+        async def scenario():
+            robot = await self.connect(loss=1.0)
+            with self.assertRaises(TimeoutError):
+                await robot.command(CMD_CODES.CMD_PING, [], timeout=0.05)
+            self.assertEqual(0, robot.sphero._notifier.pending_count())
+            self.assertEqual(0, robot.sphero._sequence.in_flight())
+            await robot.disconnect()
+        self.run_async(scenario())
+
+    def test_stream(self):
+        async def scenario():
+            robot = await self.connect()
+            frames = []
+            async with contextlib.aclosing(robot.stream(['odometer'], rate=100)) as stream:
+                async for frame in stream:
+                    frames.append(frame)
+                    if len(frames) == 5:
+                        break
+            self.assertEqual((0, 0), tuple(frames[-1].odometer))
+            # the masks are released when the iteration stops
+            self.assertEqual(0, robot.sphero._data_mask2)
+            await robot.disconnect()
+        self.run_async(scenario())
+
+    def test_stream_keeps_latest(self):
+        async def scenario():
+            robot = await self.connect()
+            stream = robot.stream(['odometer.x'], rate=200, maxsize=2)
+            first = await stream.__anext__()
+            # let the consumer fall behind
+            await asyncio.sleep(0.1)
+            second = await stream.__anext__()
+            third = await stream.__anext__()
+            self.assertGreater(third.timestamp - first.timestamp, 0.08)
+            self.assertLess(third.timestamp - second.timestamp, 0.01)
+            await stream.aclose()
+            await robot.disconnect()
+        self.run_async(scenario())
+
+    def test_reader_never_blocks_loop(self):
+        class PipeDevice(object):
+            """Reads one byte per notification from a pipe, like bluepy reads a helper line"""
+
+            def __init__(self, fd):
+                self.fd = fd
+                self.read = 0
+
+            def waitForNotifications(self, timeout):
+                if len(select.select([self.fd], [], [], timeout)[0]) == 0:
+                    return False
+                os.read(self.fd, 1)
+                self.read += 1
+                return True
+
+        async def scenario():
+            robot = AsyncSphero("00:11:22:33:44:55", peripheral_factory=SimulatedSphero.factory(), poll_interval=0.01)
+            robot._loop = asyncio.get_running_loop()
+            (r, w) = os.pipe()
+            self.addCleanup(os.close, r)
+            self.addCleanup(os.close, w)
+            device = PipeDevice(r)
+            robot.sphero._device = device
+            # a blocking call in another thread holds the lock while it reads
+            held = threading.Event()
+
+            def reader():
+                with robot.sphero._notification_lock:
+                    held.set()
+                    time.sleep(0.2)
+            thread = threading.Thread(target=reader)
+            thread.start()
+            held.wait(1.0)
+            robot._reader_fd = r
+            robot._loop.add_reader(r, robot._on_readable)
+            os.write(w, b'abc')
+            start = time.monotonic()
+            await asyncio.sleep(0.05)
+            self.assertLess(time.monotonic() - start, 0.15)
+            self.assertEqual(0, device.read)
+            await robot._loop.run_in_executor(None, thread.join)
+            await asyncio.sleep(0.1)
+            # all the lines of one readiness event are handled
+            self.assertEqual(3, device.read)
+            robot._stop_reading()
+        self.run_async(scenario())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,91 @@
+import time
+import unittest
+
+from sphero_sprk.command_policy import CommandPolicy
+from sphero_sprk.simulator import SimulatedSphero
+from sphero_sprk.sphero_constants import CMD_CODES
+
+
+class CommandPolicyTestCase(unittest.TestCase):
+
+    def test_lookup(self):
+        policy = CommandPolicy(timeout=0.5, retries=3)
+        self.assertEqual(3, policy.get(CMD_CODES.CMD_PING).retries)
+        self.assertEqual(0, policy.get(CMD_CODES.CMD_APPEND_FRAG).retries)
+        roll = policy.set(CMD_CODES.CMD_ROLL, timeout=0.1, confirm=True)
+        self.assertEqual((0.1, 3, True), (roll.timeout, roll.retries, roll.confirm))
+        self.assertIn(CMD_CODES.CMD_ROLL, policy)
+        policy.reset(CMD_CODES.CMD_ROLL)
+        self.assertIs(policy.default, policy.get(CMD_CODES.CMD_ROLL))
+
+
+class RetryTestCase(unittest.TestCase):
+
+    def slow_first_answer(self, device, delay=None, drop=False):
+        # the first command is answered after delay seconds, or dropped
+        original = device._handle_packet
+        state = {'first': True}
+
+        def handle(packet):
+            if state['first']:
+                state['first'] = False
+                if drop:
+                    return
+                device.latency = delay
+                original(packet)
+                device.latency = 0.0
+            else:
+                original(packet)
+        device._handle_packet = handle
+
+    def test_retry_and_late_response(self):
+        orb = SimulatedSphero.connected(self, policy=CommandPolicy(timeout=0.05, retries=2))
+        self.slow_first_answer(orb._device, delay=0.08)
+        (seq, resp) = orb.ping()
+        self.assertEqual(seq, resp[3])
+        self.assertEqual(1, orb.link_stats['retransmissions'])
+        # the first sequence number is held back until its late response can't come anymore
+        self.assertEqual(1, orb._sequence.held())
+        end = time.monotonic() + 0.1
+        while time.monotonic() < end:
+            orb._device.waitForNotifications(0.01)
+        self.assertEqual(1, orb._notifier.late_responses)
+
+    def test_give_up(self):
+        orb = SimulatedSphero.connected(self, policy=CommandPolicy(timeout=0.02, retries=2), loss=1.0)
+        commands = orb._device.stats['commands']
+        with self.assertRaises(TimeoutError):
+            orb.get_rgb_led()
+        self.assertEqual(commands + 3, orb._device.stats['commands'])
+        self.assertEqual(3, orb.link_stats['command_timeouts'])
+
+    def test_non_idempotent(self):
+        orb = SimulatedSphero.connected(self, policy=CommandPolicy(timeout=0.02, retries=2), loss=1.0)
+        with self.assertRaises(TimeoutError):
+            orb.command(CMD_CODES.CMD_RUN_MACRO, [1])
+        self.assertEqual(0, orb.link_stats['retransmissions'])
+
+    def test_confirmed_setpoint(self):
+        policy = CommandPolicy(timeout=0.05)
+        policy.set(CMD_CODES.CMD_ROLL, confirm=True)
+        orb = SimulatedSphero.connected(self, policy=policy)
+        self.slow_first_answer(orb._device, drop=True)
+        orb.start_pump()
+        orb.roll(60, 90)
+        end = time.monotonic() + 1.0
+        while orb._device.speed != 60 and time.monotonic() < end:
+            time.sleep(0.01)
+        self.assertEqual(60, orb._device.speed)
+        self.assertEqual(1, orb.link_stats['retransmissions'])
+
+    def test_future_retry(self):
+        orb = SimulatedSphero.connected(self, policy=CommandPolicy(timeout=0.05, retries=1))
+        self.slow_first_answer(orb._device, drop=True)
+        orb.start_pump()
+        (seq, future) = orb.command(CMD_CODES.CMD_PING, [], future=True)
+        resp = future.result(1.0)
+        self.assertNotEqual(seq, resp[3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -70,6 +70,19 @@ class MyTestCase(unittest.TestCase):
         self.assertEqual(expected1, MyTestCase.process_1_result)
         self.assertEqual(expected2b, MyTestCase.tuple_2a_result)
 
+    def test_process_sensor_pkt_samples(self):
+        # two samples of one mask in a frame
+        data = b'\xff\xfe\x03\x00\x09\x00\x01\x00\x02\x00\x03\x00\x04\x00'
+        received = []
+        masks = [
+            {'len': 2, 'callback': lambda sub: received.append(struct.unpack('>hh', sub))},
+        ]
+        s = DelegateObj(None, None)
+
+        s.process_sensor_pkt(masks, data)
+
+        self.assertEqual([(1, 2), (3, 4)], received)
+        self.assertEqual(0, s.metrics.length_mismatches)
 
     def test_verify_checksum(self):
         # Arrange
@@ -0,0 +1,115 @@
+import os
+import tempfile
+import time
+import unittest
+
+from sphero_sprk.discovery import DiscoveryService
+
+
+class FakeScanEntry(object):
+
+    def __init__(self, addr, name, rssi):
+        self.addr = addr
+        self.rssi = rssi
+        self._name = name
+
+    def getValueText(self, adtype):
+        return self._name
+
+
+class FakeScanner(object):
+    """Replays advertisements like bluepy.btle.Scanner.process does"""
+
+    def __init__(self, advertisements):
+        self.advertisements = list(advertisements)
+        self.delegate = None
+        self.scanning = False
+
+    def withDelegate(self, delegate):
+        self.delegate = delegate
+        return self
+
+    def start(self):
+        self.scanning = True
+
+    def stop(self):
+        self.scanning = False
+
+    def process(self, timeout):
+        if len(self.advertisements) > 0:
+            self.delegate.handleDiscovery(FakeScanEntry(*self.advertisements.pop(0)), True, True)
+        else:
+            time.sleep(timeout)
+
+
+class DiscoveryServiceTestCase(unittest.TestCase):
+
+    def test_order_and_ttl(self):
+        service = DiscoveryService(ttl=10)
+        service.observe("aa", "SK-AAAA", -70, now=100.0)
+        service.observe("bb", "SK-BBBB", -50, now=95.0)
+        self.assertFalse(service.observe("cc", "Keyboard", -30, now=100.0))
+        self.assertEqual(["bb", "aa"], [robot.addr for robot in service.robots('rssi', now=101.0)])
+        self.assertEqual("aa", service.robots('recent', now=101.0)[0].addr)
+        self.assertEqual(["aa"], [robot.addr for robot in service.robots(now=106.0)])
+
+    def test_background_scanner(self):
+        scanner = FakeScanner([("aa", "SK-AAAA", -80), ("bb", None, -20), ("cc", "SK-CCCC", -40)])
+        service = DiscoveryService(interval=0.01, scanner_factory=lambda iface: scanner)
+        service.start()
+        self.addCleanup(service.stop)
+        robots = service.wait_for(2, timeout=1.0)
+        self.assertEqual(["cc", "aa"], [robot.addr for robot in robots])
+        self.assertEqual("cc", service.strongest().addr)
+        self.assertTrue(scanner.scanning)
+        with self.assertRaises(TimeoutError):
+            service.wait_for(3, timeout=0.05)
+
+    def test_paused(self):
+        scanner = FakeScanner([])
+        ifaces = []
+
+        def factory(iface):
+            ifaces.append(iface)
+            return scanner
+
+        service = DiscoveryService(interval=0.01, iface=1, scanner_factory=factory)
+        service.start()
+        self.addCleanup(service.stop)
+        end = time.monotonic() + 1.0
+        while not scanner.scanning and time.monotonic() < end:
+            time.sleep(0.01)
+        with service.paused():
+            self.assertFalse(scanner.scanning)
+            with service.paused():
+                time.sleep(0.03)
+                self.assertFalse(scanner.scanning)
+        service.observe("aa", "SK-AAAA", -60)
+        self.assertEqual(1, len(service.wait_for(1, timeout=1.0)))
+        end = time.monotonic() + 1.0
+        while not scanner.scanning and time.monotonic() < end:
+            time.sleep(0.01)
+        self.assertTrue(scanner.scanning)
+        self.assertEqual([1], ifaces)
+
+    def test_scanner_error(self):
+        def broken(iface):
+            raise PermissionError("scanning needs root")
+        service = DiscoveryService(scanner_factory=broken)
+        service.start()
+        with self.assertRaises(PermissionError):
+            service.wait_for(1, timeout=1.0)
+
+    def test_disk_cache(self):
+        path = os.path.join(tempfile.mkdtemp(), "cache", "discovery.json")
+        service = DiscoveryService(cache_path=path)
+        service.observe("aa", "SK-AAAA", -60)
+        service.observe("bb", "SK-BBBB", -60, now=time.time() - 1000)
+        service.save()
+        warm = DiscoveryService(cache_path=path)
+        self.assertEqual(["aa"], warm.addresses())
+        self.assertEqual("SK-AAAA", warm.most_recent().name)
+
+
+if __name__ == '__main__':
+    unittest.main()
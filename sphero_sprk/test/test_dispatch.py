@@ -0,0 +1,138 @@
+import struct
+import threading
+import time
+import unittest
+
+from sphero_sprk.dispatch import BLOCK, DROP_OLDEST, KEEP_LATEST, Dispatcher, Subscription
+from sphero_sprk.simulator import SimulatedSphero
+
+
+class SubscriptionTestCase(unittest.TestCase):
+
+    def subscription(self, **kwargs):
+        received = []
+        gate = threading.Event()
+
+        def callback(item):
+            gate.wait(1.0)
+            received.append(item)
+        subscription = Subscription(callback, **kwargs)
+        subscription.start()
+        self.addCleanup(subscription.close, False)
+        return (subscription, received, gate)
+
+    def fill(self, subscription, count):
+        subscription.offer(0)
+        # the callback holds the first item, the others are queued
+        while subscription.depth() > 0:
+            time.sleep(0.001)
+        for i in range(1, count):
+            subscription.offer(i)
+
+    def test_drop_oldest(self):
+        (subscription, received, gate) = self.subscription(maxsize=3, policy=DROP_OLDEST)
+        self.fill(subscription, 10)
+        gate.set()
+        self.assertTrue(subscription.join_queue(1.0))
+        self.assertEqual([0, 7, 8, 9], received)
+        self.assertEqual(6, subscription.stats()['dropped'])
+        self.assertEqual(3, subscription.stats()['max_depth'])
+
+    def test_keep_latest(self):
+        (subscription, received, gate) = self.subscription(maxsize=3, policy=KEEP_LATEST)
+        self.fill(subscription, 10)
+        gate.set()
+        self.assertTrue(subscription.join_queue(1.0))
+        # the queue was cleared for 4 and again for 7
+        self.assertEqual([0, 7, 8, 9], received)
+        self.assertEqual(6, subscription.dropped)
+        self.fill(subscription, 5)
+        self.assertEqual(1, subscription.depth())
+
+    def test_block(self):
+        (subscription, received, gate) = self.subscription(maxsize=2, policy=BLOCK)
+        self.fill(subscription, 3)
+        writer = threading.Thread(target=subscription.offer, args=(3,))
+        writer.start()
+        writer.join(0.05)
+        self.assertTrue(writer.is_alive())
+        gate.set()
+        writer.join(1.0)
+        self.assertTrue(subscription.join_queue(1.0))
+        self.assertEqual([0, 1, 2, 3], received)
+        self.assertEqual(0, subscription.dropped)
+
+    def test_decimation(self):
+        (subscription, received, gate) = self.subscription(every=3)
+        gate.set()
+        for i in range(10):
+            subscription.offer(i)
+        self.assertTrue(subscription.join_queue(1.0))
+        self.assertEqual([0, 3, 6, 9], received)
+        self.assertEqual(6, subscription.stats()['decimated'])
+
+    def test_callback_error(self):
+        subscription = Subscription(lambda item: 1 / item)
+        subscription.start()
+        for i in (1, 0, 2):
+            subscription.offer(i)
+        subscription.close()
+        self.assertEqual(2, subscription.delivered)
+        self.assertEqual(1, subscription.errors)
+        self.assertFalse(subscription.is_alive())
+
+    def test_names(self):
+        dispatcher = Dispatcher()
+        self.addCleanup(dispatcher.close)
+        dispatcher.subscribe(lambda item: None)
+        dispatcher.subscribe(lambda item: None)
+        self.assertEqual(['<lambda>', '<lambda>-2'], sorted(dispatcher.stats()))
+
+
+class SpheroSubscriptionTestCase(unittest.TestCase):
+
+    def pump(self, orb, seconds):
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            orb._device.waitForNotifications(0.01)
+
+    def test_fan_out(self):
+        orb = SimulatedSphero.connected(self)
+        slow = []
+        every_fifth = []
+        subscription = orb.subscribe(lambda frame: (time.sleep(0.05), slow.append(frame)), ['odometer'],
+                                     maxsize=1, policy=KEEP_LATEST, name='slow')
+        sampled = orb.subscribe(every_fifth.append, ['odometer'], every=5, name='sampled')
+        orb.update_streaming(rate=200)
+        start = time.monotonic()
+        self.pump(orb, 0.2)
+        # reading took no longer because of the slow subscriber
+        self.assertLess(time.monotonic() - start, 0.3)
+        self.assertTrue(sampled.join_queue(1.0))
+        stats = orb.metrics.snapshot()['subscriptions']
+        self.assertEqual(stats['slow']['offered'], stats['sampled']['offered'])
+        self.assertGreater(stats['slow']['dropped'], 0)
+        self.assertEqual(stats['sampled']['offered'] - stats['sampled']['decimated'], len(every_fifth))
+        orb.unsubscribe(subscription)
+        orb.unsubscribe(sampled)
+        self.assertEqual({}, orb.metrics.snapshot()['subscriptions'])
+        self.assertEqual([], orb.get_frame_callbacks())
+        self.assertEqual((0, 0), orb._stream_mask.masks())
+
+    def test_stream_callbacks_of_a_group(self):
+        orb = SimulatedSphero.connected(self)
+        first = []
+        second = []
+        orb.set_stream_callback('odometer', lambda data: first.append(struct.unpack('>hh', data)), mask_id=2)
+        orb.set_stream_callback('odometer', lambda data: second.append(struct.unpack('>hh', data)), mask_id=2)
+        orb.config_locator(3, 4, 0)
+        orb.update_streaming(rate=100)
+        self.pump(orb, 0.1)
+        self.assertGreater(len(first), 0)
+        self.assertEqual(first, second)
+        orb.remove_stream_callback('odometer', mask_id=2)
+        self.assertEqual((0, 0), orb._stream_mask.masks())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+
+import sphero_sprk.util as util
+from sphero_sprk.encoder import PacketEncoder
+from sphero_sprk.sphero_constants import CMD_CODES
+
+
+class EncoderTestCase(unittest.TestCase):
+
+    def reference_packet(self, sop2, did, cid, seq, payload):
+        body = bytes([did, cid, seq, len(payload) + 1]) + payload
+        return bytes([0xff, sop2]) + body + bytes([util.cal_packet_checksum([body])])
+
+    def test_roll(self):
+        encoder = PacketEncoder()
+        packet = encoder.encode(CMD_CODES.CMD_ROLL, 7, False, 100, 300, 1)
+        expected = self.reference_packet(0xfe, 0x02, 0x30, 7, b'\x64\x01\x2c\x01')
+        self.assertEqual(expected, bytes(packet))
+
+    def test_locator_signed(self):
+        encoder = PacketEncoder()
+        packet = encoder.encode(CMD_CODES.CMD_LOCATOR, 255, True, 0, -10, 50, 0)
+        expected = self.reference_packet(0xff, 0x02, 0x13, 255, b'\x00\xff\xf6\x00\x32\x00\x00')
+        self.assertEqual(expected, bytes(packet))
+
+    def test_buffer_reuse(self):
+        encoder = PacketEncoder()
+        long_packet = bytes(encoder.encode(CMD_CODES.CMD_SET_RGB_LED, 1, False, 1, 2, 3, 0))
+        short_packet = bytes(encoder.encode(CMD_CODES.CMD_PING, 2, True))
+        self.assertEqual(self.reference_packet(0xfe, 0x02, 0x20, 1, b'\x01\x02\x03\x00'), long_packet)
+        self.assertEqual(self.reference_packet(0xff, 0x00, 0x01, 2, b''), short_packet)
+
+    def test_encode_payload(self):
+        encoder = PacketEncoder()
+        packet = encoder.encode_payload(True, 0x02, 0x61, 3, b'\x00abc\n')
+        self.assertEqual(self.reference_packet(0xff, 0x02, 0x61, 3, b'\x00abc\n'), bytes(packet))
+
+    def test_missing_layout(self):
+        encoder = PacketEncoder()
+        with self.assertRaises(KeyError):
+            encoder.encode(CMD_CODES.CMD_SLEEP, 0, False)
+        encoder.register_layout(CMD_CODES.CMD_SLEEP, '>HBH')
+        self.assertEqual(12, len(encoder.encode(CMD_CODES.CMD_SLEEP, 0, False, 0, 0, 0)))
+
+
+if __name__ == '__main__':
+    unittest.main()
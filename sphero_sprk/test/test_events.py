@@ -0,0 +1,65 @@
+import time
+import unittest
+
+from sphero_sprk.events import (AsyncMessage, AsyncRouter, CollisionEvent, OrbBasicErrorEvent, OrbBasicPrintEvent,
+                                PowerEvent)
+from sphero_sprk.metrics import Metrics
+from sphero_sprk.simulator import SimulatedSphero, build_async_packet
+
+
+class AsyncRouterTestCase(unittest.TestCase):
+
+    def test_orbbasic(self):
+        router = AsyncRouter()
+        events = []
+        router.subscribe(OrbBasicPrintEvent, events.append)
+        router.subscribe(OrbBasicErrorEvent, events.append)
+        self.assertTrue(router.dispatch(build_async_packet(0x08, b'hello\x00')))
+        self.assertTrue(router.dispatch(build_async_packet(0x09, b'bad syntax')))
+        self.assertTrue(router.dispatch(build_async_packet(0x0A, b'\x00\x14\x00\x03')))
+        self.assertEqual("hello", events[0].text)
+        self.assertEqual("bad syntax", events[1].text)
+        self.assertEqual((20, 3), (events[2].line, events[2].code))
+
+    def test_unknown(self):
+        metrics = Metrics()
+        router = AsyncRouter(metrics)
+        packet = build_async_packet(0x42, b'\x01\x02')
+        self.assertFalse(router.dispatch(packet))
+        messages = []
+        router.subscribe(AsyncMessage, messages.append)
+        self.assertTrue(router.dispatch(packet))
+        self.assertEqual((0x42, b'\x01\x02'), messages[0][:2])
+        # too short to be a collision
+        router.subscribe(CollisionEvent, messages.append)
+        self.assertTrue(router.dispatch(build_async_packet(0x07, b'\x01')))
+        self.assertEqual(1, metrics.length_mismatches)
+
+    def pump(self, orb, seconds=0.05):
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            orb._device.waitForNotifications(0.01)
+
+    def test_collision_and_power(self):
+        orb = SimulatedSphero.connected(self)
+        collisions = []
+        power = []
+        orb.add_event_callback(CollisionEvent, collisions.append)
+        orb.add_event_callback(PowerEvent, power.append)
+        orb._device.bump()
+        self.pump(orb)
+        self.assertEqual([], collisions)
+        orb.set_collision_detection(x_threshold=40, y_threshold=40, dead_time=200, resp=True)
+        orb.set_power_notify(True, resp=True)
+        orb.roll(60, 0)
+        orb._device.bump(y=-500)
+        orb._device.set_power_state(3)
+        self.pump(orb)
+        self.assertEqual(1, len(collisions))
+        self.assertEqual((-500, 2, 60), (collisions[0].y, collisions[0].axis, collisions[0].speed))
+        self.assertEqual(['low'], [event.state for event in power])
+        self.assertEqual(0, orb.metrics.unknown_async)
+
+
+if __name__ == '__main__':
+    unittest.main()
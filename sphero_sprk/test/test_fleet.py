@@ -0,0 +1,142 @@
+import threading
+import time
+import unittest
+
+from sphero_sprk.fleet import SpheroFleet
+from sphero_sprk.simulator import SimulatedSphero
+from sphero_sprk.timeout import call_with_timeout
+
+
+class SlowFactory(object):
+    """Peripheral factory that takes a while to connect and fails the first attempts of some robots"""
+
+    def __init__(self, delay=0.05, failures=None, hang=(), hang_time=1.0):
+        self.delay = delay
+        self.failures = dict(failures or {})
+        self.hang = hang
+        self.hang_time = hang_time
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+
+    def __call__(self, addr):
+        with self.lock:
+            self.active += 1
+            self.max_active = max(self.max_active, self.active)
+        try:
+            time.sleep(self.delay)
+            if addr in self.hang:
+                time.sleep(self.hang_time)
+            with self.lock:
+                if self.failures.get(addr, 0) > 0:
+                    self.failures[addr] -= 1
+                    raise ConnectionError("connection refused")
+            return SimulatedSphero(addr)
+        finally:
+            with self.lock:
+                self.active -= 1
+
+
+class HandshakeFailure(SimulatedSphero):
+    """Accepts the LE connection but fails the handshake that follows"""
+
+    def getServiceByUUID(self, uuid):
+        raise ConnectionError("service discovery failed")
+
+    def writeCharacteristic(self, handle, val, withResponse=False):
+        raise ConnectionError("write failed")
+
+
+class CallWithTimeoutTestCase(unittest.TestCase):
+
+    def test_result_and_error(self):
+        self.assertEqual(3, call_with_timeout(lambda: 3, 1.0))
+        with self.assertRaises(ValueError):
+            call_with_timeout(lambda: int("x"), 1.0)
+
+    def test_concurrent_timeouts(self):
+        late = []
+        errors = []
+
+        def slow():
+            time.sleep(0.2)
+            return "late"
+
+        def run():
+            try:
+                call_with_timeout(slow, 0.05, on_late=late.append)
+            except TimeoutError as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(4, len(errors))
+        time.sleep(0.3)
+        self.assertEqual(["late"] * 4, late)
+
+
+class SpheroFleetTestCase(unittest.TestCase):
+
+    def test_connect(self):
+        factory = SlowFactory(failures={"00:00:00:00:00:02": 1}, hang=("00:00:00:00:00:03",), hang_time=0.4)
+        addresses = ["00:00:00:00:00:0{}".format(i) for i in range(4)] + [("00:00:00:00:01:00", 1)]
+        fleet = SpheroFleet(addresses, per_adapter=2, timeout=0.3, retries=1, backoff=0.01, peripheral_factory=factory)
+        self.addCleanup(fleet.disconnect)
+        start = time.monotonic()
+        report = fleet.connect()
+        # sequentially it would take more than 2 * 0.45 + 5 * 0.05
+        self.assertLess(time.monotonic() - start, 1.0)
+        self.assertEqual(4, len(fleet))
+        self.assertEqual(2, report["00:00:00:00:00:02"]["attempts"])
+        self.assertTrue(report["00:00:00:00:00:02"]["connected"])
+        self.assertFalse(report["00:00:00:00:00:03"]["connected"])
+        self.assertEqual(2, len(report["00:00:00:00:00:03"]["errors"]))
+        self.assertGreater(report["00:00:00:00:00:00"]["latency"], 0.04)
+        # two adapters with two connections each
+        self.assertLessEqual(factory.max_active, 4)
+
+    def test_timed_out_attempt_keeps_adapter(self):
+        factory = SlowFactory(delay=0.01, hang=("00:00:00:00:00:00",), hang_time=0.2)
+        fleet = SpheroFleet(["00:00:00:00:00:00", "00:00:00:00:00:01"], per_adapter=1, timeout=0.05, retries=0,
+                            peripheral_factory=factory)
+        self.addCleanup(fleet.disconnect)
+        fleet.connect()
+        time.sleep(0.3)
+        # the second robot waited for the abandoned connect of the first one
+        self.assertEqual(1, factory.max_active)
+        self.assertEqual(1, len(fleet))
+
+    def test_failed_handshake_disconnects(self):
+        devices = []
+
+        def factory(addr):
+            devices.append((HandshakeFailure if len(devices) == 0 else SimulatedSphero)(addr))
+            return devices[-1]
+
+        fleet = SpheroFleet(["00:00:00:00:00:00"], retries=1, backoff=0.01, peripheral_factory=factory)
+        self.addCleanup(fleet.disconnect)
+        fleet.connect()
+        self.assertEqual(1, len(fleet))
+        # the connection of the failed handshake isn't left open next to the retry's
+        self.assertFalse(devices[0].connected)
+        self.assertTrue(devices[1].connected)
+
+    def test_broadcast(self):
+        fleet = SpheroFleet(["00:00:00:00:00:0{}".format(i) for i in range(3)], per_adapter=3,
+                            peripheral_factory=SimulatedSphero.factory())
+        self.addCleanup(fleet.disconnect)
+        fleet.connect()
+        results = fleet.roll(40, 270)
+        self.assertEqual(3, len(results))
+        for robot in fleet:
+            self.assertEqual(40, robot._device.speed)
+        self.assertLess(fleet.last_skew, 0.05)
+        pings = fleet.ping()
+        self.assertTrue(all(resp[1][2] == 0 for resp in pings.values()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+
+from sphero_sprk.macro import TEMP_MACRO_ID, MacroBuilder, disassemble
+from sphero_sprk.simulator import SimulatedSphero
+from sphero_sprk.sphero_constants import MACRO_CODES
+
+
+class MacroTestCase(unittest.TestCase):
+
+    def test_compile(self):
+        macro = MacroBuilder()
+        macro.comment("square")
+        with macro.loop(4):
+            macro.roll(80, 0, pcd=10).delay(500).set_rgb_led(255, 0, 0)
+        macro.fade_to_led(0, 0, 255, 250).stop()
+        code = macro.compile()
+        self.assertEqual(bytes([0x05, 80, 0, 0, 10]), code[11:16])
+        self.assertEqual(MACRO_CODES.END.value, code[-1])
+        commands = disassemble(code)
+        self.assertEqual((MACRO_CODES.COMMENT, ("square",)), commands[0])
+        self.assertEqual((MACRO_CODES.LOOP_START, (4,)), commands[1])
+        self.assertEqual((MACRO_CODES.FADE_TO_LED, (0, 0, 255, 250)), commands[-3])
+        self.assertEqual(4 * 510 + 250, macro.duration)
+        with self.assertRaisesRegex(ValueError, "opcode 0x06 at offset 3"):
+            disassemble(bytes([0x0B, 0, 10, 0x06, 0, 0]))
+        with self.assertRaisesRegex(ValueError, "DELAY at offset 0 is truncated"):
+            disassemble(bytes([0x0B, 0]))
+        with self.assertRaises(ValueError):
+            with macro.loop(2):
+                with macro.loop(2):
+                    pass
+
+    def test_upload_and_status(self):
+        orb = SimulatedSphero.connected(self)
+        macro = MacroBuilder()
+        for i in range(100):
+            macro.set_rgb_led(i, 0, 0).delay(1)
+        self.assertEqual(4, orb.upload_macro(macro, chunk_size=250))
+        self.assertEqual(macro.compile(), bytes(orb._device.temp_macro))
+        orb.run_macro(TEMP_MACRO_ID)
+        self.assertEqual(TEMP_MACRO_ID, orb.macro_status()[0])
+        self.assertTrue(orb.wait_for_macro(timeout=1.0, interval=0.02))
+        self.assertEqual((0, 0), orb.macro_status())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,43 @@
+import unittest
+
+from sphero_sprk.mask_index import MaskIndex, StreamMask
+from sphero_sprk.test.test_stream_decoder import MASK_LIST1, MASK_LIST2
+
+
+class MaskIndexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.index = MaskIndex(MASK_LIST1, MASK_LIST2)
+
+    def test_lookup(self):
+        self.assertEqual((1, 0x0000e000), self.index.lookup('accel_filtered'))
+        self.assertEqual((1, 0x00004000), self.index.lookup('accel_filtered.y'))
+        self.assertEqual((2, 0x0c000000), self.index.lookup('odometer'))
+        with self.assertRaises(ValueError):
+            self.index.lookup('gyro_raw')
+
+    def test_remove_never_enabled(self):
+        mask = StreamMask(self.index)
+        mask.add('odometer')
+        self.assertFalse(mask.remove('accel_filtered'))
+        self.assertEqual((0, 0x0c000000), mask.masks())
+
+    def test_reference_counts(self):
+        mask = StreamMask(self.index)
+        self.assertTrue(mask.add('accel_filtered', 'a'))
+        self.assertFalse(mask.add('accel_filtered', 'a'))
+        self.assertFalse(mask.add('accel_filtered.x', 'b'))
+        self.assertTrue(mask.remove('accel_filtered', 'a'))
+        self.assertEqual(0x00008000, mask.mask1)
+        self.assertTrue(mask.remove_subscriber('b'))
+        self.assertEqual((0, 0), mask.masks())
+
+    def test_pack(self):
+        mask = StreamMask(self.index)
+        mask.add('imu_filtered')
+        mask.add('odometer.x')
+        self.assertEqual(b'\x00\x28\x00\x01\x00\x07\x00\x00\x00\x08\x00\x00\x00', mask.pack(10))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,20 @@
+import subprocess
+import sys
+import unittest
+
+from sphero_sprk import mask_schema
+
+
+class MaskSchemaTestCase(unittest.TestCase):
+
+    def test_generated_module_matches_yaml(self):
+        self.assertEqual((mask_schema.MASK_LIST1, mask_schema.MASK_LIST2), mask_schema.load_yaml_schema())
+
+    def test_import_is_lazy(self):
+        code = "import sys, sphero_sprk; print('bluepy' in sys.modules, 'yaml' in sys.modules)"
+        output = subprocess.check_output([sys.executable, '-c', code]).decode().split()
+        self.assertEqual(['False', 'False'], output)
+
+
+if __name__ == '__main__':
+    unittest.main()
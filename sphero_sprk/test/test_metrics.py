@@ -0,0 +1,96 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+import urllib.request
+
+from sphero_sprk.metrics import Histogram, Metrics, PrometheusExporter, prometheus_text
+from sphero_sprk.simulator import SimulatedSphero
+
+
+class MetricsTestCase(unittest.TestCase):
+
+    def test_histogram(self):
+        histogram = Histogram((0.01, 0.1, 1.0))
+        for value in (0.005, 0.005, 0.05, 3.0):
+            histogram.observe(value)
+        self.assertEqual(0.01, histogram.quantile(0.5))
+        self.assertEqual(3.0, histogram.quantile(0.99))
+        self.assertEqual([(0.01, 2), (0.1, 3), (1.0, 3), (float('inf'), 4)], histogram.cumulative())
+
+    def test_stream_rate_and_jitter(self):
+        metrics = Metrics()
+        for i in range(100):
+            metrics.frame(i * 0.02)
+        self.assertAlmostEqual(50.0, metrics.stream_fps, places=3)
+        self.assertAlmostEqual(0.0, metrics.stream_jitter, places=6)
+        metrics.frame(99 * 0.02 + 0.06)
+        self.assertGreater(metrics.stream_jitter, 0.001)
+
+    def test_rate_limited_log(self):
+        metrics = Metrics("orb", log_interval=60)
+        with self.assertLogs("sphero_sprk", level="WARNING") as logs:
+            for _ in range(5):
+                metrics.problem('unknown_async', "unknown async message %s", "ff")
+        self.assertEqual(1, len(logs.output))
+        self.assertEqual(5, metrics.unknown_async)
+
+    def test_snapshot_while_observing(self):
+        metrics = Metrics()
+        errors = []
+
+        def observe():
+            for i in range(50000):
+                metrics.observe_rtt(i, 0.001)
+
+        def scrape():
+            try:
+                while thread.is_alive():
+                    metrics.snapshot()
+            except RuntimeError as e:
+                errors.append(e)
+
+        # switch threads as often as possible so the scrape runs in the middle of the inserts
+        self.addCleanup(sys.setswitchinterval, sys.getswitchinterval())
+        sys.setswitchinterval(1e-6)
+        thread = threading.Thread(target=observe)
+        thread.start()
+        scrape()
+        thread.join()
+        self.assertEqual([], errors)
+        self.assertEqual(50000, len(metrics.snapshot()['rtt']))
+
+    def test_connection(self):
+        orb = SimulatedSphero.connected(self)
+        orb.ping()
+        orb.roll(10, 10)
+        snapshot = orb.metrics.snapshot()
+        self.assertEqual(1, snapshot['rtt']['CMD_PING']['count'])
+        self.assertEqual(2, snapshot['tx_packets'])
+        self.assertEqual(orb._device.stats['bytes_written'] - 7, snapshot['tx_bytes'])
+        self.assertEqual(1, snapshot['rx_packets'])
+        self.assertEqual(1, snapshot['reassembler']['packets'])
+        self.assertEqual(1, snapshot['link']['connects'])
+
+    def test_prometheus(self):
+        metrics = Metrics("aa:bb")
+        metrics.observe_rtt("CMD_PING", 0.004)
+        metrics.tx_bytes = 12
+        text = prometheus_text([metrics])
+        self.assertIn('sphero_tx_bytes_total{robot="aa:bb"} 12\n', text)
+        self.assertIn('sphero_rtt_seconds_bucket{robot="aa:bb",command="CMD_PING",le="0.005"} 1\n', text)
+        self.assertIn('sphero_rtt_seconds_count{robot="aa:bb",command="CMD_PING"} 1\n', text)
+
+        path = os.path.join(tempfile.mkdtemp(), "sphero.prom")
+        exporter = PrometheusExporter([metrics], path=path, port=0).start()
+        self.addCleanup(exporter.stop)
+        with urllib.request.urlopen("http://127.0.0.1:{}/metrics".format(exporter.port)) as response:
+            self.assertEqual(text, response.read().decode("utf-8"))
+        exporter.write()
+        with open(path) as f:
+            self.assertEqual(text, f.read())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import time
+import unittest
+
+from sphero_sprk.odometry import LocatorPoller, StateEstimator
+from sphero_sprk.simulator import SimulatedSphero
+
+
+class StateEstimatorTestCase(unittest.TestCase):
+
+    def test_interpolation(self):
+        estimator = StateEstimator(capacity=4)
+        estimator.update(1.0, 0, 0, yaw=170)
+        estimator.update(2.0, 10, 20, yaw=-170)
+        pose = estimator.pose_at(1.5)
+        self.assertEqual((5.0, 10.0), (pose.x, pose.y))
+        # velocity derived from the odometer, yaw on the shorter arc
+        self.assertEqual((5.0, 10.0), (pose.vx, pose.vy))
+        self.assertAlmostEqual(180.0, abs(pose.yaw))
+        # extrapolated with the last velocity
+        pose = estimator.pose_at(2.5)
+        self.assertEqual((15.0, 30.0), (pose.x, pose.y))
+
+    def test_ring(self):
+        estimator = StateEstimator(capacity=4)
+        for i in range(10):
+            estimator.update(float(i), i * 2, 0, vx=2.0, vy=0.0)
+        self.assertEqual(4, len(estimator))
+        self.assertEqual(13.0, estimator.pose_at(6.5).x)
+        self.assertEqual(8.5, estimator.pose_at(4.25).x)  # before the history: extrapolated back from t=6
+        self.assertEqual(18, estimator.latest().x)
+        # out of order updates are dropped
+        estimator.update(5.0, 100, 100)
+        self.assertEqual(9.0, estimator.latest().timestamp)
+
+    def test_stream(self):
+        orb = SimulatedSphero.connected(self)
+        estimator = StateEstimator(orb)
+        orb.roll(100, 90)
+        orb.update_streaming(rate=100)
+        end = time.monotonic() + 0.2
+        while time.monotonic() < end:
+            orb._device.waitForNotifications(0.01)
+        pose = estimator.latest()
+        self.assertGreater(len(estimator), 10)
+        self.assertGreater(pose.x, 0)
+        self.assertAlmostEqual(80.0, pose.vx, places=3)
+        self.assertEqual(90, pose.yaw)
+        self.assertTrue(estimator.stream_active())
+
+    def test_locator_polling(self):
+        orb = SimulatedSphero.connected(self)
+        orb.config_locator(50, -20, 0)
+        self.assertEqual({'x': 50, 'y': -20, 'vx': 0, 'vy': 0, 'sog': 0}, orb.read_locator())
+        estimator = StateEstimator()
+        poller = LocatorPoller([(orb, estimator)])
+        self.assertEqual(1, poller.poll())
+        pose = estimator.latest()
+        self.assertEqual((50, -20), (pose.x, pose.y))
+        # a robot with an active stream isn't polled
+        estimator.last_frame = time.monotonic()
+        self.assertEqual(0, poller.poll())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import unittest
+
+from sphero_sprk.orbbasic import ProgramCache, STORAGE_PERSISTENT, STORAGE_RAM, pack_fragments, program_text
+from sphero_sprk.simulator import SimulatedSphero
+from sphero_sprk.sphero import Sphero
+
+PROGRAM = ["{} print \"line {}\"".format(10 * (i + 1), i) for i in range(200)]
+
+
+class OrbBasicTestCase(unittest.TestCase):
+
+    def test_pack_fragments(self):
+        text = program_text(PROGRAM)
+        fragments = pack_fragments(text, 100)
+        self.assertEqual(text, b''.join(fragments))
+        self.assertTrue(all(len(fragment) <= 100 for fragment in fragments))
+        # lines are not split
+        self.assertTrue(all(fragment.endswith(b'\n') for fragment in fragments[:-1]))
+        self.assertEqual([b'x' * 10, b'x' * 5 + b'\n\x00'], pack_fragments(program_text("x" * 15), 10))
+
+    def test_upload(self):
+        orb = SimulatedSphero.connected(self)
+        progress = []
+        commands = orb._device.stats['commands']
+        self.assertTrue(orb.upload_orb_basic_program(PROGRAM, STORAGE_PERSISTENT, progress=lambda *args: progress.append(args)))
+        self.assertEqual("\n".join(PROGRAM) + "\n", orb._device.orbbasic_program(1))
+        fragments = len(pack_fragments(program_text(PROGRAM)))
+        # erase + packed fragments instead of one command per line
+        self.assertEqual(commands + 1 + fragments, orb._device.stats['commands'])
+        self.assertLess(fragments, len(PROGRAM) / 10)
+        self.assertEqual(len(program_text(PROGRAM)), progress[-1][0])
+        self.assertEqual(fragments, len(progress))
+
+        # unchanged: nothing is sent
+        commands = orb._device.stats['commands']
+        self.assertFalse(orb.upload_orb_basic_program(PROGRAM, STORAGE_PERSISTENT))
+        self.assertEqual(commands, orb._device.stats['commands'])
+        self.assertTrue(orb.upload_orb_basic_program(PROGRAM[:10], STORAGE_PERSISTENT))
+        self.assertEqual("\n".join(PROGRAM[:10]) + "\n", orb._device.orbbasic_program(1))
+
+    def test_pipelined_with_pump(self):
+        orb = SimulatedSphero.connected(self)
+        orb.start_pump()
+        self.assertTrue(orb.upload_orb_basic_program(PROGRAM, STORAGE_RAM, force=True))
+        self.assertEqual("\n".join(PROGRAM) + "\n", orb._device.orbbasic_program(0))
+
+    def test_ram_hash_per_connection(self):
+        cache = ProgramCache()
+        (device, other) = (object(), object())
+        cache.put("aa", STORAGE_RAM, "abc", device)
+        cache.put("aa", STORAGE_PERSISTENT, "def", device)
+        self.assertEqual("abc", cache.get("aa", STORAGE_RAM, device))
+        # the robot may have restarted since, RAM is empty
+        self.assertIsNone(cache.get("aa", STORAGE_RAM, other))
+        self.assertEqual("def", cache.get("aa", STORAGE_PERSISTENT, other))
+
+    def test_commands(self):
+        orb = SimulatedSphero.connected(self)
+        data = ["0a", b'10 print 1']
+        self.assertTrue(orb.append_orb_basic_fragment(Sphero.STORAGE_RAM, data))
+        # the list of the caller isn't modified
+        self.assertEqual(["0a", b'10 print 1'], data)
+        self.assertTrue(orb.append_orb_basic_line(Sphero.STORAGE_RAM, "20 print 2"))
+        self.assertTrue(orb.run_orb_basic_program(Sphero.STORAGE_RAM, 10))
+        self.assertTrue(orb.abort_orb_basic_program())
+        self.assertTrue(orb.erase_orb_basic_storage(Sphero.STORAGE_RAM))
+        self.assertEqual("", orb._device.orbbasic_program(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,180 @@
+import threading
+import time
+import unittest
+
+from sphero_sprk.metrics import Metrics
+from sphero_sprk.pipeline import PRIORITY_COSMETIC, PRIORITY_NORMAL, PRIORITY_STOP, PRIORITY_STREAM, \
+    SequenceAllocator, TransmitQueue
+from sphero_sprk.simulator import SimulatedSphero, build_sync_packet
+from sphero_sprk.sphero import Sphero
+from sphero_sprk.sphero_constants import CMD_CODES
+
+
+class SequenceAllocatorTestCase(unittest.TestCase):
+
+    def test_reserved_are_skipped(self):
+        allocator = SequenceAllocator()
+        self.assertEqual(0, allocator.allocate(reserve=True))
+        for _ in range(255):
+            allocator.allocate()
+        # wrapped around, 0 is still waiting for its response
+        self.assertEqual(1, allocator.allocate())
+        allocator.release(0)
+        self.assertEqual(0, allocator.in_flight())
+
+    def test_exhausted(self):
+        allocator = SequenceAllocator()
+        for _ in range(256):
+            allocator.allocate(reserve=True)
+        with self.assertRaises(RuntimeError):
+            allocator.allocate()
+
+
+class PipelineTestCase(unittest.TestCase):
+
+    def test_pipelined(self):
+        orb = SimulatedSphero.connected(self, latency=0.02, jitter=0.01, seed=1)
+        orb.start_pump(window=8)
+        start = time.monotonic()
+        pending = [orb.command(CMD_CODES.CMD_PING, [], future=True) for _ in range(32)]
+        for (seq, future) in pending:
+            self.assertEqual(build_sync_packet(0, seq), future.result(1.0))
+        # 32 round trips of 20ms one after the other would take at least 0.64s
+        self.assertLess(time.monotonic() - start, 0.5)
+        # the futures are completed on the pump thread, joining it makes sure their callbacks ran
+        orb.stop_pump()
+        self.assertEqual(0, orb._sequence.in_flight())
+
+    def test_blocking_with_pump(self):
+        orb = SimulatedSphero.connected(self, latency=0.005)
+        orb.start_pump()
+        orb.set_rgb_led(1, 2, 3, persist=True, resp=True)
+        self.assertEqual((1, 2, 3), orb.get_rgb_led())
+        self.assertEqual("SK-SIM", orb.get_device_name()["name"])
+
+    def test_timeout(self):
+        orb = SimulatedSphero.connected(self, loss=1.0)
+        orb.start_pump(timeout=0.05)
+        (seq, future) = orb.command(CMD_CODES.CMD_PING, [], future=True)
+        with self.assertRaises(TimeoutError):
+            future.result(1.0)
+        orb.stop_pump()
+        self.assertEqual(0, orb._notifier.pending_count())
+        self.assertEqual(0, orb._sequence.in_flight())
+
+    def test_timeout_without_pump(self):
+        orb = SimulatedSphero.connected(self, loss=1.0)
+        with self.assertRaises(TimeoutError):
+            orb.command(CMD_CODES.CMD_PING, [], timeout=0.05)
+        self.assertEqual(0, orb._notifier.pending_count())
+
+    def test_disconnect_fails_pending(self):
+        orb = SimulatedSphero.connected(self, latency=1.0)
+        orb.start_pump()
+        (seq, future) = orb.command(CMD_CODES.CMD_PING, [], future=True)
+        orb.disconnect()
+        with self.assertRaises(ConnectionError):
+            future.result(1.0)
+
+
+class TransmitQueueTestCase(unittest.TestCase):
+
+    def hold(self, lock):
+        # a reader holding the notification lock in another thread
+        held = threading.Event()
+        release = threading.Event()
+
+        def reader():
+            with lock:
+                held.set()
+                release.wait(1.0)
+        thread = threading.Thread(target=reader)
+        thread.start()
+        held.wait(1.0)
+        return (release, thread)
+
+    def test_priority_order(self):
+        lock = threading.RLock()
+        written = []
+        queue = TransmitQueue(written.append, lock)
+        queue.start()
+        self.addCleanup(queue.stop)
+        (release, reader) = self.hold(lock)
+        queue.put(b'led1', PRIORITY_COSMETIC)
+        # the thread took led1 and waits for the lock
+        while len(queue._heap) > 0:
+            time.sleep(0.001)
+        queue.put(b'led2', PRIORITY_COSMETIC)
+        queue.put(b'ping', PRIORITY_NORMAL)
+        queue.put(b'stream', PRIORITY_STREAM)
+        queue.put(b'stop', PRIORITY_STOP)
+        queue.put(b'led3', PRIORITY_COSMETIC)
+        self.assertEqual(6, queue.pending())
+        release.set()
+        self.assertTrue(queue.wait_drained(1.0))
+        self.assertEqual([b'led1', b'stop', b'stream', b'ping', b'led2', b'led3'], written)
+        reader.join()
+
+    def test_write_error(self):
+        def broken(chunk):
+            raise OSError("link lost")
+        metrics = Metrics("test")
+        queue = TransmitQueue(broken, threading.RLock(), metrics)
+        queue.start()
+        self.addCleanup(queue.stop)
+        queue.put(b'stop', PRIORITY_STOP)
+        self.assertTrue(queue.wait_drained(1.0))
+        self.assertEqual(1, metrics.tx_errors)
+        with self.assertRaises(ConnectionError):
+            queue.put(b'stop', PRIORITY_STOP)
+        queue.clear_error()
+        queue.put(b'stop', PRIORITY_STOP)
+        self.assertTrue(queue.wait_drained(1.0))
+        self.assertEqual(2, queue.stats()['errors'])
+
+    def test_stop_preempts_leds(self):
+        orb = SimulatedSphero.connected(self, latency=0.002)
+        tx_queue = orb.start_tx_queue()
+        orb.start_pump()
+        commands = []
+        write = tx_queue._write
+        tx_queue._write = lambda chunk: (commands.append(chunk[3]), write(chunk))
+        (release, reader) = self.hold(orb._notification_lock)
+        start = time.monotonic()
+        orb.set_rgb_led(0, 0, 0)
+        while len(tx_queue._heap) > 0:
+            time.sleep(0.001)
+        for i in range(1, 8):
+            orb.set_rgb_led(i, 0, 0, persist=True)
+        orb.roll(0, 0)
+        orb.set_raw_motor_values(Sphero.RAW_MOTOR_MODE_BRAKE, 0, Sphero.RAW_MOTOR_MODE_BRAKE, 0)
+        # queued without waiting for the reader
+        self.assertLess(time.monotonic() - start, 0.1)
+        release.set()
+        reader.join()
+        self.assertTrue(tx_queue.wait_drained(1.0))
+        rgb = CMD_CODES.CMD_SET_RGB_LED.value[1]
+        # the first LED update was already taken by the thread
+        self.assertEqual([rgb, CMD_CODES.CMD_ROLL.value[1], CMD_CODES.CMD_SET_RAW_MOTORS.value[1]] + [rgb] * 7,
+                         commands)
+        latency = orb.metrics.snapshot()['tx_latency']
+        self.assertEqual(2, latency['stop']['count'])
+        self.assertEqual(8, latency['cosmetic']['count'])
+        self.assertEqual((7, 0, 0), orb.get_rgb_led())
+        self.assertEqual(0, orb.metrics.snapshot()['tx_queue']['errors'])
+
+    def test_blocking_without_pump(self):
+        orb = SimulatedSphero.connected(self, latency=0.002)
+        orb.start_tx_queue()
+        orb.set_rgb_led(1, 2, 3, persist=True, resp=True)
+        self.assertEqual((1, 2, 3), orb.get_rgb_led())
+        with orb.batch():
+            orb.roll(50, 90)
+            orb.set_tail_light(255)
+        orb.stop_tx_queue()
+        self.assertEqual((50, 90), (orb._device.speed, orb._device.heading))
+        self.assertIsNone(orb._notifier._transmitter)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import unittest
+
+from sphero_sprk.reassembler import PacketReassembler
+from sphero_sprk.simulator import build_async_packet, build_sync_packet
+
+
+class ReassemblerTestCase(unittest.TestCase):
+
+    def collect(self, reassembler, *chunks):
+        packets = []
+        for chunk in chunks:
+            reassembler.feed(chunk)
+            packets.extend(bytes(p) for p in reassembler.packets())
+        return packets
+
+    def test_fragmented(self):
+        stream = build_sync_packet(0, 1, b'\x01\x02\x03') + build_async_packet(0x03, bytes(range(40)))
+        chunks = [stream[i:i + 5] for i in range(0, len(stream), 5)]
+        r = PacketReassembler()
+        packets = self.collect(r, *chunks)
+        self.assertEqual([build_sync_packet(0, 1, b'\x01\x02\x03'), build_async_packet(0x03, bytes(range(40)))],
+                         packets)
+        self.assertEqual(0, len(r))
+
+    def test_async_two_byte_dlen(self):
+        packet = build_async_packet(0x03, bytes(300))
+        r = PacketReassembler()
+        self.assertEqual([packet], self.collect(r, packet))
+
+    def test_resync_on_garbage(self):
+        packet = build_sync_packet(0, 9)
+        r = PacketReassembler()
+        packets = self.collect(r, b'\x00\x12\xff\x34' + packet + b'\xff\xfe' + packet)
+        self.assertEqual([packet, packet], packets)
+        self.assertGreater(r.resyncs, 0)
+
+    def test_checksum_failure(self):
+        bad = bytearray(build_async_packet(0x03, b'\x00\x01\x02\x03'))
+        bad[6] ^= 0x40
+        good = build_sync_packet(0, 3)
+        r = PacketReassembler()
+        self.assertEqual([good], self.collect(r, bytes(bad) + good))
+        self.assertEqual(1, r.checksum_failures)
+
+    def test_held_view(self):
+        packet = build_sync_packet(0, 1, b'abc')
+        r = PacketReassembler()
+        r.feed(packet)
+        held = list(r.packets())
+        r.feed(build_sync_packet(0, 2, b'xyz'))
+        later = [bytes(p) for p in r.packets()]
+        self.assertEqual(packet, bytes(held[0]))
+        self.assertEqual([build_sync_packet(0, 2, b'xyz')], later)
+
+    def test_feed_while_iterating(self):
+        first = build_sync_packet(0, 1)
+        second = build_sync_packet(0, 2)
+        r = PacketReassembler()
+        r.feed(first)
+        seen = []
+        for packet in r.packets():
+            seen.append(bytes(packet))
+            if len(seen) == 1:
+                r.feed(second)
+                self.assertEqual([], list(r.packets()))
+        self.assertEqual([first, second], seen)
+
+
+if __name__ == '__main__':
+    unittest.main()
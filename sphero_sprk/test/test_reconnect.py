@@ -0,0 +1,86 @@
+import os
+import tempfile
+import threading
+import time
+import unittest
+
+from sphero_sprk.gatt_cache import GattHandleCache
+from sphero_sprk.simulator import SimulatedSphero
+from sphero_sprk.sphero import CommandsCharacteristic
+
+
+class ReconnectTestCase(unittest.TestCase):
+
+    def wait_until(self, condition, timeout=1.0):
+        end = time.monotonic() + timeout
+        while not condition() and time.monotonic() < end:
+            time.sleep(0.01)
+        return condition()
+
+    def test_handle_cache(self):
+        path = os.path.join(tempfile.mkdtemp(), "handles.json")
+        orb = SimulatedSphero.connected(self, handle_cache=GattHandleCache(path))
+        self.assertEqual(2, orb._device.stats['service_lookups'])
+        self.assertEqual(1, orb.link_stats['discoveries'])
+        # a new process reads the handles from the file
+        orb = SimulatedSphero.connected(self, handle_cache=GattHandleCache(path))
+        self.assertEqual(0, orb._device.stats['service_lookups'])
+        self.assertEqual(1, orb.link_stats['handle_cache_hits'])
+        self.assertTrue(orb._device.dev_mode)
+        orb.set_rgb_led(1, 2, 3, persist=True)
+        self.assertEqual((1, 2, 3), orb._device.user_rgb)
+
+    def test_concurrent_saves(self):
+        directory = tempfile.mkdtemp()
+        cache = GattHandleCache(os.path.join(directory, "handles.json"))
+        errors = []
+
+        def put_many(thread):
+            try:
+                for i in range(50):
+                    cache.put("00:00:00:00:{:02x}:{:02x}".format(thread, i), {CommandsCharacteristic: i})
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=put_many, args=(i,)) for i in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual([], errors)
+        self.assertEqual(["handles.json"], os.listdir(directory))
+        self.assertEqual(400, len(GattHandleCache(cache.path)._handles))
+
+    def test_stale_handles(self):
+        cache = GattHandleCache()
+        cache.put("00:11:22:33:44:55", {CommandsCharacteristic: 0x99})
+        orb = SimulatedSphero.connected(self, handle_cache=cache)
+        self.assertEqual(1, orb.link_stats['discoveries'])
+        self.assertNotEqual(0x99, cache.get("00:11:22:33:44:55")[CommandsCharacteristic])
+        self.assertTrue(orb._device.dev_mode)
+
+    def test_auto_reconnect(self):
+        orb = SimulatedSphero.connected(self, handle_cache=GattHandleCache())
+        frames = []
+        orb.add_frame_callback(frames.append, ['odometer'])
+        orb.update_streaming(rate=100)
+        orb.start_pump()
+        orb.enable_auto_reconnect(retries=3, backoff=0.01)
+        first_device = orb._device
+        first_device.disconnect()
+        self.assertTrue(self.wait_until(lambda: orb.link_stats['reconnects'] == 1))
+        device = orb._device
+        self.assertIsNot(first_device, device)
+        # dev mode, no discovery, and the stream in a single write
+        self.assertTrue(device.dev_mode)
+        self.assertEqual(0, device.stats['service_lookups'])
+        self.assertEqual(1, device.stats['writes'] - 3)
+        self.assertEqual(orb._data_mask2, device.stream_mask2)
+        count = len(frames)
+        self.assertTrue(self.wait_until(lambda: len(frames) > count + 3))
+        self.assertIsNotNone(orb.link_stats['last_reconnect_seconds'])
+        self.assertEqual(0, orb.ping()[1][2])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,56 @@
+import unittest
+
+from sphero_sprk.recorder import SensorRecorder, np
+from sphero_sprk.stream_decoder import StreamDecoder
+from sphero_sprk.test.test_stream_decoder import MASK_LIST1, MASK_LIST2
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class RecorderTestCase(unittest.TestCase):
+
+    def setUp(self):
+        decoder = StreamDecoder(MASK_LIST1, MASK_LIST2)
+        self.layout = decoder.update(0, 0x0c000000)
+
+    def frame(self, i):
+        return self.layout.record_class((i, -i), float(i))
+
+    def test_views(self):
+        recorder = SensorRecorder(capacity=4)
+        for i in range(6):
+            recorder.record(self.frame(i))
+        self.assertEqual(('odometer.x', 'odometer.y'), recorder.fields)
+        self.assertEqual([2, 3, 4, 5], recorder.column('odometer.x').tolist())
+        self.assertEqual([-4, -5], recorder.column('odometer.y', samples=2).tolist())
+        last = recorder.last(seconds=2.5, now=5.0)
+        self.assertEqual([3.0, 4.0, 5.0], last['timestamp'].tolist())
+        # views, not copies
+        self.assertIs(recorder._data, recorder.column('odometer.x').base)
+
+    def test_rollover_and_snapshot(self):
+        recorder = SensorRecorder(capacity=3)
+        laps = []
+        snapshots = []
+        recorder.on_rollover(lambda views: laps.append(views['odometer.x'].tolist()))
+        recorder.on_snapshot(lambda arrays: snapshots.append(arrays))
+        for i in range(7):
+            recorder.record(self.frame(i))
+        self.assertEqual([[0, 1, 2], [3, 4, 5]], laps)
+        arrays = recorder.snapshot()
+        self.assertEqual([4, 5, 6], arrays['odometer.x'].tolist())
+        self.assertEqual(1, len(snapshots))
+
+    def test_fields_change(self):
+        recorder = SensorRecorder(capacity=3)
+        snapshots = []
+        recorder.on_snapshot(snapshots.append)
+        recorder.record(self.frame(1))
+        layout = StreamDecoder(MASK_LIST1, MASK_LIST2).update(0x0000e000, 0)
+        recorder.record(layout.record_class((1, 2, 3), 2.0))
+        self.assertEqual([1], snapshots[0]['odometer.x'].tolist())
+        self.assertEqual(('accel_filtered.x', 'accel_filtered.y', 'accel_filtered.z'), recorder.fields)
+        self.assertEqual(1, len(recorder))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import os
+import tempfile
+import unittest
+
+from sphero_sprk.responses import (DECODERS, MRSP_EPARAM, OPTION_TAIL_LIGHT_ALWAYS_ON, OPTION_VECTOR_DRIVE,
+                                   Locator, ResponseError, RgbLed, Version, decode_response)
+from sphero_sprk.simulator import SimulatedSphero, build_sync_packet
+from sphero_sprk.sphero_constants import CMD_CODES
+from sphero_sprk.wire_log import WireLog, WireRecorder
+
+
+class DecodeTestCase(unittest.TestCase):
+
+    def test_version(self):
+        version = decode_response(CMD_CODES.CMD_VERSION, build_sync_packet(0, 1, SimulatedSphero.VERSION))
+        self.assertIsInstance(version, Version)
+        self.assertEqual(3, version.msa_version)
+        self.assertEqual(3, version["MSA-ver"])
+        self.assertEqual(0x36, version["BL"])
+        self.assertEqual(0x02, version[0])
+        # older firmware stops after the bootloader version
+        version = decode_response(CMD_CODES.CMD_VERSION, build_sync_packet(0, 1, SimulatedSphero.VERSION[:6]))
+        self.assertEqual(0x36, version.bootloader)
+        self.assertIsNone(version.api_major)
+
+    def test_results(self):
+        packet = build_sync_packet(0, 2, bytes.fromhex("fffb000a00000000000c"))
+        locator = decode_response(CMD_CODES.CMD_READ_LOCATOR, packet)
+        self.assertEqual((-5, 10, 0, 0, 12), locator)
+        self.assertEqual({'x': -5, 'y': 10, 'vx': 0, 'vy': 0, 'sog': 12}, locator)
+        self.assertEqual(-5, locator['x'])
+        self.assertEqual(Locator((-5, 10, 0, 0, 12)), locator)
+        self.assertNotEqual(RgbLed((1, 2, 3)), (1, 2, 4))
+        self.assertIn("sog=12", repr(locator))
+        power = decode_response(CMD_CODES.CMD_GET_PWR_STATE, build_sync_packet(0, 3, bytes.fromhex("0103031b00050078")))
+        self.assertEqual('low', power.state_name)
+        self.assertAlmostEqual(7.95, power.voltage)
+        self.assertEqual(120, power.since_charge)
+        flags = decode_response(CMD_CODES.CMD_GET_TEMP_OPTIONS_FLAG, build_sync_packet(0, 4, bytes.fromhex("00000008")))
+        self.assertTrue(flags.is_set(OPTION_TAIL_LIGHT_ALWAYS_ON))
+        self.assertFalse(flags.is_set(OPTION_VECTOR_DRIVE))
+
+    def test_errors(self):
+        with self.assertRaises(ResponseError) as error:
+            decode_response(CMD_CODES.CMD_GET_RGB_LED, build_sync_packet(MRSP_EPARAM, 5))
+        self.assertEqual(MRSP_EPARAM, error.exception.mrsp)
+        self.assertIn("bad parameter", str(error.exception))
+        packet = bytearray(build_sync_packet(0, 5, b'\x01\x02\x03'))
+        packet[4] += 1
+        with self.assertRaises(ResponseError):
+            decode_response(CMD_CODES.CMD_GET_RGB_LED, packet)
+        with self.assertRaises(ResponseError):
+            decode_response(CMD_CODES.CMD_GET_RGB_LED, build_sync_packet(0, 5, b'\x01\x02'))
+        with self.assertRaises(ResponseError):
+            decode_response(CMD_CODES.CMD_VERSION, build_sync_packet(0, 5, SimulatedSphero.VERSION[:5]))
+
+
+class GetterTestCase(unittest.TestCase):
+
+    def test_getters(self):
+        orb = SimulatedSphero.connected(self)
+        orb._device.auto_reconnect = (True, 5)
+        orb._device.options_flags = OPTION_VECTOR_DRIVE
+        orb._device.power_state = 1
+        self.assertEqual((True, 5), orb.get_auto_reconnect())
+        self.assertTrue(orb.get_options_flags().is_set(OPTION_VECTOR_DRIVE))
+        self.assertEqual(0, orb.get_options_flags(temporary=True).flags)
+        self.assertEqual('charging', orb.get_power_state().state_name)
+        self.assertEqual("SK-SIM", orb.get_device_name().name)
+
+    def test_error_response(self):
+        orb = SimulatedSphero.connected(self)
+        orb._device._handlers[tuple(CMD_CODES.CMD_GET_RGB_LED.value)] = lambda data: (MRSP_EPARAM, b'')
+        self.assertIsNone(orb.get_rgb_led())
+        self.assertEqual(1, orb.metrics.error_responses)
+
+    def test_recorded_responses(self):
+        path = os.path.join(tempfile.mkdtemp(), "queries.spwl")
+        orb = SimulatedSphero.connected(self)
+        orb.set_rgb_led(1, 2, 3, persist=True, resp=True)
+        with WireRecorder(path, orb):
+            live = [orb.get_rgb_led(), orb.version(), orb.read_locator()]
+        # decoded from the capture alone
+        recorded = [decode_response(cmd, packet) for (timestamp, cmd, packet) in WireLog(path).responses()
+                    if cmd in DECODERS]
+        self.assertEqual(live, recorded)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+import tempfile
+import time
+import unittest
+
+from sphero_sprk.sensor_store import SensorStore, np
+from sphero_sprk.simulator import SimulatedSphero
+from sphero_sprk.stream_decoder import StreamDecoder
+from sphero_sprk.test.test_stream_decoder import MASK_LIST1, MASK_LIST2
+
+
+@unittest.skipIf(np is None, "numpy is not installed")
+class SensorStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.store = SensorStore(tempfile.mkdtemp(), chunk_size=4)
+        self.layout = StreamDecoder(MASK_LIST1, MASK_LIST2).update(0, 0x0c000000)
+
+    def write_session(self, robot, start, count):
+        writer = self.store.writer(robot)
+        writer._clock_offset = 0.0
+        for i in range(start, start + count):
+            writer.record(self.layout.record_class((i, -i), float(i)))
+        writer.close()
+
+    def test_query(self):
+        self.write_session("aa:bb", 0, 10)
+        segment = self.store.segments("aa:bb")[0]
+        self.assertTrue(segment.closed)
+        self.assertEqual([4, 4, 2], segment.index()['count'].tolist())
+        # only the chunks holding 3..6 are read
+        self.assertEqual(2, len(segment.chunks(3.0, 6.0)))
+        data = self.store.query("aa:bb", 3.0, 6.0, ['odometer.y'])
+        self.assertEqual([3.0, 4.0, 5.0, 6.0], data['timestamp'].tolist())
+        self.assertEqual([-3, -4, -5, -6], data['odometer.y'].tolist())
+        self.assertNotIn('odometer.x', data)
+        self.assertEqual(10, len(self.store.query("aa:bb")['odometer.x']))
+        self.assertEqual(0, len(self.store.query("aa:bb", 20.0, 30.0)['timestamp']))
+
+    def test_compact(self):
+        self.write_session("aa:bb", 0, 5)
+        self.write_session("aa:bb", 5, 6)
+        self.assertEqual(2, len(self.store.segments("aa:bb")))
+        self.assertEqual(1, self.store.compact("aa:bb"))
+        segments = self.store.segments("aa:bb")
+        self.assertEqual(1, len(segments))
+        self.assertEqual([4, 4, 3], segments[0].index()['count'].tolist())
+        self.assertEqual(list(range(11)), self.store.query("aa:bb")['odometer.x'].tolist())
+        # nothing left to do
+        self.assertEqual(0, self.store.compact("aa:bb"))
+        self.assertEqual(1, len(self.store.segments("aa:bb")))
+
+    def test_live_stream(self):
+        orb = SimulatedSphero.connected(self)
+        start = time.time()
+        writer = self.store.attach(orb, groups=['odometer'])
+        orb.update_streaming(rate=200)
+        end = time.monotonic() + 0.2
+        while time.monotonic() < end:
+            orb._device.waitForNotifications(0.01)
+        writer.close()
+        data = self.store.query(orb._addr, start, time.time(), ['odometer.x'])
+        self.assertEqual(writer.count, len(data['odometer.x']))
+        self.assertGreater(writer.count, 10)
+        self.assertEqual(['00-11-22-33-44-55'], self.store.robots())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import time
+import unittest
+
+from sphero_sprk.simulator import SimulatedSphero
+from sphero_sprk.sphero import Sphero
+
+
+class SetpointChannelTestCase(unittest.TestCase):
+
+    def test_last_writer_wins(self):
+        orb = SimulatedSphero.connected(self)
+        channel = orb.start_setpoint_channel(rate=20)
+        commands = orb._device.stats['commands']
+        for i in range(100):
+            channel.roll(i, 90)
+        channel.set_raw_motor_values(Sphero.RAW_MOTOR_MODE_FORWARD, 80, Sphero.RAW_MOTOR_MODE_REVERSE, 80)
+        time.sleep(0.15)
+        stats = channel.stats()
+        self.assertFalse(stats['pending'])
+        self.assertEqual(101, stats['sent'] + stats['dropped'])
+        self.assertLessEqual(stats['sent'], 4)
+        self.assertEqual(commands + stats['sent'], orb._device.stats['commands'])
+        # the raw motor values came last, the simulator stops rolling
+        self.assertEqual(0, orb._device.speed)
+
+    def test_flush_on_stop(self):
+        orb = SimulatedSphero.connected(self)
+        channel = orb.start_setpoint_channel(rate=1)
+        time.sleep(0.01)
+        channel.roll(70, 180)
+        orb.stop_setpoint_channel()
+        self.assertEqual(70, orb._device.speed)
+        self.assertEqual(1, channel.stats()['sent'])
+
+    def test_error_keeps_running(self):
+        orb = SimulatedSphero.connected(self)
+        roll = orb.roll
+        failures = [OSError("link lost")]
+
+        def flaky_roll(*args):
+            if failures:
+                raise failures.pop()
+            roll(*args)
+
+        orb.roll = flaky_roll
+        channel = orb.start_setpoint_channel(rate=50)
+        orb._device.speed = 40
+        channel.roll(0, 0)
+        time.sleep(0.1)
+        stats = channel.stats()
+        # the stop failed once, then went out on the next tick
+        self.assertEqual(1, stats['errors'])
+        self.assertEqual(1, stats['sent'])
+        self.assertFalse(stats['pending'])
+        self.assertEqual(0, orb._device.speed)
+        self.assertEqual(1, orb.metrics.setpoint_errors)
+        self.assertTrue(channel.is_alive())
+        orb.stop_setpoint_channel()
+        with self.assertRaises(RuntimeError):
+            channel.roll(0, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,121 @@
+import struct
+import threading
+import time
+import unittest
+
+from sphero_sprk.simulator import SimulatedSphero, build_async_packet, build_sync_packet
+
+
+class SimulatorTestCase(unittest.TestCase):
+
+    def pump(self, orb, seconds):
+        end = time.monotonic() + seconds
+        while time.monotonic() < end:
+            orb._device.waitForNotifications(0.01)
+
+    def test_build_packets(self):
+        self.assertEqual(b'\xff\xff\x00\x05\x01\xf9', build_sync_packet(0, 5))
+        # same packet as test_delegate_object
+        self.assertEqual(b'\xff\xfe\x03\x00\x07\xff0\x00[\x0f\xefm',
+                         build_async_packet(0x03, b'\xff0\x00[\x0f\xef'))
+
+    def test_dev_mode(self):
+        orb = SimulatedSphero.connected(self)
+        self.assertTrue(orb._device.dev_mode)
+        self.assertTrue(orb._device.awake)
+
+    def test_ping(self):
+        orb = SimulatedSphero.connected(self, mtu=3)
+        (seq, resp) = orb.ping()
+        self.assertEqual(build_sync_packet(0, seq), resp)
+
+    def test_rgb_led(self):
+        orb = SimulatedSphero.connected(self)
+        orb.set_rgb_led(10, 20, 30, persist=True, resp=True)
+        self.assertEqual((10, 20, 30), orb.get_rgb_led())
+
+    def test_version_and_name(self):
+        orb = SimulatedSphero.connected(self, latency=0.005, jitter=0.002)
+        self.assertEqual(3, orb.version()["MSA-ver"])
+        name = orb.get_device_name()
+        self.assertEqual("SK-SIM", name["name"])
+        self.assertEqual("001122334455", name["bta"])
+
+    def test_no_answer(self):
+        orb = SimulatedSphero.connected(self)
+        orb.roll(50, 90)
+        self.assertFalse(orb._device.waitForNotifications(0.01))
+        self.assertEqual(50, orb._device.speed)
+        self.assertEqual(90, orb._device.heading)
+
+    def test_stream(self):
+        orb = SimulatedSphero.connected(self)
+        values = []
+        orb.set_stream_callback('odometer', lambda data: values.append(struct.unpack('>hh', data)), mask_id=2)
+        orb.config_locator(10, -20, 0)
+        orb.update_streaming(rate=100)
+        self.pump(orb, 0.2)
+        self.assertGreater(len(values), 5)
+        self.assertEqual((10, -20), values[-1])
+
+    def test_stop_stream(self):
+        orb = SimulatedSphero.connected(self)
+        orb.set_stream_callback('odometer', lambda data: None, mask_id=2)
+        orb.add_frame_callback(lambda frame: None, ['odometer'])
+        orb.update_streaming(rate=100)
+        self.assertEqual(0x0c000000, orb._device.stream_mask2)
+        orb._stop_data_stream('odometer', 2)
+        self.assertEqual((0, 0), (orb._data_mask1, orb._data_mask2))
+        self.assertEqual((0, 0), (orb._device.stream_mask1, orb._device.stream_mask2))
+        self.assertIsNone(orb._device.stream_period)
+
+    def test_loss(self):
+        orb = SimulatedSphero.connected(self, loss=1.0)
+        orb.roll(10, 0, resp=False)
+        orb._send_command("ff", 0x00, 0x01, [])
+        self.assertFalse(orb._device.waitForNotifications(0.01))
+        self.assertEqual(1, orb._device.stats['chunks_lost'])
+
+    def test_batch(self):
+        orb = SimulatedSphero.connected(self)
+        writes = orb._device.stats['writes']
+        commands = orb._device.stats['commands']
+        with orb.batch():
+            orb.roll(20, 45)
+            orb.set_tail_light(255)
+            orb.set_rgb_led(1, 2, 3, persist=True)
+        # 11 + 8 + 11 bytes in writes of at most 20 bytes
+        self.assertEqual(writes + 2, orb._device.stats['writes'])
+        self.assertEqual(commands + 3, orb._device.stats['commands'])
+        orb.set_mtu(64)
+        with orb.batch():
+            orb.roll(30, 90)
+            orb.set_tail_light(0)
+            orb.set_rgb_led(4, 5, 6, persist=True)
+            # flushed before waiting for the response
+            self.assertEqual((4, 5, 6), orb.get_rgb_led())
+        self.assertEqual(writes + 3, orb._device.stats['writes'])
+        self.assertEqual(30, orb._device.speed)
+
+    def test_batch_other_thread(self):
+        orb = SimulatedSphero.connected(self)
+        commands = orb._device.stats['commands']
+        with orb.batch():
+            orb.set_tail_light(255)
+            # a command from another thread (the setpoint channel) isn't held in this thread's batch
+            thread = threading.Thread(target=orb.roll, args=(40, 90))
+            thread.start()
+            thread.join()
+            self.assertEqual(commands + 1, orb._device.stats['commands'])
+            self.assertEqual(40, orb._device.speed)
+        self.assertEqual(commands + 2, orb._device.stats['commands'])
+
+    def test_disconnect(self):
+        orb = SimulatedSphero.connected(self)
+        orb._device.disconnect()
+        with self.assertRaises(ConnectionError):
+            orb._device.waitForNotifications(0.01)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,98 @@
+import time
+import unittest
+
+from sphero_sprk.sphero import Sphero
+from sphero_sprk.simulator import SimulatedSphero, build_async_packet
+from sphero_sprk.stream_decoder import StreamDecoder
+
+MASK_LIST1 = [
+    {"name": "accel_filtered", "values": [{"name": "x", "mask": "0000 8000"}, {"name": "y", "mask": "0000 4000"},
+                                          {"name": "z", "mask": "0000 2000"}]},
+    {"name": "imu_filtered", "values": [{"name": "pitch", "mask": "0004 0000"}, {"name": "roll", "mask": "0002 0000"},
+                                        {"name": "yaw", "mask": "0001 0000"}]},
+]
+MASK_LIST2 = [
+    {"name": "odometer", "values": [{"name": "x", "mask": "0800 0000"}, {"name": "y", "mask": "0400 0000"}]},
+]
+
+
+class StreamDecoderTestCase(unittest.TestCase):
+
+    def test_decode(self):
+        decoder = StreamDecoder(MASK_LIST1, MASK_LIST2)
+        decoder.update(0x0007e000, 0x0c000000)
+        # imu comes first, it has the higher bits
+        self.assertEqual(('imu_filtered.pitch', 'imu_filtered.roll', 'imu_filtered.yaw',
+                          'accel_filtered.x', 'accel_filtered.y', 'accel_filtered.z',
+                          'odometer.x', 'odometer.y'), decoder.layout.fields)
+        payload = b''.join(v.to_bytes(2, 'big', signed=True) for v in (1, 2, 3, -4, 5, 4096, 10, -20))
+        frame = decoder.decode(build_async_packet(0x03, payload), timestamp=1.5)
+        self.assertEqual(-4, frame.accel_filtered.x)
+        self.assertEqual(4096, frame.accel_filtered.z)
+        self.assertEqual((10, -20), tuple(frame.odometer))
+        self.assertEqual(3, frame['imu_filtered.yaw'])
+        self.assertEqual(1.5, frame.timestamp)
+
+    def test_layout_cache(self):
+        decoder = StreamDecoder(MASK_LIST1, MASK_LIST2)
+        layout = decoder.update(b'\x00\x00\xe0\x00', b'\x00\x00\x00\x00')
+        decoder.update(0, 0x0c000000)
+        self.assertIs(layout, decoder.update(0x0000e000, 0))
+
+    def test_length_mismatch(self):
+        decoder = StreamDecoder(MASK_LIST1, MASK_LIST2)
+        decoder.update(0x0000e000, 0)
+        self.assertIsNone(decoder.decode(build_async_packet(0x03, b'\x00\x01')))
+        self.assertEqual(1, decoder.length_mismatches)
+
+    def test_frame_callback(self):
+        orb = SimulatedSphero.connected(self)
+        frames = []
+        orb.add_frame_callback(frames.append, ['odometer', 'accel_filtered'])
+        orb.config_locator(30, 40, 0)
+        orb.update_streaming(rate=200)
+        end = time.monotonic() + 0.1
+        while time.monotonic() < end:
+            orb._device.waitForNotifications(0.01)
+        self.assertGreater(len(frames), 2)
+        self.assertEqual(4096, frames[-1].accel_filtered.z)
+        self.assertEqual(30, frames[-1].odometer.x)
+        self.assertEqual(40, frames[-1].odometer.y)
+
+    def test_decode_samples(self):
+        decoder = StreamDecoder(MASK_LIST1, MASK_LIST2)
+        decoder.update(0, 0x0c000000, samples=3, sample_period=0.01)
+        payload = b''.join(v.to_bytes(2, 'big', signed=True) for v in (1, 2, 3, 4, 5, 6))
+        frames = decoder.decode_samples(build_async_packet(0x03, payload), timestamp=2.0)
+        self.assertEqual([(1, 2), (3, 4), (5, 6)], [tuple(frame.odometer) for frame in frames])
+        self.assertEqual([1.98, 1.99, 2.0], [round(frame.timestamp, 6) for frame in frames])
+        self.assertIsNone(decoder.decode_samples(build_async_packet(0x03, payload[:8])))
+        self.assertEqual(1, decoder.length_mismatches)
+
+    def test_samples_per_frame(self):
+        # every value is the 400Hz tick of its sample
+        factory = SimulatedSphero.factory(sensor_source=lambda mask_id, bit, t: int(round(t * 400)) % 32768)
+        orb = Sphero("00:00:00:00:00:01", peripheral_factory=factory)
+        orb.connect()
+        samples = []
+        batches = []
+        orb.add_frame_callback(samples.append, ['odometer'])
+        orb.add_frame_callback(batches.append, batch=True)
+        orb.update_streaming(rate=100, samples=4)
+        self.assertEqual(4, orb._device.stream_samples)
+        end = time.monotonic() + 0.2
+        while time.monotonic() < end:
+            orb._device.waitForNotifications(0.01)
+        self.assertGreater(len(batches), 1)
+        self.assertEqual(4 * len(batches), len(samples))
+        for batch in batches:
+            self.assertEqual(4, len(batch))
+            ticks = [frame.odometer.x for frame in batch]
+            self.assertEqual([4, 4, 4], [(b - a) % 32768 for (a, b) in zip(ticks, ticks[1:])])
+            times = [frame.timestamp for frame in batch]
+            self.assertEqual([0.01] * 3, [round(b - a, 6) for (a, b) in zip(times, times[1:])])
+        self.assertIs(batches[-1][-1], samples[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import os
+import tempfile
+import time
+import unittest
+
+from sphero_sprk.simulator import SimulatedSphero
+from sphero_sprk.sphero import CommandsCharacteristic
+from sphero_sprk.wire_log import RX, TX, WireLog, WireRecorder, replay, split_commands
+
+
+class WireLogTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.path = os.path.join(tempfile.mkdtemp(), "capture.spwl")
+
+    def capture(self, frames):
+        orb = SimulatedSphero.connected(self)
+        orb.add_frame_callback(frames.append, ['odometer', 'velocity'])
+        with WireRecorder(self.path, orb) as recorder:
+            orb.update_streaming(rate=100)
+            with orb.batch():
+                orb.roll(50, 90)
+                orb.set_tail_light(255)
+            end = time.monotonic() + 0.1
+            while time.monotonic() < end:
+                orb._device.waitForNotifications(0.01)
+        self.assertIsNone(orb._notifier.wire_tap)
+        return (orb, recorder)
+
+    def test_capture(self):
+        frames = []
+        (orb, recorder) = self.capture(frames)
+        records = list(WireLog(self.path))
+        self.assertEqual(recorder.records, len(records))
+        tx = [record for record in records if record.direction == TX]
+        # the streaming command, then roll and tail light in one write
+        self.assertEqual(2, len(tx))
+        self.assertEqual([0x11, 0x30, 0x21], [packet[3] for packet in split_commands(b''.join(r.data for r in tx))])
+        self.assertEqual(orb._cmd_characteristics[CommandsCharacteristic].getHandle(), tx[0].handle)
+        self.assertEqual(orb._device.response_handle, records[-1].handle)
+        timestamps = [record.timestamp for record in records]
+        self.assertEqual(sorted(timestamps), timestamps)
+        self.assertEqual((orb._data_mask1, orb._data_mask2), WireLog(self.path).stream_masks())
+        self.assertEqual((orb._data_mask1, orb._data_mask2, 1, 0.01), WireLog(self.path).stream_settings())
+
+    def test_replay(self):
+        frames = []
+        self.capture(frames)
+        self.assertGreater(len(frames), 3)
+        # decode the capture offline with the masks it was recorded with
+        orb = SimulatedSphero.connected(self)
+        orb._device.disconnect()
+        log = WireLog(self.path)
+        orb._frame_decoder.update(*log.stream_settings())
+        replayed = []
+        orb.add_frame_callback(replayed.append)
+        orb._notifier.update_callbacks()
+        commands = []
+        delivered = replay(log, orb._notifier, speed=None, on_tx=commands.append)
+        self.assertEqual(len([record for record in log if record.direction == RX]), delivered)
+        self.assertEqual(2, len(commands))
+        self.assertEqual([frame.odometer for frame in frames], [frame.odometer for frame in replayed])
+
+    def test_real_time(self):
+        recorder = WireRecorder(self.path)
+        now = time.monotonic()
+        recorder.record(RX, 0x12, b'\xff\xff\x00\x01\x01\xfd', timestamp=now)
+        recorder.record(RX, 0x12, b'\xff\xff\x00\x02\x01\xfc', timestamp=now + 0.1)
+        recorder.close()
+
+        class Delegate(object):
+            def __init__(self):
+                self.times = []
+
+            def handleNotification(self, handle, data):
+                self.times.append(time.monotonic())
+
+        delegate = Delegate()
+        replay(self.path, delegate, speed=2.0)
+        self.assertAlmostEqual(0.05, delegate.times[1] - delegate.times[0], delta=0.03)
+
+    def test_truncated(self):
+        recorder = WireRecorder(self.path)
+        recorder.record(RX, 0x12, b'\x01\x02\x03')
+        recorder.record(RX, 0x12, b'\x04\x05\x06')
+        recorder.close()
+        with open(self.path, 'r+b') as f:
+            f.truncate(os.path.getsize(self.path) - 1)
+        self.assertEqual([b'\x01\x02\x03'], [record.data for record in WireLog(self.path)])
+        with open(self.path, 'wb') as f:
+            f.write(b'not a log')
+        with self.assertRaises(ValueError):
+            WireLog(self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,19 +1,76 @@
 import signal
+import threading
 
 class Timeout(Exception):
-    """Timeout class using ALARM signal."""
+    """Timeout class using ALARM signal.
+
+    Signals are only delivered to the main thread, in other threads the timeout is not armed.
+    Only one alarm exists per process, use call_with_timeout for concurrent timeouts."""
     class Timeout(Exception):
         pass
 
     def __init__(self, sec):
         self.sec = sec
+        self._armed = False
 
     def __enter__(self):
-        signal.signal(signal.SIGALRM, self.raise_timeout)
-        signal.alarm(self.sec)
+        if threading.current_thread() is threading.main_thread():
+            signal.signal(signal.SIGALRM, self.raise_timeout)
+            signal.alarm(self.sec)
+            self._armed = True
 
     def __exit__(self, *args):
-        signal.alarm(0)    # disable alarm
+        if self._armed:
+            signal.alarm(0)    # disable alarm
+            self._armed = False
 
     def raise_timeout(self, *args):
-        raise Timeout.Timeout()
\ No newline at end of file
+        raise Timeout.Timeout()
+
+
+def call_with_timeout(func, timeout, on_late=None, on_done=None):
+    """
+    Call func in a worker thread and wait for it until the deadline, without signals, so it works in any
+    thread and any number of calls can run at the same time.
+
+    func - (function) called without arguments
+    timeout - (float) seconds, None waits forever
+    on_late - (function) called with the result if func returns after the deadline, e.g. to close a
+        connection nobody is waiting for anymore
+    on_done - (function) called without arguments from the worker once func returned or raised, also after
+        the deadline, e.g. to free a resource the abandoned call still uses
+    -----
+
+    return - the result of func, raises TimeoutError when the deadline passes, or the exception of func
+    """
+    state = {'done': False, 'late': False}
+    lock = threading.Lock()
+    finished = threading.Event()
+
+    def run():
+        try:
+            state['result'] = func()
+        except BaseException as e:
+            state['error'] = e
+        with lock:
+            state['done'] = True
+            late = state['late']
+        finished.set()
+        try:
+            if late and on_late is not None and 'result' in state:
+                on_late(state['result'])
+        finally:
+            if on_done is not None:
+                on_done()
+
+    worker = threading.Thread(target=run, name="sphero-deadline")
+    worker.daemon = True
+    worker.start()
+    finished.wait(timeout)
+    with lock:
+        if not state['done']:
+            state['late'] = True
+            raise TimeoutError("Timed out after {} seconds".format(timeout))
+    if 'error' in state:
+        raise state['error']
+    return state['result']
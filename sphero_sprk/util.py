@@ -1,9 +1,11 @@
 #!/usr/bin/python3
 
-from bluepy.btle import Scanner
+import os
+import tempfile
 
 
 def search_for_sphero(second_time=1):
+	from bluepy.btle import Scanner
 	scanner = Scanner()
 	devices = scanner.scan(second_time)
 	sphero_list = []
@@ -17,12 +19,7 @@ def search_for_sphero(second_time=1):
 
 
 def cal_packet_checksum(arr):
-	value = 0;
-	for a in arr:
-		for i in range(0,len(a)):
-			value += a[i]
-		#print(int.from_bytes(a,'big'))
-		#print(value)
+	value = sum(map(sum, arr))
 	return 255-(value%256)
 
 
@@ -44,24 +41,25 @@ def package_validator(data):
 
 
 
-def OR_mask(b1, b2):
-	if(len(b1) != len(b2)):
-		raise Exception("OR bytes with different length")
-	arr = []
-	for i in range(0, len(b1)):
-		arr.append(b1[i] | b2[i])
-	return bytes(arr)
-
-def XOR_mask(b1, b2):
-	if(len(b1) != len(b2)):
-		raise Exception("XOR bytes with different length")
-	arr = []
-	for i in range(0, len(b1)):
-		arr.append(b1[i] ^ b2[i])
-	return bytes(arr)
+def write_file_atomic(path, text):
+	"""
+	Replace the file at path with text in one step, readers never see a partial file.
+	Every call writes its own temporary file, concurrent calls don't collide
+	"""
+	directory = os.path.dirname(path)
+	if directory:
+		os.makedirs(directory, exist_ok=True)
+	(fd, tmp_path) = tempfile.mkstemp(prefix=os.path.basename(path) + ".", suffix=".tmp", dir=directory or ".")
+	try:
+		with os.fdopen(fd, "w") as f:
+			f.write(text)
+		os.replace(tmp_path, path)
+	except BaseException:
+		try:
+			os.unlink(tmp_path)
+		except OSError:
+			pass
+		raise
 
 def count_data_size(arr_list):
-	val = 0
-	for l in arr_list:
-		val += len(l)
-	return val
\ No newline at end of file
+	return sum(map(len, arr_list))
\ No newline at end of file
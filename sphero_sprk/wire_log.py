@@ -0,0 +1,246 @@
+#!/usr/bin/python3
+"""
+Wire level capture of a connection: every chunk written to the commands characteristic (TX) and every
+notification received (RX), with its time and characteristic handle, in an append-only binary log.
+
+File layout, all little endian:
+    header  - b"SPWL", version (B), time.monotonic() (d) and time.time() (d) of the start of the capture
+    records - microseconds since the previous record (I), direction (B), handle (H), length (H), the bytes
+
+A gap of more than 71 minutes between two records is shortened to 0xFFFFFFFF microseconds.
+
+    with WireRecorder("field.spwl", orb):
+        ...
+    replay("field.spwl", orb._notifier, speed=None)
+"""
+
+import struct
+import threading
+import time
+from collections import namedtuple
+
+from sphero_sprk.reassembler import PacketReassembler
+from sphero_sprk.sphero_constants import CMD_CODES
+
+MAGIC = b"SPWL"
+VERSION = 1
+RX = 0
+TX = 1
+
+FILE_HEADER = struct.Struct('<4sBdd')
+RECORD_HEADER = struct.Struct('<IBHH')
+MAX_DELTA_US = 0xFFFFFFFF
+
+#(DID, CID) -> CMD_CODES
+_COMMANDS = dict((tuple(cmd.value), cmd) for cmd in CMD_CODES)
+
+#timestamp is in seconds since the start of the capture
+WireRecord = namedtuple('WireRecord', 'timestamp direction handle data')
+
+
+class WireRecorder(object):
+    """
+    Writes the TX/RX chunks of a Sphero to a wire log.
+
+    Attaching hooks DelegateObj.handleNotification and the writes of Sphero._transmit, the hooks stay in
+    place across reconnects. record() can be called directly to capture another source.
+    """
+
+    def __init__(self, path, sphero=None):
+        '''
+        :param path: (str) file to create, an existing file is overwritten
+        :param sphero: (Sphero) attach to this Sphero, None to feed record() yourself
+        '''
+        self.path = path
+        self.records = 0
+        self._lock = threading.Lock()
+        self._sphero = None
+        self._file = open(path, 'wb')
+        self._last = time.monotonic()
+        self.start_time = self._last
+        self._file.write(FILE_HEADER.pack(MAGIC, VERSION, self._last, time.time()))
+        if sphero is not None:
+            self.attach(sphero)
+
+    def attach(self, sphero):
+        self.detach()
+        self._sphero = sphero
+        sphero._wire_tap = self
+        sphero._notifier.wire_tap = self
+
+    def detach(self):
+        if self._sphero is not None:
+            self._sphero._wire_tap = None
+            self._sphero._notifier.wire_tap = None
+            self._sphero = None
+
+    def record(self, direction, handle, data, timestamp=None):
+        '''
+        Append a chunk to the log
+        :param direction: (int) RX or TX
+        :param handle: (int) value handle of the characteristic
+        :param data: (bytes-like) the chunk
+        :param timestamp: (float) time.monotonic() of the chunk, now by default
+        '''
+        now = time.monotonic() if timestamp is None else timestamp
+        with self._lock:
+            if self._file is None:
+                return
+            delta = min(MAX_DELTA_US, max(0, int(round((now - self._last) * 1e6))))
+            #keep the rounding error out of the next delta
+            self._last += delta / 1e6
+            self._file.write(RECORD_HEADER.pack(delta, direction, handle, len(data)))
+            self._file.write(data)
+            self.records += 1
+
+    def rx(self, handle, data):
+        self.record(RX, handle, data)
+
+    def tx(self, handle, data):
+        self.record(TX, handle, data)
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        self.detach()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class WireLog(object):
+    """
+    Reads a wire log, iterating yields a WireRecord per chunk
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            header = f.read(FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size:
+            raise ValueError("{} is not a wire log".format(path))
+        (magic, version, self.start_time, self.wall_time) = FILE_HEADER.unpack(header)
+        if magic != MAGIC:
+            raise ValueError("{} is not a wire log".format(path))
+        if version != VERSION:
+            raise ValueError("Unsupported wire log version {}".format(version))
+
+    def __iter__(self):
+        with open(self.path, 'rb') as f:
+            data = f.read()
+        offset = FILE_HEADER.size
+        timestamp = 0
+        unpack = RECORD_HEADER.unpack_from
+        header_size = RECORD_HEADER.size
+        while offset + header_size <= len(data):
+            (delta, direction, handle, length) = unpack(data, offset)
+            offset += header_size
+            if offset + length > len(data):
+                #truncated by a crash during the capture
+                break
+            timestamp += delta
+            yield WireRecord(timestamp / 1e6, direction, handle, data[offset:offset + length])
+            offset += length
+
+    def commands(self):
+        '''
+        :return: (generator) (timestamp, packet) of every command in the TX chunks
+        '''
+        for record in self:
+            if record.direction == TX:
+                for packet in split_commands(record.data):
+                    yield (record.timestamp, packet)
+
+    def responses(self):
+        '''
+        The responses of the RX chunks with the command they answer, matched on the sequence number of the
+        last command sent with it. Decode them with responses.decode_response
+        :return: (generator) (timestamp, CMD_CODES or None if the command is unknown, packet)
+        '''
+        reassembler = PacketReassembler()
+        pending = {}  # seq -> command waiting for its response
+        for record in self:
+            if record.direction == TX:
+                for packet in split_commands(record.data):
+                    if packet[1] == 0xff and len(packet) >= 7:
+                        pending[packet[4]] = _COMMANDS.get((packet[2], packet[3]))
+                continue
+            reassembler.feed(record.data)
+            for packet in reassembler.packets():
+                if packet[1] == 0xff:
+                    yield (record.timestamp, pending.pop(packet[3], None), bytes(packet))
+
+    def stream_masks(self):
+        '''
+        :return: (tuple) (MASK1, MASK2) of the last SET_DATA_STREAMING command sent, (0, 0) if there was none
+        '''
+        return self.stream_settings()[:2]
+
+    def stream_settings(self):
+        '''
+        :return: (tuple) (MASK1, MASK2, samples per frame, seconds between samples) of the last
+            SET_DATA_STREAMING command sent, the arguments of StreamDecoder.update
+        '''
+        settings = (0, 0, 1, 0.0)
+        for (timestamp, packet) in self.commands():
+            if packet[2] == 0x02 and packet[3] == 0x11 and len(packet) >= 15:
+                mask2 = int.from_bytes(packet[15:19], 'big') if len(packet) >= 20 else 0
+                divisor = int.from_bytes(packet[6:8], 'big')
+                samples = max(1, int.from_bytes(packet[8:10], 'big'))
+                settings = (int.from_bytes(packet[10:14], 'big'), mask2, samples, divisor / 400.0)
+        return settings
+
+
+def split_commands(data):
+    '''
+    Split a TX chunk into command packets, a batch holds several
+    :return: (list of bytes) the packets, an incomplete tail is dropped
+    '''
+    packets = []
+    i = 0
+    while i + 6 <= len(data):
+        if data[i] != 0xff or data[i + 1] not in (0xfe, 0xff):
+            i += 1
+            continue
+        end = i + 6 + data[i + 5]
+        if end > len(data):
+            break
+        packets.append(bytes(data[i:end]))
+        i = end
+    return packets
+
+
+def replay(source, delegate, speed=1.0, on_tx=None):
+    '''
+    Feed the RX chunks of a wire log to a DelegateObj
+    :param source: (str or WireLog) the log
+    :param delegate: (DelegateObj) receives every RX chunk through handleNotification
+    :param speed: (float) 1.0 replays in real time, 10.0 ten times faster, None as fast as possible
+    :param on_tx: (function) called with every TX WireRecord, at its time
+    :return: (int) number of RX chunks delivered
+    '''
+    log = source if isinstance(source, WireLog) else WireLog(source)
+    handle_notification = delegate.handleNotification
+    delivered = 0
+    start = time.monotonic()
+    for record in log:
+        if speed:
+            delay = start + record.timestamp / speed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        if record.direction == RX:
+            handle_notification(record.handle, record.data)
+            delivered += 1
+        elif on_tx is not None:
+            on_tx(record)
+    return delivered